@@ -0,0 +1,132 @@
+import os
+import time
+import struct
+
+import numpy as np
+
+from utils import atomic_open
+
+# IVF index layout (little endian), exported next to the library:
+#   header    32 bytes: magic, version, n_lists, dim, count
+#   centroids n_lists * dim float32, unit length
+#   offsets   n_lists + 1 uint32; list i holds entries offsets[i]:offsets[i+1]
+#   strings   every track path in list order, as <u16 length><utf-8 bytes>
+# Paths are stored in the index itself because the JSON library has no
+# stable track order on the device.
+IVF_MAGIC = b"PPIV"
+IVF_VERSION = 1
+IVF_HEADER_FORMAT = "<4sHxxIII12x"
+
+# Rows per block when assigning vectors to centroids
+ASSIGN_CHUNK = 8192
+RECALL_K = 10
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms < 1e-9] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def assign(vectors, centroids):
+    """Index of the most similar centroid for every (unit length) vector."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[start:start + ASSIGN_CHUNK]
+        labels[start:start + ASSIGN_CHUNK] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, k: int, iters: int = 20, seed: int = 0):
+    """Lloyd's k-means on the unit sphere, i.e. clustering by cosine similarity."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    labels = None
+    for _ in range(iters):
+        new_labels = assign(vectors, centroids)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = np.bincount(labels, minlength=k) == 0
+        # Re-seed empty lists with random tracks so every list stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids, assign(vectors, centroids)
+
+
+def build_ivf(vectors, n_lists: int, seed: int = 0):
+    """Returns (centroids, offsets, order): order lists track indices grouped per list."""
+    vectors = normalize(vectors)
+    centroids, labels = spherical_kmeans(vectors, n_lists, seed=seed)
+    order = np.argsort(labels, kind='stable')
+    offsets = np.zeros(n_lists + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+    return centroids, offsets, order
+
+
+def search_ivf(query, vectors, centroids, offsets, order, n_probe: int, k: int):
+    """Top-k track indices for a unit query, scanning the n_probe closest lists."""
+    lists = np.argsort(centroids @ query)[::-1][:n_probe]
+    candidates = np.concatenate([order[offsets[i]:offsets[i + 1]] for i in lists])
+    scores = vectors[candidates] @ query
+    top = np.argsort(scores)[::-1][:k]
+    return candidates[top], len(candidates)
+
+
+def recall_report(vectors, centroids, offsets, order, n_queries: int = 200, seed: int = 0):
+    """
+    Compares IVF search against brute force for a range of n_probe values.
+    Queries are random tracks blended with noise, standing in for the
+    listener's taste vector on the device.
+    """
+    vectors = normalize(vectors)
+    rng = np.random.default_rng(seed)
+    n_lists = len(centroids)
+    k = min(RECALL_K, len(vectors))
+
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = normalize(vectors[picks] + 0.5 * normalize(rng.standard_normal(vectors[picks].shape)))
+    truth = np.argsort(queries @ vectors.T, axis=1)[:, ::-1][:, :k]
+
+    print(f"ANN recall@{k} vs brute force ({len(queries)} queries, {n_lists} lists):")
+    n_probe = 1
+    while True:
+        hits, scanned = 0, 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, truth):
+            found, n_scanned = search_ivf(query, vectors, centroids, offsets, order, n_probe, k)
+            hits += len(np.intersect1d(found, expected))
+            scanned += n_scanned
+        elapsed = (time.perf_counter() - start) / len(queries)
+        print(f"  n_probe={n_probe:<4} recall {hits / truth.size * 100:6.2f}%  "
+              f"scans {scanned / len(queries) / len(vectors) * 100:5.1f}% of tracks  "
+              f"{elapsed * 1e3:.2f} ms/query")
+        if n_probe >= n_lists:
+            break
+        n_probe = min(n_probe * 2, n_lists)
+
+
+def write_ivf(path: str, paths, centroids, offsets, order):
+    with atomic_open(path, 'wb') as f:
+        f.write(struct.pack(IVF_HEADER_FORMAT, IVF_MAGIC, IVF_VERSION,
+                            len(centroids), centroids.shape[1], len(order)))
+        f.write(centroids.astype('<f4').tobytes())
+        f.write(offsets.astype('<u4').tobytes())
+        for i in order:
+            encoded = paths[i].encode('utf-8')
+            f.write(struct.pack("<H", len(encoded)) + encoded)
+
+
+def export_ivf(path: str, paths, vectors, n_lists: int):
+    """Builds the IVF index for the exported vectors, checks its recall and writes it."""
+    n_lists = min(n_lists, len(paths))
+    if n_lists < 1:
+        return
+    print(f"Building ANN index with {n_lists} lists...")
+    centroids, offsets, order = build_ivf(vectors, n_lists)
+    recall_report(vectors, centroids, offsets, order)
+    write_ivf(path, paths, centroids, offsets, order)
+    print(f"Saved {path} ({os.path.getsize(path) / 1024:.1f} KiB)")
@@ -0,0 +1,241 @@
+import os
+import sys
+import copy
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+import soundfile as sf
+
+from statics import SAMPLE_RATE, DEFAULT_SEGMENT_POSITIONS, DEFAULT_SEGMENT_SECONDS
+from decoder import load_windows, decode_stream
+from embedders import get_backend
+from embedding_store import EmbeddingStore
+from journal import Journal, compact_into
+from library_export import write_library_json
+from json_stream import iter_entries
+
+# Benchmarks every stage of `pipod_manager.py process` on generated audio,
+# so runs on different machines and versions are comparable. Results are
+# appended to a JSON file; compare two of them to spot regressions.
+
+
+# --- FIXTURES ---
+
+def make_fixtures(out_dir, durations, rates, formats):
+    """Writes a sine + noise track for every duration / sample rate / format combination."""
+    rng = np.random.default_rng(0)
+    fixtures = []
+    for seconds in durations:
+        for sr in rates:
+            t = np.arange(int(seconds * sr)) / sr
+            audio = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))
+            stereo = np.stack([audio, audio[::-1]], axis=1).astype(np.float32)
+            for fmt in formats:
+                path = os.path.join(out_dir, f"fixture_{seconds}s_{sr}hz.{fmt}")
+                if not os.path.exists(path):
+                    sf.write(path, stereo, sr)
+                fixtures.append({"path": path, "seconds": seconds, "rate": sr, "format": fmt})
+    return fixtures
+
+
+def make_backend(name, engine, threads, work_dir):
+    """Backend with random weights when its checkpoint is missing; timing does not depend on them."""
+    backend_cls = get_backend(name)
+    checkpoint = getattr(backend_cls, 'checkpoint', None)
+    if checkpoint and not os.path.exists(checkpoint):
+        import torch
+        from pytorch import models
+        model = getattr(models, backend_cls.model_cls)(
+            sample_rate=SAMPLE_RATE, window_size=1024, hop_size=320, mel_bins=64,
+            fmin=50, fmax=14000, classes_num=527)
+        checkpoint = os.path.join(work_dir, f"random_{name}.pth")
+        torch.save({'model': model.state_dict()}, checkpoint)
+        backend_cls = type(backend_cls.__name__, (backend_cls,), {"checkpoint": checkpoint})
+    return backend_cls(engine=engine, threads=threads)
+
+
+# --- TIMING ---
+
+def best_of(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def record(results, stage, seconds, items, **params):
+    entry = {"stage": stage, "seconds": seconds, "items": items,
+             "per_item": seconds / max(items, 1), "items_per_s": items / max(seconds, 1e-12), **params}
+    results.append(entry)
+    detail = " ".join(f"{k}={v}" for k, v in params.items())
+    print(f"  {stage:<10} {detail:<45} {seconds * 1e3:10.1f} ms  ({entry['items_per_s']:.2f} items/s)")
+
+
+def bench_decode(results, fixtures, repeats):
+    """First-window decode versus the default segment sampling layout."""
+    print("Decode + resample:")
+    segments = (DEFAULT_SEGMENT_POSITIONS, DEFAULT_SEGMENT_SECONDS)
+    load_windows(fixtures[0]['path'])  # warm up librosa's resampler
+    for fx in fixtures:
+        for sampling, layout in (("head", None), ("segments", segments)):
+            seconds = best_of(lambda: load_windows(fx['path'], layout), repeats)
+            record(results, "decode", seconds, 1, format=fx['format'], rate=fx['rate'],
+                   duration=fx['seconds'], sampling=sampling)
+
+
+def bench_model(results, backend, clip_seconds, batch_sizes, repeats):
+    """Times the log-mel front end and the conv stack separately, per batch size."""
+    import torch
+    from cpu_engine import FusedEmbedder
+
+    if not hasattr(backend, 'model'):
+        print("Model stages: skipped, backend has no torch model")
+        return
+
+    model = copy.deepcopy(backend.model).cpu().eval()
+    stack = FusedEmbedder(model).eval()
+    print("Model stages (CPU):")
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            audio = torch.zeros(batch_size, clip_seconds * SAMPLE_RATE)
+            frontend = lambda: model.logmel_extractor(model.spectrogram_extractor(audio))
+            mel = frontend()
+
+            record(results, "frontend", best_of(frontend, repeats), batch_size, batch=batch_size)
+            record(results, "conv", best_of(lambda: stack.embed_mel(mel), repeats), batch_size, batch=batch_size)
+            record(results, "forward", best_of(lambda: backend.embed_batch(list(audio.numpy())), repeats),
+                   batch_size, batch=batch_size, engine=backend.engine, device=backend.device)
+
+
+def bench_storage(results, n_tracks, dim, work_dir, repeats):
+    """Journal + store compaction versus the JSON library export, for n_tracks vectors."""
+    print(f"Storage ({n_tracks} x {dim} vectors):")
+    rng = np.random.default_rng(0)
+    paths = [f"artist {i // 10}/{i % 10:02d} - track {i}.flac" for i in range(n_tracks)]
+    vectors = rng.random((n_tracks, dim), dtype=np.float32)
+
+    def store_write():
+        store_dir = tempfile.mkdtemp(dir=work_dir)
+        journal = Journal(os.path.join(store_dir, "bench.journal"))
+        for path, vec in zip(paths, vectors):
+            journal.append(path, "bench@1", vec)
+        compact_into(journal, EmbeddingStore(store_dir))
+        return store_dir
+
+    store_dir = store_write()
+    json_path = os.path.join(work_dir, "bench_library.json")
+    record(results, "store", best_of(store_write, repeats), n_tracks, op="journal+compact")
+    record(results, "store", best_of(lambda: EmbeddingStore(store_dir).matrix(), repeats),
+           n_tracks, op="open+read")
+    record(results, "json", best_of(lambda: write_library_json(json_path, "/", paths, vectors), repeats),
+           n_tracks, op="write")
+
+    def json_read():
+        for _ in iter_entries(json_path, "files"):
+            pass
+    record(results, "json", best_of(json_read, repeats), n_tracks, op="read")
+
+
+def bench_pipeline(results, backend, fixtures, batch_sizes, worker_counts):
+    """End to end: decode pipeline feeding batched inference, like `process`."""
+    print("End to end:")
+    paths = [fx['path'] for fx in fixtures]
+    for workers in worker_counts:
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            pending = []
+            for _, windows, _, error in decode_stream(paths, workers, 2 * max(batch_size, workers), with_meta=True):
+                if error is None:
+                    pending.extend(windows)
+                if len(pending) >= batch_size:
+                    backend.embed_batch(pending)
+                    pending = []
+            if pending:
+                backend.embed_batch(pending)
+            record(results, "pipeline", time.perf_counter() - start, len(paths),
+                   workers=workers, batch=batch_size)
+
+
+# --- MAIN ---
+
+def environment():
+    info = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    for module in ("torch", "librosa", "soundfile"):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            info[module] = None
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                        text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except FileNotFoundError:
+        info["commit"] = None
+    return info
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the desktop embedding pipeline.")
+    parser.add_argument("--out", default="benchmark_results.json", help="JSON file the results are appended to")
+    parser.add_argument("--fixtures", default=None, help="Directory for generated audio (default: temp dir)")
+    parser.add_argument("--durations", type=int_list, default=[30, 120, 300], help="Fixture lengths in seconds")
+    parser.add_argument("--rates", type=int_list, default=[44100, 48000], help="Fixture sample rates")
+    parser.add_argument("--model", default="cnn6", help="Embedding backend to benchmark")
+    parser.add_argument("--engine", choices=("auto", "eager", "fused"), default="auto")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op CPU threads")
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 2, 4, 8])
+    parser.add_argument("--workers", type=int_list, default=[0, 1, 2, 4], help="Decode worker counts")
+    parser.add_argument("--tracks", type=int, default=10000, help="Vectors used for the storage benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per measurement; the best is kept")
+    parser.add_argument("--stages", default="decode,model,storage,pipeline",
+                        help="Comma separated stages to run")
+    args = parser.parse_args()
+
+    stages = set(args.stages.split(","))
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        fixture_dir = args.fixtures or work_dir
+        os.makedirs(fixture_dir, exist_ok=True)
+        print(f"Generating fixtures in {fixture_dir}...")
+        fixtures = make_fixtures(fixture_dir, args.durations, args.rates, ("wav", "flac"))
+
+        if "decode" in stages:
+            bench_decode(results, fixtures, args.repeats)
+        if stages & {"model", "pipeline"}:
+            backend = make_backend(args.model, args.engine, args.threads, work_dir)
+            if "model" in stages:
+                bench_model(results, backend, 120, args.batch_sizes, args.repeats)
+            if "pipeline" in stages:
+                bench_pipeline(results, backend, fixtures, args.batch_sizes, args.workers)
+        if "storage" in stages:
+            bench_storage(results, args.tracks, 512, work_dir, args.repeats)
+
+    runs = []
+    if os.path.exists(args.out):
+        with open(args.out, 'r') as f:
+            runs = json.load(f)
+    runs.append({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(),
+                 "config": vars(args) | {"stages": sorted(stages)}, "results": results})
+    with open(args.out, 'w') as f:
+        json.dump(runs, f, indent=2)
+    print(f"\nSaved {len(results)} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import os
+import time
+import struct
+
+import numpy as np
+
+from statics import CLUSTER_STATE_FILE
+from utils import atomic_open
+from ann_index import normalize, assign
+from graph import vector_hashes
+
+# Mood cluster layout (little endian), exported next to the library:
+#   header    32 bytes: magic, version, k, dim, count
+#   centroids k * dim float32, unit length
+#   labels    count uint16 cluster ids, in string table order
+#   strings   every track path, as <u16 length><utf-8 bytes>
+# A genre jump or the first seed on the device then only compares the taste
+# vector against k centroids and picks among that cluster's tracks.
+CLUSTER_MAGIC = b"PPCL"
+CLUSTER_VERSION = 1
+CLUSTER_HEADER_FORMAT = "<4sHxxIII12x"
+
+CLUSTER_BATCH = 1024         # Tracks per mini-batch
+CLUSTER_ITERS = 100          # Mini-batches per full fit
+CLUSTER_INITS = 3            # Fits from different seeds, the best is kept
+CLUSTER_REFIT_FRACTION = 0.25  # Refit once this share of the library was assigned incrementally
+SILHOUETTE_SAMPLE = 2000     # Tracks the silhouette is computed over
+
+
+def minibatch_kmeans(units, k: int, batch: int = CLUSTER_BATCH, iters: int = CLUSTER_ITERS,
+                     inits: int = CLUSTER_INITS, seed: int = 0):
+    """
+    Mini-batch k-means on the unit sphere (Sculley, 2010): every batch moves
+    its centroids towards the assigned tracks with a per-centroid learning
+    rate of 1 / tracks seen, so a fit costs iters * batch rows, not epochs
+    over the whole library. Of `inits` runs from different k-means++ seeds
+    the one whose centroids fit a sample of tracks best is kept, as single
+    runs easily settle with two moods merged. Returns (centroids, labels).
+    """
+    rng = np.random.default_rng(seed)
+    sample = units[rng.choice(len(units), size=min(len(units), 4 * batch), replace=False)]
+    best, best_fit = None, -np.inf
+    for _ in range(inits):
+        centroids = kmeans_plus_plus(sample, k, rng)
+        seen = np.zeros(k, dtype=np.float64)
+        for _ in range(iters):
+            rows = units[rng.choice(len(units), size=min(batch, len(units)), replace=False)]
+            centroids, seen = step(centroids, seen, rows)
+        fit = (sample @ centroids.T).max(axis=1).mean()
+        if fit > best_fit:
+            best, best_fit = centroids, fit
+
+    centroids = best
+    labels = assign(units, centroids)
+    # A centroid that never won a track is re-seeded on the worst fitting one
+    for c in np.flatnonzero(np.bincount(labels, minlength=k) == 0):
+        worst = np.argmin(np.einsum('ij,ij->i', units, centroids[labels]))
+        centroids[c] = units[worst]
+        labels = assign(units, centroids)
+    return centroids, labels
+
+
+def kmeans_plus_plus(units, k: int, rng):
+    """
+    Greedy k-means++ seeding: every new centroid is the best of a few tracks
+    drawn by squared distance to the nearest centroid so far, which spreads
+    the seeds over the moods instead of doubling up on a big one.
+    """
+    tries = 2 + int(np.log(k))
+    centroids = np.empty((k, units.shape[1]), dtype=np.float32)
+    centroids[0] = units[rng.integers(len(units))]
+    distance = np.maximum(1.0 - units @ centroids[0], 0.0) ** 2
+    for c in range(1, k):
+        total = distance.sum()
+        if total <= 0:
+            centroids[c] = units[rng.integers(len(units))]
+            continue
+        picks = rng.choice(len(units), size=tries, p=distance / total)
+        options = np.minimum(distance, np.maximum(1.0 - units[picks] @ units.T, 0.0) ** 2)
+        best = np.argmin(options.sum(axis=1))
+        centroids[c], distance = units[picks[best]], options[best]
+    return centroids
+
+
+def step(centroids, seen, rows):
+    """Moves the centroids to the running mean of every track assigned to them so far."""
+    labels = assign(rows, centroids)
+    onehot = np.zeros((len(rows), len(centroids)), dtype=np.float32)
+    onehot[np.arange(len(rows)), labels] = 1
+    sums = onehot.T @ rows
+    added = np.bincount(labels, minlength=len(centroids))
+    moved = added > 0
+    seen = seen + added
+    updated = centroids.astype(np.float64)
+    updated[moved] += (sums[moved] - added[moved, None] * updated[moved]) / seen[moved, None]
+    return normalize(updated), seen
+
+
+def silhouette(units, labels, sample: int = SILHOUETTE_SAMPLE, seed: int = 0):
+    """Mean silhouette with cosine distance over a random sample of tracks (-1 .. 1, higher is better)."""
+    rng = np.random.default_rng(seed)
+    if len(units) > sample:
+        rows = rng.choice(len(units), size=sample, replace=False)
+        units, labels = units[rows], labels[rows]
+    k = int(labels.max()) + 1
+    if k < 2:
+        return 0.0
+    distances = 1.0 - units @ units.T
+    onehot = np.zeros((len(units), k), dtype=np.float32)
+    onehot[np.arange(len(units)), labels] = 1
+    sizes = onehot.sum(axis=0)
+    totals = distances @ onehot  # summed distance of every track to every cluster
+    own_size = sizes[labels] - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = totals[np.arange(len(units)), labels] / own_size
+        means = totals / sizes
+        means[np.arange(len(units)), labels] = np.inf
+        means[:, sizes == 0] = np.inf
+        b = means.min(axis=1)
+        # Tracks alone in their cluster score 0 by convention
+        scores = np.where(own_size > 0, (b - a) / np.maximum(a, b), 0.0)
+    return float(np.nan_to_num(scores).mean())
+
+
+def size_summary(labels, k: int):
+    sizes = np.bincount(labels, minlength=k)
+    return f"sizes min {sizes.min()}, median {int(np.median(sizes))}, max {sizes.max()}"
+
+
+def cluster_report(units, k: int, chosen):
+    """Silhouette and cluster sizes for k and its neighbours, to help choosing --clusters."""
+    print(f"Cluster quality (silhouette over {min(len(units), SILHOUETTE_SAMPLE)} tracks, higher is better):")
+    for candidate in sorted(c for c in {k // 2, k, k * 2} if 2 <= c < len(units) or c == k):
+        labels = chosen if candidate == k else minibatch_kmeans(units, candidate)[1]
+        marker = "  <- --clusters" if candidate == k else ""
+        print(f"  k={candidate:<4} silhouette {silhouette(units, labels):6.3f}  "
+              f"{size_summary(labels, candidate)}{marker}")
+    sizes = np.bincount(chosen, minlength=k)
+    order = np.argsort(sizes)
+    print(f"  Smallest clusters: {', '.join(f'#{c} ({sizes[c]})' for c in order[:3])}; "
+          f"largest: {', '.join(f'#{c} ({sizes[c]})' for c in order[::-1][:3])}")
+
+
+def load_cluster_state(root: str):
+    path = os.path.join(root, CLUSTER_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    data = np.load(path, allow_pickle=False)
+    return {key: data[key] for key in data.files}
+
+
+def save_cluster_state(state, root: str):
+    with atomic_open(os.path.join(root, CLUSTER_STATE_FILE), 'wb') as f:
+        np.savez(f, **state)
+
+
+def update_clusters(previous, paths, vectors, k: int, refit: bool = False):
+    """
+    Returns (state, refitted). Tracks that are new or changed since the last
+    run nudge the centroid they are assigned to, as one more mini-batch; the
+    clusters are only fitted from scratch without a usable previous state,
+    with `refit`, or once the incrementally assigned tracks reach
+    CLUSTER_REFIT_FRACTION of the tracks the last fit saw.
+    """
+    units = normalize(np.asarray(vectors, dtype=np.float32))
+    hashes = vector_hashes(vectors)
+    k = min(k, len(paths))
+
+    usable = (previous is not None and not refit and int(previous['k']) == k
+              and int(previous['dim']) == units.shape[1])
+    if usable:
+        known = dict(zip(previous['paths'].tolist(), previous['hashes'].tolist()))
+        new = np.array([known.get(p) != h for p, h in zip(paths, hashes.tolist())], dtype=bool)
+        updated = int(previous['updated']) + int(new.sum())
+        usable = updated <= CLUSTER_REFIT_FRACTION * int(previous['n_fit'])
+
+    if usable:
+        centroids, seen = previous['centroids'], previous['seen']
+        if new.any():
+            centroids, seen = step(centroids, seen, units[new])
+        labels = assign(units, centroids)
+        n_fit = int(previous['n_fit'])
+    else:
+        centroids, labels = minibatch_kmeans(units, k)
+        seen = np.bincount(labels, minlength=k).astype(np.float64)
+        n_fit, updated = len(paths), 0
+
+    state = {"paths": np.array(paths), "hashes": hashes, "centroids": centroids, "seen": seen,
+             "labels": labels, "k": np.int64(k), "dim": np.int64(units.shape[1]),
+             "n_fit": np.int64(n_fit), "updated": np.int64(updated)}
+    return state, not usable
+
+
+def write_clusters(path: str, state):
+    centroids = state['centroids']
+    with atomic_open(path, 'wb') as f:
+        f.write(struct.pack(CLUSTER_HEADER_FORMAT, CLUSTER_MAGIC, CLUSTER_VERSION,
+                            centroids.shape[0], centroids.shape[1], len(state['labels'])))
+        f.write(centroids.astype('<f4').tobytes())
+        f.write(state['labels'].astype('<u2').tobytes())
+        for p in state['paths'].tolist():
+            encoded = p.encode('utf-8')
+            f.write(struct.pack("<H", len(encoded)) + encoded)
+
+
+def export_clusters(root: str, path: str, paths, vectors, k: int, refit: bool = False):
+    """Assigns the exported tracks to mood clusters (refitting when due) and writes them next to the library."""
+    if len(paths) < 2:
+        return
+    start = time.perf_counter()
+    state, refitted = update_clusters(load_cluster_state(root), paths, vectors, k, refit)
+    k = int(state['k'])
+    if refitted:
+        print(f"Fitted {k} clusters on {len(paths)} tracks.")
+        cluster_report(normalize(np.asarray(vectors, dtype=np.float32)), k, state['labels'])
+    else:
+        print(f"Assigned tracks to the existing {k} clusters ({int(state['updated'])} new or changed since "
+              f"the last fit, refit after {int(CLUSTER_REFIT_FRACTION * int(state['n_fit']))}).")
+    save_cluster_state(state, root)
+    write_clusters(path, state)
+    print(f"Saved {path} ({size_summary(state['labels'], k)}, {time.perf_counter() - start:.1f}s, "
+          f"{os.path.getsize(path) / 1024:.1f} KiB)")
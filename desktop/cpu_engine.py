@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from statics import SAMPLE_RATE
+from utils import atomic_open
+
+# Embeddings of the fused model may differ from the eager model by float
+# rounding only; anything above this is a bug in the folding.
+PARITY_TOLERANCE = 1e-3
+PARITY_SECONDS = 5
+
+
+def bn_affine(bn):
+    """The (scale, shift) an eval-mode BatchNorm applies per channel."""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    return scale.detach(), shift.detach()
+
+
+def fold_conv_bn(conv, bn):
+    """Returns a conv computing bn(conv(x)) in one op."""
+    scale, shift = bn_affine(bn)
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                      stride=conv.stride, padding=conv.padding, bias=True)
+    fused.weight.data = conv.weight.detach() * scale[:, None, None, None]
+    bias = conv.bias.detach() if conv.bias is not None else torch.zeros_like(shift)
+    fused.bias.data = bias * scale + shift
+    return fused
+
+
+class FusedEmbedder(nn.Module):
+    """
+    Inference-only rewrite of Cnn6 / Cnn10 that returns just the embedding.
+
+    The BatchNorms of every conv block are folded into their convolutions
+    and the spec augmenter, dropout and fc_audioset head are dropped. bn0
+    normalizes mel bins rather than conv channels, and the zero padding of
+    the first conv keeps it from folding exactly, so it stays a single fused
+    multiply-add on the log-mel features instead of two transposes and a
+    BatchNorm.
+    """
+
+    def __init__(self, eager):
+        super(FusedEmbedder, self).__init__()
+        self.spectrogram_extractor = eager.spectrogram_extractor
+        self.logmel_extractor = eager.logmel_extractor
+
+        scale, shift = bn_affine(eager.bn0)
+        self.register_buffer('bn0_scale', scale.view(1, 1, 1, -1))
+        self.register_buffer('bn0_shift', shift.view(1, 1, 1, -1))
+
+        convs = []
+        for block in (eager.conv_block1, eager.conv_block2, eager.conv_block3, eager.conv_block4):
+            layers = [fold_conv_bn(block.conv1, block.bn1), nn.ReLU(inplace=True)]
+            if hasattr(block, 'conv2'):
+                layers += [fold_conv_bn(block.conv2, block.bn2), nn.ReLU(inplace=True)]
+            layers.append(nn.AvgPool2d(kernel_size=(2, 2)))
+            convs.append(nn.Sequential(*layers))
+        self.convs = nn.Sequential(*convs)
+        self.fc1 = eager.fc1
+
+    def forward(self, input):
+        x = self.spectrogram_extractor(input)   # (batch_size, 1, time_steps, freq_bins)
+        x = self.logmel_extractor(x)    # (batch_size, 1, time_steps, mel_bins)
+        return self.embed_mel(x)
+
+    def embed_mel(self, x):
+        """Embeds log-mel features of shape (batch_size, 1, time_steps, mel_bins)."""
+        x = torch.addcmul(self.bn0_shift, x, self.bn0_scale)
+        x = self.convs(x)
+        x = torch.mean(x, dim=3)
+
+        (x1, _) = torch.max(x, dim=2)
+        x2 = torch.mean(x, dim=2)
+        return F.relu_(self.fc1(x1 + x2))
+
+
+def set_threads(threads):
+    if threads:
+        torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+
+def check_parity(eager, engine, seconds: int = PARITY_SECONDS):
+    """
+    Runs eager and fused models on the same noise batch, at two lengths to
+    make sure the traced graph is not tied to its example input, and raises
+    if their embeddings disagree. The log-mel entry point used with the mel
+    cache is checked as well. Returns the largest absolute difference.
+    """
+    rng = np.random.default_rng(0)
+    max_diff = 0.0
+    with torch.inference_mode():
+        for length in (seconds * SAMPLE_RATE, seconds * SAMPLE_RATE // 2 + 123):
+            audio = torch.from_numpy(rng.uniform(-0.5, 0.5, (2, length)).astype(np.float32))
+            expected = eager(audio)['embedding']
+            mel = eager.logmel_extractor(eager.spectrogram_extractor(audio))
+            for actual in (engine(audio), engine.embed_mel(mel)):
+                max_diff = max(max_diff, float((expected - actual).abs().max()))
+
+    if max_diff > PARITY_TOLERANCE:
+        raise RuntimeError(f"Fused CPU model diverges from the eager model (max diff {max_diff:.2e})")
+    return max_diff
+
+
+def build_cpu_engine(eager, threads=None):
+    """Folds, traces and freezes an eager Cnn6 / Cnn10 for CPU inference."""
+    set_threads(threads)
+    eager = eager.cpu().eval()
+    fused = FusedEmbedder(eager).eval()
+
+    example = torch.zeros(1, PARITY_SECONDS * SAMPLE_RATE)
+    with torch.inference_mode():
+        mel_example = fused.logmel_extractor(fused.spectrogram_extractor(example))
+        traced = torch.jit.trace_module(fused, {"forward": example, "embed_mel": mel_example})
+        return torch.jit.freeze(traced, preserved_attrs=["embed_mel"])
+
+
+def load_cpu_engine(eager, checkpoint: str, threads=None):
+    """
+    The CPU engine for the model loaded from `checkpoint`. Tracing takes
+    seconds, so the engine is saved next to the checkpoint as TorchScript
+    (<checkpoint>.cpu.pt) and loaded from there while it is newer than both
+    the checkpoint and this file. Eager / fused parity is covered by
+    tests/test_cpu_engine.py.
+    """
+    path = os.path.splitext(checkpoint)[0] + ".cpu.pt"
+    n_threads = set_threads(threads)
+    sources = max(os.path.getmtime(checkpoint), os.path.getmtime(__file__))
+    if os.path.exists(path) and os.path.getmtime(path) > sources:
+        try:
+            engine = torch.jit.load(path, map_location='cpu')
+            print(f"CPU engine loaded from {path} ({n_threads} threads)")
+            return engine
+        except (RuntimeError, OSError) as e:
+            print(f"Note: cannot load {path} ({e}), tracing the model again.")
+
+    engine = build_cpu_engine(eager, threads)
+    with atomic_open(path, 'wb') as f:
+        torch.jit.save(engine, f)
+    print(f"CPU engine traced ({n_threads} threads) and saved to {path}")
+    return engine
@@ -0,0 +1,133 @@
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import librosa
+
+from statics import SAMPLE_RATE, CLIP_DURATION
+from track_meta import measure
+
+# Kept free of torch so decode workers start quickly and stay small.
+
+
+def load_clip(path: str):
+    """Decodes up to CLIP_DURATION seconds of mono audio at SAMPLE_RATE."""
+    audio, _ = librosa.load(path, sr=SAMPLE_RATE, duration=CLIP_DURATION, mono=True)
+    return audio
+
+
+def load_windows(path: str, layout=None):
+    """
+    Decodes the windows a track is embedded from. With layout=None that is
+    the first CLIP_DURATION seconds; with a (positions, seconds) layout (see
+    sampling.py) it is one window of `seconds` centred on each position, in
+    percent of the track, so only those parts are read and resampled.
+    Tracks too short to hold every window are decoded whole.
+    """
+    if layout is None:
+        return [load_clip(path)]
+
+    positions, seconds = layout
+    duration = librosa.get_duration(path=path)
+    if duration < len(positions) * seconds:
+        return [load_clip(path)]
+
+    windows = []
+    for position in positions:
+        offset = min(max(duration * position / 100 - seconds / 2, 0), duration - seconds)
+        audio, _ = librosa.load(path, sr=SAMPLE_RATE, offset=offset, duration=seconds, mono=True)
+        windows.append(audio)
+    # Decoders may return a sample less near the end of a file
+    length = min(len(w) for w in windows)
+    return [w[:length] for w in windows]
+
+
+def track_duration(path: str, windows):
+    """Length of the track; free when the single decoded window turned out to be all of it."""
+    if len(windows) == 1 and len(windows[0]) < CLIP_DURATION * SAMPLE_RATE:
+        return len(windows[0]) / SAMPLE_RATE
+    return librosa.get_duration(path=path)
+
+
+def decode_one(path: str, layout=None, with_meta: bool = False):
+    """
+    Decodes a single file and never raises. With with_meta=True the
+    track's gain, duration and tempo are measured on the decoded windows.
+    Returns (path, windows, meta, error) where meta is None unless measured
+    and error is a (reason, traceback) pair or None.
+    """
+    try:
+        windows = load_windows(path, layout)
+    except Exception as e:
+        return path, None, None, (str(e), traceback.format_exc())
+
+    meta = None
+    if with_meta:
+        try:
+            meta = measure(windows, SAMPLE_RATE, track_duration(path, windows))
+        except Exception:
+            pass  # The metadata is optional, the embedding is not
+    return path, windows, meta, None
+
+
+def decode_isolated(path: str, layout=None, with_meta: bool = False):
+    """decode_one in a fresh single-worker pool, so a crash can only be this file's."""
+    with ProcessPoolExecutor(max_workers=1) as solo:
+        try:
+            return solo.submit(decode_one, path, layout, with_meta).result()
+        except BrokenProcessPool as e:
+            return (path, None, None, (f"Decoder process crashed: {e}", ""))
+
+
+def decode_stream(paths, workers: int, prefetch: int, layout=None, with_meta: bool = False):
+    """
+    Yields decode_one's (path, windows, meta, error) for every path, in input order.
+
+    With workers > 0 the files are decoded by a process pool while the
+    caller consumes results. At most `prefetch` files are queued or held
+    decoded at any time, so memory stays bounded however large the library.
+    A worker that dies (e.g. a decoder segfault) breaks every file in
+    flight, so those are decoded again one at a time in a pool of their
+    own: only a file that crashes a fresh pool by itself is failed. The
+    pool is then restarted for the remaining files.
+    """
+    if workers <= 0:
+        for path in paths:
+            yield decode_one(path, layout, with_meta)
+        return
+
+    remaining = iter(paths)
+    in_flight = deque()
+    pool = ProcessPoolExecutor(max_workers=workers)
+
+    def top_up():
+        while len(in_flight) < prefetch:
+            nxt = next(remaining, None)
+            if nxt is None:
+                return
+            in_flight.append((nxt, pool.submit(decode_one, nxt, layout, with_meta)))
+
+    try:
+        top_up()
+        while in_flight:
+            path, future = in_flight[0]
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                suspects = [p for p, _ in in_flight]
+                in_flight.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                for suspect in suspects:
+                    yield decode_isolated(suspect, layout, with_meta)
+                pool = ProcessPoolExecutor(max_workers=workers)
+                top_up()
+                continue
+
+            # Top up the queue before handing the result over so decoding
+            # keeps running while the caller does inference.
+            in_flight.popleft()
+            top_up()
+            yield result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
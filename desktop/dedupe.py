@@ -0,0 +1,177 @@
+import os
+import re
+import json
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from statics import DUPLICATES_FILE
+from utils import atomic_write_json
+from ann_index import normalize
+
+# Rows per block of the similarity matrix; a block pair is a BLOCK x BLOCK
+# float32 product (64 MiB), whatever the size of the library
+SIM_BLOCK = 4096
+# Preferred copy of a duplicate cluster, best first
+FORMAT_RANK = ('.flac', '.wav', '.m4a', '.mp3')
+
+
+def similar_pairs(store, paths, threshold: float, block: int = SIM_BLOCK):
+    """
+    Returns (i, j, similarity) arrays for every pair of tracks with cosine
+    similarity >= threshold, i < j. Blocks are read from the memory-mapped
+    store as needed, so only two of them are in memory at a time.
+    """
+    found_i, found_j, found_s = [], [], []
+    n = len(paths)
+    for i0 in range(0, n, block):
+        a = normalize(store.matrix(paths[i0:i0 + block])[1])
+        for j0 in range(i0, n, block):
+            b = a if j0 == i0 else normalize(store.matrix(paths[j0:j0 + block])[1])
+            sims = a @ b.T
+            if j0 == i0:
+                sims = np.triu(sims, 1)  # each pair once, no self matches
+            ii, jj = np.nonzero(sims >= threshold)
+            found_i.append(ii + i0)
+            found_j.append(jj + j0)
+            found_s.append(sims[ii, jj])
+    if not found_i:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_s)
+
+
+def title_key(rel_path: str):
+    """Filename reduced to its title: no track number, bracketed extras, case or punctuation."""
+    name = os.path.splitext(os.path.basename(rel_path))[0].lower()
+    name = re.sub(r"^\d{1,3}\s*[-._)]?\s*", "", name)
+    name = re.sub(r"[\(\[].*?[\)\]]", " ", name)
+    return " ".join(re.sub(r"[^\w\s]", " ", name).split())
+
+
+def header_duration(full_path: str):
+    """Duration read from the file header, for tracks analyzed before durations were stored."""
+    import librosa
+    try:
+        return librosa.get_duration(path=full_path)
+    except Exception:
+        return None
+
+
+class UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        self.parent[self.find(a)] = self.find(b)
+
+
+def pick_keeper(root: str, members):
+    """Lossless over lossy, then the biggest file, then the shortest path."""
+    def rank(rel_path):
+        ext = os.path.splitext(rel_path)[1].lower()
+        fmt = FORMAT_RANK.index(ext) if ext in FORMAT_RANK else len(FORMAT_RANK)
+        try:
+            size = os.path.getsize(os.path.join(root, rel_path))
+        except OSError:
+            size = 0
+        return fmt, -size, len(rel_path), rel_path
+    return min(members, key=rank)
+
+
+def find_duplicates(root: str, store, threshold: float, strict: float,
+                    max_duration_diff: float, name_similarity: float, block: int = SIM_BLOCK):
+    """
+    Clusters tracks whose vectors are at least `threshold` similar, whose
+    durations differ by at most `max_duration_diff` seconds and whose titles
+    look alike; above `strict` similarity the titles are not compared, which
+    catches copies with unhelpful names. Returns a list of clusters.
+    """
+    paths = sorted(store.paths())
+    ii, jj, sims = similar_pairs(store, paths, threshold, block)
+    print(f"Found {len(sims)} candidate pairs above {threshold} similarity.")
+
+    durations = {}
+
+    def duration(i):
+        if i not in durations:
+            meta = store.meta_of(paths[i])
+            if meta is not None and meta.get('duration') is not None:
+                durations[i] = meta['duration']
+            else:
+                durations[i] = header_duration(os.path.join(root, paths[i]))
+        return durations[i]
+
+    uf = UnionFind(len(paths))
+    best = {}  # accepted pairs
+    for i, j, sim in zip(ii.tolist(), jj.tolist(), sims.tolist()):
+        if sim < strict:
+            ratio = SequenceMatcher(None, title_key(paths[i]), title_key(paths[j])).ratio()
+            if ratio < name_similarity:
+                continue
+        di, dj = duration(i), duration(j)
+        if di is not None and dj is not None and abs(di - dj) > max_duration_diff:
+            continue
+        uf.union(i, j)
+        best[(i, j)] = sim
+
+    groups, min_sim = {}, {}
+    for (i, j), sim in best.items():
+        cluster = uf.find(i)
+        groups.setdefault(cluster, set()).update((i, j))
+        min_sim[cluster] = min(min_sim.get(cluster, 1.0), sim)
+
+    clusters = []
+    for cluster, members in groups.items():
+        members = sorted(paths[m] for m in members)
+        keep = pick_keeper(root, members)
+        clusters.append({"keep": keep, "drop": [m for m in members if m != keep],
+                         "min_similarity": round(min_sim[cluster], 4)})
+    clusters.sort(key=lambda c: c['keep'])
+    return clusters
+
+
+def report_duplicates(clusters):
+    for cluster in clusters:
+        print(f"\nKEEP: {cluster['keep']}  (similarity >= {cluster['min_similarity']})")
+        for rel_path in cluster['drop']:
+            print(f"DROP: {rel_path}")
+    n_drop = sum(len(c['drop']) for c in clusters)
+    print(f"\n{len(clusters)} duplicate clusters, {n_drop} redundant copies.")
+
+
+def save_duplicates(root: str, clusters, exclude: bool):
+    """Saves the report; with exclude=True the redundant copies are left out of the next export."""
+    excluded = sorted(p for c in clusters for p in c['drop']) if exclude else []
+    atomic_write_json({"clusters": clusters, "excluded": excluded},
+                      os.path.join(root, DUPLICATES_FILE), indent=2)
+    return excluded
+
+
+def load_excluded(root: str, present):
+    """
+    Copies to leave out of the export, among the `present` paths. A copy is
+    only dropped while another copy of its cluster is still exported: when
+    the kept file was deleted or renamed, the best remaining copy takes its
+    place, so the song never disappears from the library.
+    """
+    path = os.path.join(root, DUPLICATES_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        report = json.load(f)
+    marked = set(report['excluded'])
+    excluded = set()
+    for cluster in report['clusters']:
+        drops = [p for p in cluster['drop'] if p in marked and p in present]
+        if not drops:
+            continue
+        if cluster['keep'] not in present:
+            drops.remove(pick_keeper(root, drops))
+        excluded.update(drops)
+    return excluded
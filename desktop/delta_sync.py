@@ -0,0 +1,257 @@
+import os
+import json
+import shlex
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from collections import namedtuple
+
+from statics import LIBRARY_FILE, SYNCED_EXPORTS
+from manifest import load_manifest, describe
+from discovery import discover
+from json_stream import iter_entries
+import sync_apply
+from sync_apply import STATE_FILE, STAGING_DIR, PATCH_FILE
+
+# Sync state, kept on the device in STATE_FILE and rebuilt locally on
+# every run:
+#   files    {path: fingerprint} of every audio file pushed, embedded or not
+#   library  {"dir": ..., "vectors": {path: hash}} of the pushed library.json
+#   exports  {name: hash} of the export files pushed whole
+# Comparing the two tells which audio files to send, which the device can
+# move or delete itself, and which library entries changed. A device without
+# a pushed library gets library.json whole, like the other exports.
+
+# upload:   audio paths to send
+# moved:    {old_path: new_path} for audio the device already has elsewhere
+# deleted:  audio paths to remove from the device
+# lib_add / lib_update / lib_remove: library.json entries to patch
+# exports:  export files to replace whole
+SyncPlan = namedtuple("SyncPlan", ["upload", "moved", "deleted", "lib_add", "lib_update", "lib_remove", "exports"])
+
+HASH_CHUNK = 1024 * 1024
+# Shipped with every patch so the device can stream library.json too
+DEVICE_MODULES = ("utils.py", "json_stream.py")
+
+
+def file_hash(path: str):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def vector_hash(vec, meta=None):
+    """Hash of a library entry: its vector, plus the track metadata when there is any."""
+    value = vec if meta is None else [vec, meta]
+    return hashlib.blake2b(json.dumps(value).encode(), digest_size=8).hexdigest()
+
+
+def local_state(root: str):
+    """
+    The sync state of the local music folder. Every audio file on disk is
+    synced, including the ones 'process' skipped or has not reached yet;
+    fingerprints are taken from the manifest while size and mtime match.
+    """
+    manifest = load_manifest(root)
+    files = {}
+    for rel_path, stat in discover(root):
+        files[rel_path] = describe(os.path.join(root, rel_path), manifest.get(rel_path), stat)['fp']
+    state = {"files": files, "library": None, "exports": {}}
+
+    library_path = os.path.join(root, LIBRARY_FILE)
+    if os.path.exists(library_path):
+        # "dir" and "meta" come before "files", so the header is read by the first entry
+        header = {}
+        vectors = {p: vector_hash(v, header.get('meta', {}).get(p))
+                   for p, v in iter_entries(library_path, "files", header)}
+        state['library'] = {"dir": header['dir'], "vectors": vectors}
+
+    for name in SYNCED_EXPORTS:
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            state['exports'][name] = file_hash(path)
+    return state
+
+
+def plan_sync(local, remote):
+    """Compares the local state with the state last pushed to the device (None on a first sync)."""
+    remote = remote or {"files": {}, "library": None, "exports": {}}
+    local_files, remote_files = local['files'], remote['files']
+
+    added = [p for p, fp in local_files.items() if remote_files.get(p) != fp]
+    gone = [p for p in remote_files if p not in local_files]
+
+    # A file that is gone from one path and new at another with the same
+    # fingerprint was moved; the device can rename its copy instead of
+    # receiving it again. Move sources are gone locally, so no upload can
+    # land on a file that still has to be moved.
+    by_fp = {}
+    for p in gone:
+        by_fp.setdefault(remote_files[p], []).append(p)
+    upload, moved = [], {}
+    for p in added:
+        candidates = by_fp.get(local_files[p])
+        if p not in remote_files and candidates:
+            moved[candidates.pop()] = p
+        else:
+            upload.append(p)
+    deleted = [p for p in gone if p not in moved]
+
+    lib_add, lib_update, lib_remove = [], [], []
+    exports = [name for name, h in local['exports'].items() if remote['exports'].get(name) != h]
+    if local['library'] is not None and remote['library'] is None:
+        exports.append(LIBRARY_FILE)
+    elif local['library'] is not None:
+        local_vecs = local['library']['vectors']
+        remote_vecs = remote['library']['vectors'] if remote['library'] else {}
+        for p, h in local_vecs.items():
+            if p not in remote_vecs:
+                lib_add.append(p)
+            elif remote_vecs[p] != h:
+                lib_update.append(p)
+        lib_remove = [p for p in remote_vecs if p not in local_vecs]
+        if local['library']['dir'] != remote['library']['dir']:
+            exports.append(LIBRARY_FILE)
+            lib_add, lib_update, lib_remove = [], [], []
+    return SyncPlan(sorted(upload), moved, sorted(deleted), lib_add, lib_update, lib_remove, exports)
+
+
+def build_patch(root: str, plan, local):
+    patch = {"moves": plan.moved, "deletes": plan.deleted, "library": None,
+             "exports": plan.exports, "state": local}
+    if plan.lib_add or plan.lib_update or plan.lib_remove:
+        add, update = set(plan.lib_add), set(plan.lib_update)
+        patch['library'] = {"dir": local['library']['dir'], "add": {}, "update": {}, "remove": plan.lib_remove,
+                            "meta": {}}
+        header = {}
+        for p, vec in iter_entries(os.path.join(root, LIBRARY_FILE), "files", header):
+            if p in add:
+                patch['library']['add'][p] = vec
+            elif p in update:
+                patch['library']['update'][p] = vec
+            else:
+                continue
+            if p in header.get('meta', {}):
+                patch['library']['meta'][p] = header['meta'][p]
+    return patch
+
+
+def report_sync_plan(plan, first_sync: bool):
+    if first_sync:
+        print("No sync state on the device, sending everything that differs.")
+    print(f"Audio: {len(plan.upload)} to send, {len(plan.moved)} moved, {len(plan.deleted)} deleted")
+    print(f"Library: {len(plan.lib_add)} added, {len(plan.lib_update)} updated, {len(plan.lib_remove)} removed")
+    if plan.exports:
+        print(f"Exports: {', '.join(plan.exports)}")
+
+
+# --- TRANSPORTS ---
+
+class LocalTransport:
+    """A directory standing in for the device, e.g. a mounted SD card."""
+    commands = ()
+
+    def __init__(self, dest: str):
+        self.dest = dest
+
+    def read_state(self):
+        path = os.path.join(self.dest, STATE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def upload(self, root: str, rel_paths):
+        for rel_path in rel_paths:
+            src, dst = os.path.join(root, rel_path), os.path.join(self.dest, rel_path)
+            try:
+                src_stat = os.stat(src)
+            except FileNotFoundError:
+                print(f"Warning: {rel_path} was removed before it was sent, skipping it.")
+                continue
+            # Same quick check as rsync: equal size and mtime means equal file
+            if os.path.exists(dst):
+                dst_stat = os.stat(dst)
+                if (dst_stat.st_size, int(dst_stat.st_mtime)) == (src_stat.st_size, int(src_stat.st_mtime)):
+                    continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(src, dst + ".tmp")
+            os.replace(dst + ".tmp", dst)
+
+    def upload_staging(self, staging: str):
+        target = os.path.join(self.dest, STAGING_DIR)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(staging, target)
+
+    def apply(self):
+        sync_apply.apply_patch(self.dest)
+
+
+class SshTransport:
+    """The Pi over ssh; audio is sent with rsync, the patch is applied by sync_apply.py."""
+    commands = ("ssh", "rsync")  # Executables the transport runs
+
+    def __init__(self, user: str, ip: str, dest: str):
+        self.host = f"{user}@{ip}"
+        self.dest = dest.rstrip('/')
+
+    def ssh(self, command, **kwargs):
+        return subprocess.run(["ssh", self.host, command], **kwargs)
+
+    def read_state(self):
+        # A missing state file is a first sync; a failing ssh raises
+        path = shlex.quote(self.dest + '/' + STATE_FILE)
+        result = self.ssh(f"cat {path} 2>/dev/null || true", capture_output=True, text=True, check=True)
+        return json.loads(result.stdout) if result.stdout.strip() else None
+
+    def upload(self, root: str, rel_paths):
+        if not rel_paths:
+            return
+        # --files-from only looks at the listed files, not the whole library;
+        # files removed since the state was taken are skipped
+        src = root if root.endswith('/') else root + '/'
+        subprocess.run(["rsync", "-a", "--from0", "--ignore-missing-args", "--files-from=-", src,
+                        f"{self.host}:{self.dest}/"],
+                       input="\0".join(rel_paths).encode('utf-8'), check=True)
+
+    def upload_staging(self, staging: str):
+        subprocess.run(["rsync", "-a", "--delete", staging + '/', f"{self.host}:{self.dest}/{STAGING_DIR}/"],
+                       check=True)
+
+    def apply(self):
+        with open(sync_apply.__file__, 'rb') as f:
+            source = f.read()
+        self.ssh(f"python3 - {shlex.quote(self.dest)}", input=source, check=True)
+
+
+def delta_sync(root: str, transport, dry_run: bool = False):
+    """Plans the sync against the device state, sends the difference and applies the patch there."""
+    local = local_state(root)
+
+    remote = transport.read_state()
+    plan = plan_sync(local, remote)
+    report_sync_plan(plan, remote is None)
+    if dry_run:
+        return plan
+    if remote is not None and not any(plan):
+        print("The device is up to date.")
+        return plan
+
+    print(f"Sending {len(plan.upload)} audio files...")
+    transport.upload(root, plan.upload)
+
+    with tempfile.TemporaryDirectory() as staging:
+        with open(os.path.join(staging, PATCH_FILE), 'w') as f:
+            json.dump(build_patch(root, plan, local), f)
+        for name in plan.exports:
+            shutil.copy2(os.path.join(root, name), os.path.join(staging, name))
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in DEVICE_MODULES:
+            shutil.copy2(os.path.join(here, name), os.path.join(staging, name))
+        transport.upload_staging(staging)
+
+    transport.apply()
+    return plan
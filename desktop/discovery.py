@@ -0,0 +1,91 @@
+import os
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from statics import SUPPORTED_EXTS, DIR_CACHE_FILE
+from utils import atomic_write_json
+
+# The part of os.stat_result the manifest needs; cached listings hand these out
+FileStat = namedtuple("FileStat", ["st_size", "st_mtime_ns"])
+
+
+def load_dir_cache(root: str):
+    path = os.path.join(root, DIR_CACHE_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def scan_dir(root: str, rel_dir: str, cached):
+    """
+    Lists one directory. When its mtime matches the cached listing, the
+    directory is not read again: files only come and go by changing the
+    mtime of the directory holding them. Rewriting a file in place does not,
+    so the cached files are still stat'ed, one stat each.
+    Returns (rel_dir, listing) with listing = {"mtime", "files", "dirs"},
+    or None when the directory no longer exists.
+    """
+    full_dir = os.path.join(root, rel_dir)
+    try:
+        mtime = os.stat(full_dir).st_mtime_ns
+        if cached is not None and cached['mtime'] == mtime:
+            files = {}
+            for name in cached['files']:
+                try:
+                    stat = os.stat(os.path.join(full_dir, name))
+                except FileNotFoundError:
+                    continue  # removed since the directory was stat'ed
+                files[name] = [stat.st_size, stat.st_mtime_ns]
+            return rel_dir, {"mtime": mtime, "files": files, "dirs": cached['dirs']}
+
+        files = {}
+        dirs = []
+        with os.scandir(full_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif entry.name.lower().endswith(SUPPORTED_EXTS) and entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+                except FileNotFoundError:
+                    continue  # removed while listing
+    except (FileNotFoundError, NotADirectoryError):
+        # Removed (or replaced) since its parent was listed
+        return rel_dir, None
+    return rel_dir, {"mtime": mtime, "files": files, "dirs": dirs}
+
+
+def discover(root: str, workers: int = 8, use_cache: bool = True, cache_dir: str = None):
+    """
+    Streams (rel_path, FileStat) for every supported audio file under root.
+
+    Directories are listed concurrently on a thread pool, which hides the
+    per-request latency of network shares. Listings are cached by directory
+    mtime, while every file is still stat'ed; pass use_cache=False to list
+    every directory again. The cache lives in `cache_dir` (default: root).
+    """
+    cache_dir = cache_dir or root
+    cache = load_dir_cache(cache_dir) if use_cache else {}
+    listings = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {pool.submit(scan_dir, root, "", cache.get(""))}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir, listing = future.result()
+                if listing is None:
+                    continue
+                listings[rel_dir] = listing
+
+                for name in listing['dirs']:
+                    sub_dir = os.path.join(rel_dir, name)
+                    running.add(pool.submit(scan_dir, root, sub_dir, cache.get(sub_dir)))
+
+                for name, (size, mtime) in listing['files'].items():
+                    yield os.path.join(rel_dir, name), FileStat(size, mtime)
+
+    atomic_write_json(listings, os.path.join(cache_dir, DIR_CACHE_FILE))
@@ -0,0 +1,203 @@
+import numpy as np
+
+from statics import SAMPLE_RATE, CLIP_DURATION
+
+# Backends are looked up by name from `process --model`. Every vector in
+# the embedding store is tagged with the `tag` of the backend that made it,
+# so bump `version` whenever weights or preprocessing change: stored vectors
+# with another tag are analyzed again on the next run.
+BACKENDS = {}
+
+
+def register_backend(cls):
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def get_backend(name: str):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}'. Choose from: {', '.join(sorted(BACKENDS))}")
+    return BACKENDS[name]
+
+
+class EmbeddingBackend:
+    name = None
+    version = None
+    dim = None
+    # Settings of the log-mel front end for backends that can embed cached
+    # features (see mel_cache). Backends sharing them share cache entries.
+    frontend = None
+
+    def __init__(self, engine: str = "auto", threads: int = None):
+        pass
+
+    @classmethod
+    def tag(cls):
+        return f"{cls.name}@{cls.version}"
+
+    def embed_batch(self, clips):
+        """Returns one float32 vector of length `dim` per clip, in input order."""
+        raise NotImplementedError
+
+    def logmel(self, clips):
+        """Returns the (time_steps, mel_bins) front end features of every clip."""
+        raise NotImplementedError
+
+    def embed_mels(self, mels):
+        """Like embed_batch, for features made by `logmel`."""
+        raise NotImplementedError
+
+
+def get_device():
+    import torch
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def run_grouped(arrays, fn):
+    """
+    Calls fn on stacks of equally shaped arrays and returns one output row
+    per array, in input order. Clips or features of tracks shorter than
+    CLIP_DURATION get their own pass so they are never padded with silence.
+    """
+    groups = {}
+    for i, array in enumerate(arrays):
+        groups.setdefault(array.shape, []).append(i)
+
+    out = [None] * len(arrays)
+    for indices in groups.values():
+        rows = fn(np.stack([arrays[i] for i in indices]))
+        for i, row in zip(indices, rows):
+            out[i] = row
+    return out
+
+
+def eager_embed_mel(model, x):
+    """The eval-mode forward pass of Cnn6 / Cnn10 from the log-mel features on."""
+    import torch
+    import torch.nn.functional as F
+
+    x = model.bn0(x.transpose(1, 3)).transpose(1, 3)
+    for block in (model.conv_block1, model.conv_block2, model.conv_block3, model.conv_block4):
+        x = block(x, pool_size=(2, 2), pool_type='avg')
+    x = torch.mean(x, dim=3)
+    (x1, _) = torch.max(x, dim=2)
+    x2 = torch.mean(x, dim=2)
+    return F.relu_(model.fc1(x1 + x2))
+
+
+class PannsBackend(EmbeddingBackend):
+    """
+    PANNs AudioSet CNNs; the 512-d input of the classifier head is the embedding.
+    engine="fused" (the default on machines without a GPU) runs the folded,
+    TorchScript-compiled model from cpu_engine instead of the eager one.
+    """
+    dim = 512
+    model_cls = None
+    checkpoint = None
+    frontend = {"sample_rate": SAMPLE_RATE, "window_size": 1024, "hop_size": 320,
+                "mel_bins": 64, "fmin": 50, "fmax": 14000, "clip_duration": CLIP_DURATION}
+
+    def __init__(self, engine: str = "auto", threads: int = None):
+        # Imported here so machines without torch can still use numpy backends
+        import torch
+        from pytorch import models
+
+        self.torch = torch
+        self.device = get_device()
+        if threads:
+            torch.set_num_threads(threads)
+
+        # Initialize the architecture
+        params = {k: v for k, v in self.frontend.items() if k != "clip_duration"}
+        self.model = getattr(models, self.model_cls)(classes_num=527, **params)
+
+        # Load your weights
+        checkpoint = torch.load(self.checkpoint, map_location=self.device)
+        self.model.load_state_dict(checkpoint['model'])
+        self.model.eval()
+
+        self.engine = "fused" if engine == "fused" or (engine == "auto" and self.device == 'cpu') else "eager"
+        if self.engine == "fused":
+            from cpu_engine import load_cpu_engine
+            self.device = 'cpu'
+            engine = load_cpu_engine(self.model, self.checkpoint, threads)
+            self.forward = engine
+            self.forward_mel = engine.embed_mel
+        else:
+            self.model.to(self.device)
+            self.forward = lambda x: self.model(x)['embedding']
+            self.forward_mel = lambda x: eager_embed_mel(self.model, x)
+
+    def _run(self, fn, batch):
+        with self.torch.inference_mode():
+            tensor = self.torch.from_numpy(batch).to(self.device)
+            return fn(tensor).cpu().numpy()
+
+    def embed_batch(self, clips):
+        """Clips of equal length (every track longer than CLIP_DURATION) share a forward pass."""
+        return run_grouped(clips, lambda batch: self._run(self.forward, batch))
+
+    def logmel(self, clips):
+        extract = lambda x: self.model.logmel_extractor(self.model.spectrogram_extractor(x))[:, 0]
+        return run_grouped(clips, lambda batch: self._run(extract, batch))
+
+    def embed_mels(self, mels):
+        mels = [np.asarray(mel, dtype=np.float32)[None] for mel in mels]
+        return run_grouped(mels, lambda batch: self._run(self.forward_mel, batch))
+
+
+@register_backend
+class Cnn6Backend(PannsBackend):
+    name = "cnn6"
+    version = 1
+    model_cls = "Cnn6"
+    checkpoint = "Cnn6_mAP=0.343.pth"
+
+
+@register_backend
+class Cnn10Backend(PannsBackend):
+    name = "cnn10"
+    version = 1
+    model_cls = "Cnn10"
+    checkpoint = "Cnn10_mAP=0.380.pth"
+
+
+@register_backend
+class DspBackend(EmbeddingBackend):
+    """
+    Hand-made features for fast runs on machines without torch or a GPU:
+    mean and std of 64 log-mel bands, mean and std of the 12 chroma bins
+    and the tempo. Each group is scaled to roughly [-1, 1] so none of them
+    dominates cosine similarity.
+    """
+    name = "dsp"
+    version = 1
+    dim = 64 * 2 + 12 * 2 + 1
+
+    def __init__(self, engine: str = "auto", threads: int = None):
+        import librosa
+        self.librosa = librosa
+
+    def embed_batch(self, clips):
+        return [self.embed(clip) for clip in clips]
+
+    def embed(self, clip):
+        librosa = self.librosa
+        stft = np.abs(librosa.stft(clip, n_fft=1024, hop_length=320))
+        mel = librosa.feature.melspectrogram(S=stft ** 2, sr=SAMPLE_RATE, n_mels=64, fmin=50, fmax=14000)
+        logmel = librosa.power_to_db(mel, ref=1.0, amin=1e-10, top_db=None)
+        chroma = librosa.feature.chroma_stft(S=stft, sr=SAMPLE_RATE, n_fft=1024)
+        onset_env = librosa.onset.onset_strength(S=logmel, sr=SAMPLE_RATE, hop_length=320)
+        tempo = librosa.feature.tempo(onset_envelope=onset_env, sr=SAMPLE_RATE, hop_length=320)[0]
+
+        return np.concatenate([
+            logmel.mean(axis=1) / 80.0,
+            logmel.std(axis=1) / 20.0,
+            chroma.mean(axis=1),
+            chroma.std(axis=1),
+            [tempo / 200.0],
+        ]).astype(np.float32)
@@ -0,0 +1,210 @@
+import os
+import json
+import struct
+
+import numpy as np
+
+from statics import RAW_DB_FILE, RAW_STORE_FILE, RAW_INDEX_FILE, LEGACY_MODEL_TAG
+from utils import atomic_write_json
+from json_stream import iter_entries
+
+# Matrix file layout: a fixed HEADER_SIZE header followed by n_rows * dim
+# little-endian float32 values. The index file is the source of truth for
+# which rows are alive; rows past its n_rows are leftovers from an
+# interrupted write and get overwritten by the next append.
+MAGIC = b"PPEM"
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_FORMAT = "<4sII"
+DTYPE = np.dtype('<f4')
+
+
+class EmbeddingStore:
+    """
+    Contiguous float32 embedding matrix with a path -> row index, plus the
+    tag of the backend that produced each row and the track metadata
+    (gain, duration, tempo) measured from the same decode.
+
+    Vectors are appended in place and deletions only tombstone their row,
+    so neither ever rewrites the matrix. Rows are read through np.memmap,
+    which keeps opening the store cheap however large the library is.
+    Call save() to persist the index after modifying the store.
+    """
+
+    def __init__(self, root: str):
+        self.matrix_path = os.path.join(root, RAW_STORE_FILE)
+        self.index_path = os.path.join(root, RAW_INDEX_FILE)
+        self.dim = None
+        self.n_rows = 0
+        self.rows = {}
+        self.tombstones = []
+        self.models = []
+        self.row_models = []
+        self.meta = {}
+        self._mmap = None
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            self.dim = index['dim']
+            self.n_rows = index['n_rows']
+            self.rows = index['rows']
+            self.tombstones = index['tombstones']
+            # Stores written before backends were tracked only hold Cnn6 vectors
+            self.models = index.get('models', [LEGACY_MODEL_TAG])
+            self.row_models = index.get('row_models', [0] * self.n_rows)
+            self.meta = index.get('meta', {})
+            self._check_header()
+
+    @classmethod
+    def open(cls, root: str):
+        """Opens the store in `root`, migrating a legacy raw_features.json once."""
+        store = cls(root)
+        legacy_path = os.path.join(root, RAW_DB_FILE)
+        if not os.path.exists(store.index_path) and os.path.exists(legacy_path):
+            store.migrate_json(legacy_path)
+        return store
+
+    def migrate_json(self, legacy_path: str):
+        print(f"Migrating vectors from {legacy_path} to {self.matrix_path}...")
+        count = 0
+        for path, vec in iter_entries(legacy_path):
+            self.put(path, vec, LEGACY_MODEL_TAG)
+            count += 1
+        self.save()
+        print(f"Migrated {count} vectors.")
+
+        # Keep the old file around, but out of the way of future runs
+        os.replace(legacy_path, legacy_path + ".migrated")
+        print(f"Migration complete. Old data kept at {legacy_path}.migrated")
+
+    # --- READ ---
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    def paths(self):
+        return list(self.rows.keys())
+
+    def model_of(self, path: str):
+        return self.models[self.row_models[self.rows[path]]]
+
+    def meta_of(self, path: str):
+        """The track's {"gain", "duration", "bpm"}, or None if it was never measured."""
+        return self.meta.get(path)
+
+    def get(self, path: str):
+        return np.array(self._view()[self.rows[path]])
+
+    def matrix(self, paths=None):
+        """Returns (paths, matrix) with one float32 row per live path."""
+        if paths is None:
+            paths = self.paths()
+        if not paths:
+            return paths, np.zeros((0, self.dim or 0), dtype=np.float32)
+        row_ids = np.fromiter((self.rows[p] for p in paths), dtype=np.int64, count=len(paths))
+        return paths, np.asarray(self._view()[row_ids], dtype=np.float32)
+
+    def chunks(self, size: int):
+        """Yields the live vectors as consecutive float32 matrices of up to `size` rows."""
+        paths = self.paths()
+        for start in range(0, len(paths), size):
+            yield self.matrix(paths[start:start + size])[1]
+
+    def _view(self):
+        if self._mmap is None:
+            self._mmap = np.memmap(self.matrix_path, dtype=DTYPE, mode='r',
+                                   offset=HEADER_SIZE, shape=(self.n_rows, self.dim))
+        return self._mmap
+
+    # --- WRITE ---
+
+    def put(self, path: str, vec, model: str):
+        """Stores vec (made by backend tag `model`) under path, overwriting its row if the path is known."""
+        vec = np.asarray(vec, dtype=DTYPE).reshape(-1)
+        if self.dim is None:
+            self.dim = vec.shape[0]
+            self._write_header()
+        elif vec.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-d vector for {path}, got {vec.shape[0]}")
+
+        if path in self.rows:
+            row = self.rows[path]
+        elif self.tombstones:
+            row = self.tombstones.pop()
+        else:
+            row = self.n_rows
+            self.n_rows += 1
+            self.row_models.append(0)
+
+        if model not in self.models:
+            self.models.append(model)
+        self.row_models[row] = self.models.index(model)
+
+        self._write_row(row, vec)
+        self.rows[path] = row
+
+    def set_meta(self, path: str, meta):
+        self.meta[path] = meta
+
+    def delete(self, path: str):
+        row = self.rows.pop(path)
+        self.tombstones.append(row)
+        self.meta.pop(path, None)
+
+    def rename(self, old_path: str, new_path: str):
+        """Points new_path at the row of old_path; the vector is not copied."""
+        if new_path in self.rows:
+            self.delete(new_path)
+        self.rows[new_path] = self.rows.pop(old_path)
+        if old_path in self.meta:
+            self.meta[new_path] = self.meta.pop(old_path)
+
+    def reset(self):
+        """Drops every vector, e.g. before re-embedding with a backend of another width."""
+        self.dim = None
+        self.n_rows = 0
+        self.rows = {}
+        self.tombstones = []
+        self.models = []
+        self.row_models = []
+        self.meta = {}
+        self._mmap = None
+        for path in (self.index_path, self.matrix_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def save(self):
+        """Persists the index. Matrix writes are already on disk at this point."""
+        if self.dim is None:
+            return
+        atomic_write_json({
+            "version": VERSION,
+            "dim": self.dim,
+            "n_rows": self.n_rows,
+            "rows": self.rows,
+            "tombstones": self.tombstones,
+            "models": self.models,
+            "row_models": self.row_models,
+            "meta": self.meta,
+        }, self.index_path)
+
+    def _write_header(self):
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.dim)
+        with open(self.matrix_path, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def _check_header(self):
+        with open(self.matrix_path, 'rb') as f:
+            magic, version, dim = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != MAGIC or dim != self.dim:
+            raise ValueError(f"{self.matrix_path} does not match its index {self.index_path}")
+
+    def _write_row(self, row: int, vec):
+        self._mmap = None
+        with open(self.matrix_path, 'r+b') as f:
+            f.seek(HEADER_SIZE + row * self.dim * DTYPE.itemsize)
+            f.write(vec.tobytes())
@@ -0,0 +1,180 @@
+import os
+import time
+import struct
+import hashlib
+
+import numpy as np
+
+from statics import GRAPH_STATE_FILE
+from utils import atomic_open
+from ann_index import normalize
+
+# Neighbour graph layout (little endian), exported next to the library:
+#   header    32 bytes: magic, version, k, count
+#   neighbors count * k int32 track indices, most similar first, -1 = none
+#   scores    count * k float16 cosine similarities
+#   strings   every track path, as <u16 length><utf-8 bytes>; indices refer
+#             to this order because the JSON library has none on the device
+GRAPH_MAGIC = b"PPGR"
+GRAPH_VERSION = 1
+GRAPH_HEADER_FORMAT = "<4sHxxII16x"
+
+# Rows per side of a similarity block (a 4096 x 4096 float32 product)
+GRAPH_BLOCK = 4096
+
+
+def vector_hashes(vectors):
+    """One 64-bit hash per row, to tell which exported vectors changed since the last run."""
+    return np.array([int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), 'little')
+                     for row in np.ascontiguousarray(vectors, dtype=np.float32)], dtype=np.uint64)
+
+
+def merge_topk(idx_a, score_a, idx_b, score_b, k: int):
+    """Keeps the k best of two candidate sets per row, sorted by descending score."""
+    idx = np.concatenate([idx_a, idx_b], axis=1)
+    scores = np.concatenate([score_a, score_b], axis=1)
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        idx = np.take_along_axis(idx, part, axis=1)
+        scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def empty_topk(n: int, k: int):
+    return np.full((n, k), -1, dtype=np.int32), np.full((n, k), -np.inf, dtype=np.float32)
+
+
+def topk(query_rows, units, candidate_rows, k: int, block: int = GRAPH_BLOCK):
+    """
+    Top-k neighbours of units[query_rows] among units[candidate_rows], as
+    (indices into units, scores); a track is never its own neighbour.
+    candidate_rows must be sorted. Both sides are processed in blocks so
+    memory does not grow with n.
+    """
+    query_rows = np.asarray(query_rows, dtype=np.int64)
+    candidate_rows = np.asarray(candidate_rows, dtype=np.int64)
+    idx, scores = empty_topk(len(query_rows), k)
+    for q0 in range(0, len(query_rows), block):
+        q_rows = query_rows[q0:q0 + block]
+        queries = units[q_rows]
+        best_idx, best_scores = empty_topk(len(q_rows), k)
+        for c0 in range(0, len(candidate_rows), block):
+            c_rows = candidate_rows[c0:c0 + block]
+            sims = queries @ units[c_rows].T
+            # Candidate rows are sorted, so each query finds itself by bisection
+            pos = np.minimum(np.searchsorted(c_rows, q_rows), len(c_rows) - 1)
+            own = np.flatnonzero(c_rows[pos] == q_rows)
+            sims[own, pos[own]] = -np.inf
+            # Shrink the block to its own top k before merging with the best so far
+            if sims.shape[1] > k:
+                part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                cand, sims = c_rows[part].astype(np.int32), np.take_along_axis(sims, part, axis=1)
+            else:
+                cand = np.broadcast_to(c_rows.astype(np.int32), sims.shape)
+            best_idx, best_scores = merge_topk(best_idx, best_scores, cand, sims, k)
+        idx[q0:q0 + block], scores[q0:q0 + block] = best_idx, best_scores
+    return idx, scores
+
+
+def load_graph_state(root: str):
+    path = os.path.join(root, GRAPH_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    data = np.load(path, allow_pickle=False)
+    return {key: data[key] for key in data.files}
+
+
+def save_graph_state(state, root: str):
+    with atomic_open(os.path.join(root, GRAPH_STATE_FILE), 'wb') as f:
+        np.savez(f, **state)
+
+
+def update_graph(previous, paths, vectors, k: int):
+    """
+    Returns the graph state for `paths` / `vectors`. With a previous state of
+    the same k and width, only added or changed tracks are compared against
+    everything; kept tracks just merge in the added ones, unless one of
+    their neighbours was removed or changed, in which case their row is
+    recomputed. Returns (state, number of rows fully recomputed).
+    """
+    n = len(paths)
+    k = min(k, max(n - 1, 1))
+    units = normalize(np.asarray(vectors, dtype=np.float32))
+    hashes = vector_hashes(vectors)
+    everything = np.arange(n)
+
+    usable = (previous is not None and int(previous['k']) == k
+              and int(previous['dim']) == units.shape[1])
+    if not usable:
+        idx, scores = topk(everything, units, everything, k)
+        return {"paths": np.array(paths), "hashes": hashes, "neighbors": idx,
+                "scores": scores, "k": np.int64(k), "dim": np.int64(units.shape[1])}, n
+
+    # Map previous rows onto the current ones; changed vectors count as new
+    old_rows = {p: i for i, p in enumerate(previous['paths'].tolist())}
+    old_to_new = np.full(len(old_rows) + 1, -1, dtype=np.int64)  # last slot maps the -1 padding
+    new_to_old = np.full(n, -1, dtype=np.int64)
+    for i, p in enumerate(paths):
+        j = old_rows.get(p)
+        if j is not None and previous['hashes'][j] == hashes[i]:
+            old_to_new[j] = i
+            new_to_old[i] = j
+    # A moved file keeps its vector, so unmatched rows are paired up by hash
+    by_hash = {}
+    for j in np.flatnonzero(old_to_new[:-1] < 0).tolist():
+        by_hash.setdefault(int(previous['hashes'][j]), []).append(j)
+    for i in np.flatnonzero(new_to_old < 0).tolist():
+        rows = by_hash.get(int(hashes[i]))
+        if rows:
+            j = rows.pop()
+            old_to_new[j] = i
+            new_to_old[i] = j
+    kept_new = np.flatnonzero(new_to_old >= 0)
+    kept_old = new_to_old[kept_new]
+    added = np.flatnonzero(new_to_old < 0)
+
+    idx, scores = empty_topk(n, k)
+    old_idx = previous['neighbors'][kept_old]
+    remapped = old_to_new[np.where(old_idx < 0, len(old_rows), old_idx)]
+    # A neighbour that was removed or changed leaves a hole that only a full
+    # recompute of the row can fill
+    lost = ((remapped < 0) & (old_idx >= 0)).any(axis=1)
+    idx[kept_new] = np.where(remapped < 0, -1, remapped).astype(np.int32)
+    scores[kept_new] = np.where(remapped < 0, -np.inf, previous['scores'][kept_old])
+
+    clean = kept_new[~lost]
+    if len(added) and len(clean):
+        add_idx, add_scores = topk(clean, units, added, k)
+        idx[clean], scores[clean] = merge_topk(idx[clean], scores[clean], add_idx, add_scores, k)
+
+    recompute = np.concatenate([added, kept_new[lost]])
+    if len(recompute):
+        idx[recompute], scores[recompute] = topk(recompute, units, everything, k)
+
+    return {"paths": np.array(paths), "hashes": hashes, "neighbors": idx,
+            "scores": scores, "k": np.int64(k), "dim": np.int64(units.shape[1])}, len(recompute)
+
+
+def write_graph(path: str, state):
+    neighbors, scores = state['neighbors'], state['scores']
+    with atomic_open(path, 'wb') as f:
+        f.write(struct.pack(GRAPH_HEADER_FORMAT, GRAPH_MAGIC, GRAPH_VERSION,
+                            neighbors.shape[1], neighbors.shape[0]))
+        f.write(neighbors.astype('<i4').tobytes())
+        f.write(np.where(np.isfinite(scores), scores, 0).astype('<f2').tobytes())
+        for p in state['paths'].tolist():
+            encoded = p.encode('utf-8')
+            f.write(struct.pack("<H", len(encoded)) + encoded)
+
+
+def export_graph(root: str, path: str, paths, vectors, k: int):
+    """Updates the neighbour graph for the exported vectors and writes it next to the library."""
+    if len(paths) < 2:
+        return
+    start = time.perf_counter()
+    state, recomputed = update_graph(load_graph_state(root), paths, vectors, k)
+    save_graph_state(state, root)
+    write_graph(path, state)
+    print(f"Saved {path} (top-{int(state['k'])} neighbours, {recomputed} of {len(paths)} rows "
+          f"computed in full, {time.perf_counter() - start:.1f}s, {os.path.getsize(path) / 1024:.1f} KiB)")
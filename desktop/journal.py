@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import struct
+import zlib
+
+import numpy as np
+
+# Each record is framed as <payload length, crc32 of payload> followed by
+# the payload <path length><utf-8 path><model length><model tag>[meta]<float32 vector>.
+# When the high bit of the model length is set, [meta] is the track
+# metadata as <u16 length><utf-8 JSON>; older records have none.
+# A record cut short
+# by a crash fails its length or checksum test and ends the replay there.
+FRAME_FORMAT = "<II"
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+PATH_LEN_FORMAT = "<H"
+PATH_LEN_SIZE = struct.calcsize(PATH_LEN_FORMAT)
+MODEL_LEN_FORMAT = "<B"
+MODEL_LEN_SIZE = struct.calcsize(MODEL_LEN_FORMAT)
+HAS_META = 0x80
+MAX_MODEL_LEN = HAS_META - 1  # Longest model tag in bytes; the high bit is the meta flag
+META_LEN_FORMAT = "<H"
+META_LEN_SIZE = struct.calcsize(META_LEN_FORMAT)
+
+
+class Journal:
+    """
+    Append-only log of (rel_path, model, vector, meta) records written while `process`
+    runs. Records are buffered and fsync'ed every `flush_every` records or
+    `flush_seconds` seconds, whichever comes first, so a crash loses at
+    most one checkpoint interval of work.
+    """
+
+    def __init__(self, path: str, flush_every: int = 50, flush_seconds: float = 60.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def replay(self):
+        """Yields every intact (rel_path, model, vector, meta) record, truncating a torn tail."""
+        if not os.path.exists(self.path):
+            return
+
+        good_until = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                frame = f.read(FRAME_SIZE)
+                if len(frame) < FRAME_SIZE:
+                    break
+                length, crc = struct.unpack(FRAME_FORMAT, frame)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                good_until = f.tell()
+                yield decode_record(payload)
+
+        if good_until < os.path.getsize(self.path):
+            print(f"Discarding torn tail of {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_until)
+
+    def append(self, rel_path: str, model: str, vec, meta=None):
+        self._buffer.append(encode_record(rel_path, model, vec, meta))
+        if (len(self._buffer) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        with open(self.path, 'ab') as f:
+            for payload in self._buffer:
+                f.write(struct.pack(FRAME_FORMAT, len(payload), zlib.crc32(payload)))
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer = []
+
+    def remove(self):
+        self._buffer = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def encode_record(rel_path: str, model: str, vec, meta=None):
+    path_bytes = rel_path.encode('utf-8')
+    model_bytes = model.encode('utf-8')
+    if len(model_bytes) > MAX_MODEL_LEN:
+        raise ValueError(f"model tag '{model}' is longer than {MAX_MODEL_LEN} bytes")
+    vec_bytes = np.asarray(vec, dtype='<f4').tobytes()
+    meta_bytes = b""
+    model_len = len(model_bytes)
+    if meta is not None:
+        encoded = json.dumps(meta).encode('utf-8')
+        meta_bytes = struct.pack(META_LEN_FORMAT, len(encoded)) + encoded
+        model_len |= HAS_META
+    return (struct.pack(PATH_LEN_FORMAT, len(path_bytes)) + path_bytes
+            + struct.pack(MODEL_LEN_FORMAT, model_len) + model_bytes + meta_bytes + vec_bytes)
+
+
+def decode_record(payload: bytes):
+    (path_len,) = struct.unpack_from(PATH_LEN_FORMAT, payload)
+    offset = PATH_LEN_SIZE + path_len
+    rel_path = payload[PATH_LEN_SIZE:offset].decode('utf-8')
+    (model_len,) = struct.unpack_from(MODEL_LEN_FORMAT, payload, offset)
+    offset += MODEL_LEN_SIZE
+    has_meta, model_len = model_len & HAS_META, model_len & ~HAS_META
+    model = payload[offset:offset + model_len].decode('utf-8')
+    offset += model_len
+    meta = None
+    if has_meta:
+        (meta_len,) = struct.unpack_from(META_LEN_FORMAT, payload, offset)
+        offset += META_LEN_SIZE
+        meta = json.loads(payload[offset:offset + meta_len].decode('utf-8'))
+        offset += meta_len
+    vec = np.frombuffer(payload, dtype='<f4', offset=offset).copy()
+    return rel_path, model, vec, meta
+
+
+def compact_into(journal: Journal, store):
+    """
+    Moves every journaled vector into the store and drops the journal.
+    The store index is replaced atomically, so a crash at any point leaves
+    either the old index plus the journal, or the new index.
+    Returns the compacted paths.
+    """
+    journal.flush()
+    paths = []
+    for rel_path, model, vec, meta in journal.replay():
+        if store.dim is not None and len(vec) != store.dim:
+            # Left behind by a run with a backend of another width
+            continue
+        store.put(rel_path, vec, model)
+        if meta is not None:
+            store.set_meta(rel_path, meta)
+        paths.append(rel_path)
+    store.save()
+    journal.remove()
+    return paths
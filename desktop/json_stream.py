@@ -0,0 +1,126 @@
+import json
+
+from utils import atomic_open
+
+# Streaming reader and writer for the JSON files holding one vector per
+# track: library.json ({"dir": ..., "files": {path: vector}}) and the legacy
+# raw_features.json ({path: vector}). Entries are written one at a time in
+# compact form and parsed back one at a time, so memory does not grow with
+# the library. The output is exactly json.dumps(data, separators=(",", ":")),
+# which the Pi decodes with encoding/json like the old indented files.
+#
+# Only needs the standard library and utils.py: sync ships both files to
+# the device to patch library.json there.
+
+READ_CHUNK = 1024 * 1024
+SEPARATORS = (",", ":")
+
+
+def dumps(value):
+    # NaN and Infinity are not JSON and the Pi's decoder rejects them
+    return json.dumps(value, separators=SEPARATORS, allow_nan=False)
+
+
+def write_entries(path: str, entries, field: str = None, header=None):
+    """
+    Writes (name, value) entries as a JSON object, nested under `field` with
+    the `header` members before it when given. Returns the number of entries.
+    """
+    count = 0
+    with atomic_open(path, 'w') as f:
+        f.write("{")
+        if field is not None:
+            for key, value in (header or {}).items():
+                f.write(f"{dumps(key)}:{dumps(value)},")
+            f.write(f"{dumps(field)}:{{")
+        for name, value in entries:
+            f.write(f"{',' if count else ''}{dumps(name)}:{dumps(value)}")
+            count += 1
+        f.write("}}" if field is not None else "}")
+    return count
+
+
+class _Reader:
+    """A buffered cursor over a JSON text file that parses one value at a time."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(READ_CHUNK)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+
+    def peek(self):
+        """The next non-whitespace character, or '' at the end of the file."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON: expected '{char}' but found '{found}'")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number cut off by the end of the buffer still parses,
+                # so only trust values followed by another character
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def members(self):
+        """Yields (key, reader) for each member of the object at the cursor; read the value before continuing."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def iter_entries(path: str, field: str = None, header=None):
+    """
+    Yields the (name, value) entries of the object stored under `field`, or
+    of the top-level object when None, one at a time. Other top-level
+    members are stored in the `header` dict when given.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f)
+        if field is None:
+            for name in reader.members():
+                yield name, reader.value()
+            return
+
+        for key in reader.members():
+            if key != field:
+                value = reader.value()
+                if header is not None:
+                    header[key] = value
+                continue
+            for name in reader.members():
+                yield name, reader.value()
@@ -0,0 +1,152 @@
+import os
+import struct
+
+import numpy as np
+
+from utils import atomic_open
+from json_stream import write_entries, iter_entries
+
+# Binary library layout (little endian), read by pi/internal/io/library_bin.go:
+#   header   32 bytes: magic, version, dtype, flags, dim, count, strings size
+#   strings  dir followed by every path, each as <u16 length><utf-8 bytes>
+#            padded with zeros to a multiple of 4 bytes
+#   scales   count float32 values (int8 only)
+#   vectors  count * dim float16 or int8 values
+#   meta     count * 3 float32 values: gain (dB), duration (s), bpm per
+#            track, NaN when unknown (since version 2)
+#
+# library.json holds the same metadata as {"meta": {path: {"gain", "duration", "bpm"}}}
+# next to "dir", for the tracks that have it.
+BIN_MAGIC = b"PPLB"
+BIN_VERSION = 2
+META_FIELDS = ("gain", "duration", "bpm")
+BIN_HEADER_FORMAT = "<4sHBBIII12x"
+BIN_DTYPES = {"f16": 1, "int8": 2}
+
+
+def quantize(vectors, fmt: str):
+    """Returns (payload arrays in file order, dequantized float32 vectors)."""
+    if fmt == "f16":
+        q = vectors.astype('<f2')
+        return [q], q.astype(np.float32)
+
+    if fmt == "int8":
+        # Per-vector scale keeps quiet and loud embeddings equally precise
+        scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        q = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        scales = scales.astype('<f4')
+        return [scales, q], q.astype(np.float32) * scales[:, None]
+
+    raise ValueError(f"Unknown library format '{fmt}'")
+
+
+def quantization_error(vectors, restored):
+    """Max absolute error and worst-case cosine similarity against the originals."""
+    if len(vectors) == 0:
+        return 0.0, 1.0
+    max_abs = float(np.abs(vectors - restored).max())
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(restored, axis=1)
+    norms[norms == 0] = 1.0
+    cosine = np.einsum('ij,ij->i', vectors, restored) / norms
+    return max_abs, float(cosine.min())
+
+
+def write_library_json(path: str, lib_dir: str, paths, vectors, metas=None):
+    # Rounding saves space and is fine for similarity checks
+    restored = np.empty_like(vectors)
+    header = {"dir": lib_dir}
+    if metas is not None:
+        header['meta'] = {p: m for p, m in zip(paths, metas) if m is not None}
+
+    def entries():
+        for i, p in enumerate(paths):
+            rounded = np.round(vectors[i].astype(np.float64), 4)
+            restored[i] = rounded
+            yield p, rounded.tolist()
+
+    write_entries(path, entries(), field="files", header=header)
+    return restored
+
+
+def meta_matrix(metas, count: int):
+    """float32 [count, 3] of gain, duration and bpm, NaN where unknown."""
+    table = np.full((count, len(META_FIELDS)), np.nan, dtype='<f4')
+    for i, meta in enumerate(metas or ()):
+        if meta is not None:
+            table[i] = [meta[field] for field in META_FIELDS]
+    return table
+
+
+def write_library_bin(path: str, lib_dir: str, paths, vectors, fmt: str, metas=None):
+    count, dim = vectors.shape if len(vectors) else (0, 0)
+    payload, restored = quantize(vectors, fmt)
+    payload.append(meta_matrix(metas, count))
+
+    strings = bytearray()
+    for s in [lib_dir, *paths]:
+        encoded = s.encode('utf-8')
+        strings += struct.pack("<H", len(encoded)) + encoded
+    strings += b"\0" * (-len(strings) % 4)
+
+    with atomic_open(path, 'wb') as f:
+        f.write(struct.pack(BIN_HEADER_FORMAT, BIN_MAGIC, BIN_VERSION, BIN_DTYPES[fmt], 0,
+                            dim, count, len(strings)))
+        f.write(strings)
+        for arr in payload:
+            f.write(np.ascontiguousarray(arr).tobytes())
+    return restored
+
+
+def export_library(path: str, lib_dir: str, paths, vectors, fmt: str, metas=None):
+    """Writes the library in `fmt` and reports its size and quantization error."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if fmt == "json":
+        restored = write_library_json(path, lib_dir, paths, vectors, metas)
+    else:
+        restored = write_library_bin(path, lib_dir, paths, vectors, fmt, metas)
+
+    max_abs, min_cos = quantization_error(vectors, restored)
+    size_kb = os.path.getsize(path) / 1024
+    measured = sum(m is not None for m in metas or ())
+    print(f"Saved {path} ({fmt}, {len(paths)} tracks, {measured} with gain/tempo, {size_kb:.1f} KiB)")
+    print(f"Quantization error: max abs {max_abs:.6f}, worst cosine similarity {min_cos:.6f}")
+
+
+def read_library_json(path: str):
+    paths, vectors = [], []
+    for p, vec in iter_entries(path, "files"):
+        paths.append(p)
+        vectors.append(vec)
+    return paths, np.asarray(vectors, dtype=np.float32)
+
+
+def read_library_bin(path: str):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, dtype, _, dim, count, strings_size = struct.unpack_from(BIN_HEADER_FORMAT, data)
+    if magic != BIN_MAGIC or not 1 <= version <= BIN_VERSION:
+        raise ValueError(f"{path} is not a library.bin this version can read")
+    offset = struct.calcsize(BIN_HEADER_FORMAT)
+    strings, pos = [], offset
+    for _ in range(count + 1):
+        (length,) = struct.unpack_from("<H", data, pos)
+        strings.append(data[pos + 2:pos + 2 + length].decode('utf-8'))
+        pos += 2 + length
+    offset += strings_size
+
+    if dtype == BIN_DTYPES["int8"]:
+        scales = np.frombuffer(data, dtype='<f4', count=count, offset=offset)
+        offset += 4 * count
+        q = np.frombuffer(data, dtype=np.int8, count=count * dim, offset=offset).reshape(count, dim)
+        vectors = q.astype(np.float32) * scales[:, None]
+    else:
+        vectors = np.frombuffer(data, dtype='<f2', count=count * dim, offset=offset).reshape(count, dim)
+    return strings[1:], vectors.astype(np.float32)
+
+
+def read_library(path: str):
+    """(paths, float32 vectors) of an exported library, as the device reads them."""
+    if path.endswith(".bin"):
+        return read_library_bin(path)
+    return read_library_json(path)
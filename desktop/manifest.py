@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+
+from statics import MANIFEST_FILE
+from utils import atomic_write_json
+
+# Bytes hashed from the start, middle and end of a file. Enough to tell
+# re-encodes and retags apart without reading whole files off a NAS.
+FINGERPRINT_CHUNK = 64 * 1024
+
+# new:     paths on disk without an embedding
+# changed: paths whose content differs from what was embedded
+# renamed: {old_path: new_path} for moved files whose embedding can be reused
+# deleted: paths in the store that are gone from disk
+# current: {path: manifest entry} for every file on disk
+ChangePlan = namedtuple("ChangePlan", ["new", "changed", "renamed", "deleted", "current"])
+
+
+def load_manifest(root: str):
+    path = os.path.join(root, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest, root: str):
+    atomic_write_json(manifest, os.path.join(root, MANIFEST_FILE))
+
+
+def fingerprint(path: str, size: int):
+    """Hashes the size plus three evenly spread chunks of the file."""
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= 3 * FINGERPRINT_CHUNK:
+            h.update(f.read())
+        else:
+            for offset in (0, (size - FINGERPRINT_CHUNK) // 2, size - FINGERPRINT_CHUNK):
+                f.seek(offset)
+                h.update(f.read(FINGERPRINT_CHUNK))
+    return h.hexdigest()
+
+
+def describe(full_path: str, previous=None, stat=None):
+    """
+    Manifest entry for a file. The fingerprint of `previous` is reused when
+    size and mtime did not change, so unchanged files are never read.
+    """
+    if stat is None:
+        stat = os.stat(full_path)
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+        return previous
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "fp": fingerprint(full_path, stat.st_size),
+    }
+
+
+def plan_changes(root: str, files_on_disk, store_paths, manifest):
+    """
+    Compares the files on disk against the embedded paths and the manifest
+    of what they were embedded from. `files_on_disk` yields (rel_path, stat)
+    pairs, with stat None to stat the file here; it is consumed as it goes,
+    so fingerprinting overlaps with a streaming directory walk.
+    """
+    current = {}
+    for rel_path, stat in files_on_disk:
+        try:
+            current[rel_path] = describe(os.path.join(root, rel_path), manifest.get(rel_path), stat)
+        except FileNotFoundError:
+            continue  # moved or deleted since it was listed; the next run sees where it went
+
+    embedded = set(store_paths)
+    missing = embedded - current.keys()
+    candidates = sorted(current.keys() - embedded)
+
+    changed = sorted(
+        p for p in current.keys() & embedded
+        if p in manifest and manifest[p]['fp'] != current[p]['fp']
+    )
+
+    # A missing path whose content shows up under a new path was moved
+    missing_by_fp = {}
+    for p in sorted(missing):
+        if p in manifest:
+            missing_by_fp.setdefault(manifest[p]['fp'], []).append(p)
+
+    renamed = {}
+    new = []
+    for p in candidates:
+        sources = missing_by_fp.get(current[p]['fp'])
+        if sources:
+            renamed[sources.pop(0)] = p
+        else:
+            new.append(p)
+
+    deleted = sorted(missing - renamed.keys())
+    return ChangePlan(new, changed, renamed, deleted, current)
+
+
+def apply_plan(plan: ChangePlan, store, manifest):
+    """
+    Applies renames and deletions to the store and manifest, and refreshes
+    the manifest entries of embedded files that did not change. New and
+    changed files only get their entry once they have been embedded.
+    """
+    for old_path, new_path in plan.renamed.items():
+        store.rename(old_path, new_path)
+        manifest[new_path] = manifest.pop(old_path)
+
+    for path in plan.deleted:
+        store.delete(path)
+        manifest.pop(path, None)
+
+    pending = set(plan.new) | set(plan.changed)
+    for path, entry in plan.current.items():
+        if path in store and path not in pending:
+            manifest[path] = entry
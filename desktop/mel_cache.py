@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from utils import atomic_open
+
+# Log-mel features of analyzed tracks, so switching between models that
+# share a front end (or updating their weights) skips decoding and
+# resampling and only runs the conv stack. One float16 .npy file per track
+# holds the stacked features of its sampling windows (see sampling.py),
+# spread over 256 shard directories by key prefix. Keys hash the file
+# fingerprint from the manifest together with the front end settings and
+# sampling layout, so changed audio or settings never hit a stale entry.
+# Hits refresh the file mtime; the least recently used files are evicted
+# once the cache grows past its size cap.
+
+# After an eviction the cache is trimmed to this share of its cap, so a
+# full cache is not rescanned on every write
+EVICT_TO = 0.9
+
+
+class MelCache:
+    def __init__(self, root: str, max_mb: float, frontend: dict):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.params = json.dumps(frontend, sort_keys=True)
+        self.hits = 0
+        self.misses = 0
+        self.size = sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        """(mtime, path, size) of every cached file."""
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".npy"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, entry.path, st.st_size))
+        return entries
+
+    def _path(self, fp: str):
+        key = hashlib.blake2b(f"{fp}|{self.params}".encode(), digest_size=16).hexdigest()
+        return os.path.join(self.root, key[:2], key + ".npy")
+
+    def get(self, fp: str):
+        """The cached float32 features of every window for a fingerprint, or None."""
+        path = self._path(fp)
+        try:
+            mels = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(mels.astype(np.float32))
+
+    def put(self, fp: str, mels):
+        """
+        Stores the features of a track's windows as float16 and returns them
+        as they will be read back, so an embedding never depends on whether
+        the cache was hit.
+        """
+        stored = np.stack(mels).astype(np.float16)
+        path = self._path(fp)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_open(path, 'wb') as f:
+            np.save(f, stored)
+        self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+        return list(stored.astype(np.float32))
+
+    def evict(self):
+        """Deletes the least recently used files until the cache is below EVICT_TO of its cap."""
+        entries = sorted(self._entries())
+        self.size = sum(size for _, _, size in entries)
+        target = self.max_bytes * EVICT_TO
+        removed = 0
+        for _, path, size in entries:
+            if self.size <= target:
+                break
+            os.remove(path)
+            self.size -= size
+            removed += 1
+        if removed:
+            print(f"Evicted {removed} files from the mel cache ({self.size / 1024 ** 2:.1f} MiB left)")
+
+
+def cached_mels(items, cache: MelCache, backend, decode, need_meta=frozenset()):
+    """
+    Yields (path, mels, meta, error) for (path, fingerprint) items like
+    decode_stream does for audio windows. Cached tracks come first, without
+    metadata; the rest, and the paths in `need_meta`, are decoded with
+    `decode(paths)`, run through the backend's front end and cached.
+    """
+    misses = []
+    for path, fp in items:
+        mels = cache.get(fp) if path not in need_meta else None
+        if mels is None:
+            misses.append((path, fp))
+        else:
+            yield path, mels, None, None
+
+    fingerprints = dict(misses)
+    for path, windows, meta, error in decode([path for path, _ in misses]):
+        if error is not None:
+            yield path, None, None, error
+            continue
+        yield path, cache.put(fingerprints[path], backend.logmel(windows)), meta, None
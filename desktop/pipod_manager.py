@@ -1,163 +1,581 @@
 import argparse
-import librosa
 import os
-import json
+import time
+import shutil
 import traceback
-import torch
 import subprocess
-import numpy as np
 
-from statics import RAW_DB_FILE, LIBRARY_FILE, DEFAULT_MUSIC_DIR, SUPPORTED_EXTS
-
-from pytorch.models import Cnn6
+from statics import (
+    LIBRARY_FILE, LIBRARY_BIN_FILE, ANN_INDEX_FILE, GRAPH_FILE, CLUSTERS_FILE, DEFAULT_MUSIC_DIR, LOCAL_ONLY_FILES, DEFAULT_WALK_WORKERS,
+    DEFAULT_MODEL, DEFAULT_BATCH_SIZE, DEFAULT_DECODE_WORKERS,
+    JOURNAL_FILE, RUN_SUMMARY_FILE, MEL_CACHE_DIR, DEFAULT_MEL_CACHE_MB,
+    DEFAULT_CHECKPOINT_EVERY, DEFAULT_CHECKPOINT_SECONDS, DEFAULT_REDUCED_DIMS,
+    DEFAULT_SAMPLING, DEFAULT_SEGMENT_POSITIONS, DEFAULT_SEGMENT_SECONDS,
+    DEFAULT_DEDUPE_THRESHOLD, DEFAULT_DEDUPE_STRICT, DEFAULT_GRAPH_K, DEFAULT_CLUSTERS,
+    DEFAULT_WATCH_SETTLE, DEFAULT_POLL_INTERVAL, WATCH_MAX_DELAY, SHARD_META_FILE,
+)
+from decoder import decode_stream
+from embedding_store import EmbeddingStore
+from journal import Journal, compact_into
+from discovery import discover
+from manifest import load_manifest, save_manifest, plan_changes, apply_plan
+from library_export import export_library, read_library
+from reduction import reduce_library, project
+from ann_index import export_ivf
+from graph import export_graph
+from clusters import export_clusters
+from embedders import BACKENDS, get_backend
+from telemetry import RunStats, profiled
+from mel_cache import MelCache, cached_mels
+from delta_sync import LocalTransport, SshTransport, delta_sync
+from sync_apply import STATE_FILE as SYNC_STATE_FILE, STAGING_DIR as SYNC_STAGING_DIR
+from dedupe import find_duplicates, report_duplicates, save_duplicates, load_excluded
+from sampling import parse_layout, parse_positions, embedding_tag, embed_windows, compare_sampling
+from watcher import open_watcher
+from simulate import GO_PARAMS, parse_values, load_recorded, simulate
+from sharding import (
+    parse_shard, shard_of, shard_dir, save_shard_meta, load_shards, find_shards, check_shards, merge_shards,
+)
 
 # --- HELPERS ---
 
-def load_json(path):
-    if os.path.exists(path):
-        with open(path, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_json(data, path):
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
-    print(f"Saved {path}")
+def report_corrupt(path, e, tb=None):
+    print(f"\n[!] SKIPPING CORRUPT FILE: {path}")
+    print(f"Reason: {e}")
+    print(tb if tb is not None else traceback.format_exc())
 
 
+def embed_pending(pending, embed, tag, journal, stats):
+    """
+    Embeds a batch of decoded (rel_path, windows, meta) tracks into the journal,
+    with `embed` being the backend's embed_batch, or embed_mels for cached features.
+    If the batched pass fails, the tracks are retried one by one so a
+    single bad file cannot take the rest of the batch down with it.
+    """
+    if not pending:
+        return
 
-def extract_embeddings(path: str, model):
-    audio, _ = librosa.load(path, sr=32000, duration=120, mono=True)
-    audio = audio[None, :] # add batch dim: (1, -1)
-    device = 'cuda' if torch.cuda.is_available() else 'mps'
-
-    tensor = torch.from_numpy(audio).to(device)
-    out = model(tensor)
-    embedding = out['embedding']
-    return embedding.detach().cpu().numpy().tolist()
+    with stats.stage("inference"):
+        try:
+            vecs = embed_windows(embed, [windows for _, windows, _ in pending])
+        except Exception:
+            vecs = []
+            for rel_path, windows, _ in pending:
+                try:
+                    vecs.append(embed_windows(embed, [windows])[0])
+                except Exception as e:
+                    report_corrupt(rel_path, e)
+                    stats.skip(rel_path, str(e))
+                    vecs.append(None)
+    stats.count("batches")
+
+    with stats.stage("write"):
+        for (rel_path, _, meta), vec in zip(pending, vecs):
+            if vec is None:
+                continue
+            journal.append(rel_path, tag, vec, meta)
+            stats.count("embedded")
     
 
 # --- COMMANDS ---
 
+def report_plan(plan):
+    if plan.renamed:
+        print(f"Found {len(plan.renamed)} moved files. Reusing their embeddings...")
+    if plan.deleted:
+        print(f"Found {len(plan.deleted)} deleted files. Removing from DB...")
+    if plan.changed:
+        print(f"Found {len(plan.changed)} changed files. They will be analyzed again.")
+
+
 def cmd_scan(args):
-    """Scans disk vs raw_data.json to find new files."""
+    """Scans disk vs the embedding store to find new, moved and changed files."""
     print(f"--- Scanning {args.dir} ---")
     
-    raw_data = load_json(os.path.join(args.dir, RAW_DB_FILE))
+    store = EmbeddingStore.open(args.dir)
+    manifest = load_manifest(args.dir)
     
-    # 1. Walk Disk
-    files_on_disk = set()
-    for root, _, files in os.walk(args.dir):
-        for file in files:
-            if file.lower().endswith(SUPPORTED_EXTS):
-                # Rel path ensures portability
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, args.dir)
-                files_on_disk.add(rel_path)
-
-    # 2. Compare with DB
-    files_in_db = set(raw_data.keys())
-    
-    new_files = files_on_disk - files_in_db
-    deleted_files = files_in_db - files_on_disk
-
-    # 3. Handle Deletions
-    if deleted_files:
-        print(f"Found {len(deleted_files)} deleted files. Removing from DB...")
-        for f in deleted_files:
-            del raw_data[f]
-        save_json(raw_data, os.path.join(args.dir, RAW_DB_FILE))
+    # 1. Walk Disk & 2. Compare with DB
+    files_on_disk = discover(args.dir, args.walk_workers, not args.rescan)
+    plan = plan_changes(args.dir, files_on_disk, store.paths(), manifest)
+
+    # 3. Handle Renames & Deletions
+    report_plan(plan)
+    apply_plan(plan, store, manifest)
+    store.save()
+    save_manifest(manifest, args.dir)
     
     print("Scan complete.")
-    print(f"Total files: {len(files_on_disk)}")
-    print(f"New files to process: {len(new_files)}")
+    print(f"Total files: {len(plan.current)}")
+    print(f"New files to process: {len(plan.new)}")
+    print(f"Changed files to process: {len(plan.changed)}")
     
-    if new_files:
+    if plan.new or plan.changed:
         print("\nRun 'python pipod_manager.py process' to analyze them.")
 
 
+def open_library(root, checkpoint_every=DEFAULT_CHECKPOINT_EVERY, checkpoint_seconds=DEFAULT_CHECKPOINT_SECONDS):
+    """Opens the store, manifest and journal, picking up what an interrupted run already analyzed."""
+    store = EmbeddingStore.open(root)
+    manifest = load_manifest(root)
+    journal = Journal(os.path.join(root, JOURNAL_FILE), checkpoint_every, checkpoint_seconds)
+
+    resumed = compact_into(journal, store)
+    if resumed:
+        print(f"Resumed {len(resumed)} files from an interrupted run.")
+        # Their manifest entries describe what was embedded before; dropping
+        # them lets the next plan record the files as they are now
+        for rel_path in resumed:
+            manifest.pop(rel_path, None)
+    return store, manifest, journal
+
+
+def plan_work(args, store, manifest, tag, files_on_disk):
+    """Applies renames and deletions; returns the plan and the paths that need analyzing."""
+    plan = plan_changes(args.dir, files_on_disk, store.paths(), manifest)
+    report_plan(plan)
+    apply_plan(plan, store, manifest)
+
+    # Vectors made by another backend (or version or sampling layout) are analyzed again
+    pending_paths = set(plan.new) | set(plan.changed)
+    outdated = sorted(p for p in store.paths()
+                      if store.model_of(p) != tag and p not in pending_paths)
+    if outdated:
+        print(f"Found {len(outdated)} files embedded by another model or sampling layout. "
+              f"They will be analyzed again.")
+    return plan, plan.new + plan.changed + outdated
+
+
+def analyze(args, backend, layout, tag, to_process, plan, store, manifest, journal, stats, profile=None):
+    """Embeds `to_process` with a loaded backend and compacts the results into the store."""
+    print(f"--- Processing {len(to_process)} Files with {tag} "
+          f"(batch size {args.batch_size}, {args.decode_workers} decode workers) ---")
+    pending = []
+    full_paths = [os.path.join(args.dir, rel_path) for rel_path in to_process]
+    prefetch = 2 * max(args.batch_size, args.decode_workers)
+    # Gain, duration and tempo are measured on the same decoded audio
+    decode = lambda paths: decode_stream(paths, args.decode_workers, prefetch, layout, with_meta=True)
+
+    cache = None
+    if args.mel_cache > 0 and backend.frontend is None:
+        print(f"Note: '{args.model}' does not embed log-mel features, the mel cache is not used.")
+    elif args.mel_cache > 0:
+        cache = MelCache(os.path.join(args.dir, MEL_CACHE_DIR), args.mel_cache,
+                         {**backend.frontend, "layout": layout})
+        print(f"Using mel cache ({cache.size / 1024 ** 2:.1f} of {args.mel_cache:g} MiB in use)")
+
+    if cache is None:
+        decoded, embed = decode(full_paths), backend.embed_batch
+    else:
+        items = [(full_path, plan.current[rel_path]['fp'])
+                 for full_path, rel_path in zip(full_paths, to_process)]
+        # Cached features skip decoding, unless the track was never measured
+        need_meta = {full_path for full_path, rel_path in zip(full_paths, to_process)
+                     if store.meta_of(rel_path) is None}
+        decoded, embed = cached_mels(items, cache, backend, decode, need_meta), backend.embed_mels
+
+    stats.start_loop()
+    try:
+        with profiled(profile, os.path.join(args.dir, "process_profile")):
+            while True:
+                # Time spent here means the model is starved by decoding
+                with stats.stage("decode_wait"):
+                    item = next(decoded, None)
+                if item is None:
+                    break
+
+                full_path, windows, meta, error = item
+                rel_path = os.path.relpath(full_path, args.dir)
+                stats.progress(rel_path)
+
+                if error is not None:
+                    report_corrupt(full_path, *error)
+                    stats.skip(rel_path, error[0])
+                    continue
+
+                pending.append((rel_path, windows, meta))
+                if len(pending) >= args.batch_size:
+                    embed_pending(pending, embed, tag, journal, stats)
+                    pending = []
+
+            embed_pending(pending, embed, tag, journal, stats)
+    finally:
+        # Ctrl-C, crashes in the model, ...: keep what was finished
+        stats.end_progress()
+        if cache is not None:
+            stats.count("mel_cache_hits", cache.hits)
+            stats.count("mel_cache_misses", cache.misses)
+        with stats.stage("write"):
+            journal.flush()
+
+    print("Finished analysis. Saving raw data...")
+    with stats.stage("compact"):
+        for rel_path in compact_into(journal, store):
+            manifest[rel_path] = plan.current[rel_path]
+
+
+def export_outputs(args, store, lib_db_path):
+    """Exports the (optionally reduced) library and the indexes built from it."""
+    foldername = os.path.basename(os.path.normpath(args.dir))
+    projection = reduce_library(args.dir, store, args.reduce, args.dims, args.refit)
+    stored = store.paths()
+    excluded = load_excluded(args.dir, set(stored))
+    if excluded:
+        print(f"Leaving {len(excluded)} duplicate copies out of the library (see 'dedupe').")
+    paths, vectors = store.matrix([p for p in stored if p not in excluded])
+    if projection is not None:
+        vectors = project(vectors, projection)
+    export_library(lib_db_path, f'/home/pipod/{foldername}', paths, vectors, args.format,
+                   [store.meta_of(p) for p in paths])
+    if args.ann_lists > 0:
+        export_ivf(os.path.join(args.dir, ANN_INDEX_FILE), paths, vectors, args.ann_lists)
+    if args.graph_k > 0:
+        export_graph(args.dir, os.path.join(args.dir, GRAPH_FILE), paths, vectors, args.graph_k)
+    if args.clusters > 0:
+        export_clusters(args.dir, os.path.join(args.dir, CLUSTERS_FILE), paths, vectors, args.clusters, args.refit)
+
+
+def library_path(args):
+    return os.path.join(args.dir, LIBRARY_FILE if args.format == "json" else LIBRARY_BIN_FILE)
+
+
 def cmd_process(args):
-    """Analyzes new files and re-runs PCA."""
-    raw_db_path = os.path.join(args.dir, RAW_DB_FILE)
-    lib_db_path = os.path.join(args.dir, LIBRARY_FILE)
-    
-    raw_data = load_json(raw_db_path)
+    """Analyzes new files and exports the (optionally reduced) library."""
+    if args.shard is not None:
+        process_shard(args)
+        return
+    lib_db_path = library_path(args)
+    store, manifest, journal = open_library(args.dir, args.checkpoint_every, args.checkpoint_seconds)
     
+    backend_cls = get_backend(args.model)
+    layout = parse_layout(args.sampling, args.segment_positions, args.segment_seconds)
+    try:
+        tag = embedding_tag(backend_cls, layout)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    if store.dim is not None and store.dim != backend_cls.dim:
+        if not args.reembed:
+            print(f"Error: The store holds {store.dim}-d vectors, but '{args.model}' makes "
+                  f"{backend_cls.dim}-d ones. Rerun with --reembed to replace all of them.")
+            return
+        print(f"Dropping {len(store)} {store.dim}-d vectors to re-embed with {backend_cls.tag()}...")
+        store.reset()
+        manifest.clear()
+
     # Find what needs processing
-    files_on_disk = set()
-    for root, _, files in os.walk(args.dir):
-        for file in files:
-            if file.lower().endswith(SUPPORTED_EXTS):
-                rel_path = os.path.relpath(os.path.join(root, file), args.dir)
-                files_on_disk.add(rel_path)
+    files_on_disk = discover(args.dir, args.walk_workers, not args.rescan)
+    plan, to_process = plan_work(args, store, manifest, tag, files_on_disk)
     
-    to_process = files_on_disk - set(raw_data.keys())
+    if not to_process:
+        # Nothing to embed (e.g. after 'merge'): the model is not loaded at all
+        print("No new files to analyze.")
+    else:
+        stats = RunStats(len(to_process))
+
+        # load ML Model
+        with stats.stage("model_load"):
+            backend = backend_cls(engine=args.engine, threads=args.threads)
+        analyze(args, backend, layout, tag, to_process, plan, store, manifest, journal, stats, args.profile)
+
+        stats.report()
+        stats.save(os.path.join(args.dir, RUN_SUMMARY_FILE), {
+            "model": tag, "engine": getattr(backend, "engine", None),
+            "batch_size": args.batch_size, "decode_workers": args.decode_workers,
+            "threads": args.threads,
+        })
+
+    # Renames and deletions are applied even when nothing was analyzed
+    store.save()
+    save_manifest(manifest, args.dir)
+
+    # Create final Library
+    export_outputs(args, store, lib_db_path)
+    print("Ready to sync.")
 
-    # load ML Model
-    device = 'cuda' if torch.cuda.is_available() else 'mps'
 
-    # Initialize the architecture
-    model = Cnn6(sample_rate=32000, window_size=1024, 
-                 hop_size=320, mel_bins=64, fmin=50, 
-                 fmax=14000, classes_num=527)
+def process_shard(args):
+    """Embeds this node's share of the files into its shard directory; the main store is only read."""
+    index, count = args.shard
+    out_dir = shard_dir(args.dir, index, count)
 
-    # Load your weights
-    checkpoint = torch.load("Cnn6_mAP=0.343.pth", map_location=device)
-    model.load_state_dict(checkpoint['model'])
-    model.to(device)
-    model.eval()
-    
-    if not to_process and os.path.exists(lib_db_path):
-        print("No new files to analyze.")
+    backend_cls = get_backend(args.model)
+    layout = parse_layout(args.sampling, args.segment_positions, args.segment_seconds)
+    try:
+        tag = embedding_tag(backend_cls, layout)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    previous = load_shards([out_dir]) if os.path.exists(os.path.join(out_dir, SHARD_META_FILE)) else []
+    if previous and previous[0][1]['model'] != tag:
+        print(f"Error: {out_dir} was embedded with {previous[0][1]['model']}, not {tag}. "
+              f"Merge or remove it first.")
+        return
+
+    main_store = EmbeddingStore(args.dir)
+    main_manifest = load_manifest(args.dir)
+    os.makedirs(out_dir, exist_ok=True)
+    store, manifest, journal = open_library(out_dir, args.checkpoint_every, args.checkpoint_seconds)
+    for existing in (main_store, store):
+        if existing.dim is not None and existing.dim != backend_cls.dim:
+            print(f"Error: {existing.index_path} holds {existing.dim}-d vectors, but '{args.model}' makes "
+                  f"{backend_cls.dim}-d ones.")
+            return
+
+    print(f"--- Shard {index}/{count} of {args.dir} into {out_dir} ---")
+    # Every node lists the whole tree but keeps only its own share; the
+    # listing cache is per shard so nodes do not overwrite each other's
+    files_on_disk = ((rel_path, stat) for rel_path, stat
+                     in discover(args.dir, args.walk_workers, not args.rescan, out_dir)
+                     if shard_of(rel_path, count) == index)
+    plan, to_process = plan_work(args, store, manifest, tag, files_on_disk)
+
+    # Files the main store already holds, as they are now, need no shard copy
+    done = {p for p in to_process
+            if p in main_store and main_store.model_of(p) == tag
+            and main_manifest.get(p, {}).get('fp') == plan.current[p]['fp']}
+    if done:
+        print(f"Skipping {len(done)} files the main store already holds.")
+    to_process = [p for p in to_process if p not in done]
+
+    if to_process:
+        stats = RunStats(len(to_process))
+        with stats.stage("model_load"):
+            backend = backend_cls(engine=args.engine, threads=args.threads)
+        analyze(args, backend, layout, tag, to_process, plan, store, manifest, journal, stats, args.profile)
+        stats.report()
+        stats.save(os.path.join(out_dir, RUN_SUMMARY_FILE), {
+            "model": tag, "shard": f"{index}/{count}", "batch_size": args.batch_size,
+            "decode_workers": args.decode_workers, "threads": args.threads,
+        })
     else:
-        print(f"--- Processing {len(to_process)} New Files ---")
-        count = 0
-        for i, rel_path in enumerate(to_process):
-            full_path = os.path.join(args.dir, rel_path)
-            print(f"[{i+1}/{len(to_process)}] Analyzing: {rel_path}...")
-            
+        print("No new files to analyze.")
+
+    store.save()
+    save_manifest(manifest, out_dir)
+    save_shard_meta(out_dir, index, count, tag, store)
+    print(f"Shard {index}/{count} holds {len(store)} tracks. Run 'merge' once every shard is done.")
+
+
+def watch_round(args, backend, layout, tag, store, manifest, journal, use_cache=True):
+    """
+    Analyzes what changed since the last round and updates the exports.
+    Returns the files that were left for the next round because they are
+    still being written.
+    """
+    files_on_disk = discover(args.dir, args.walk_workers, use_cache)
+    plan, to_process = plan_work(args, store, manifest, tag, files_on_disk)
+
+    # A file modified in the last --settle seconds may still be copying in
+    settled_before = time.time_ns() - int(args.settle * 1e9)
+    young = {p for p in to_process if p in plan.current and plan.current[p]['mtime'] > settled_before}
+    if young:
+        print(f"Waiting for {len(young)} files that are still being written...")
+    to_process = [p for p in to_process if p not in young]
+    lib_db_path = library_path(args)
+    if not to_process and not plan.renamed and not plan.deleted and os.path.exists(lib_db_path):
+        return young
+
+    if to_process:
+        stats = RunStats(len(to_process))
+        analyze(args, backend, layout, tag, to_process, plan, store, manifest, journal, stats)
+        stats.report()
+    store.save()
+    save_manifest(manifest, args.dir)
+    export_outputs(args, store, lib_db_path)
+    print(f"Library updated at {time.strftime('%H:%M:%S')}.")
+    return young
+
+
+def cmd_watch(args):
+    """Keeps the model loaded and analyzes files as they are added to or changed in the music folder."""
+    store, manifest, journal = open_library(args.dir, args.checkpoint_every, args.checkpoint_seconds)
+    backend_cls = get_backend(args.model)
+    layout = parse_layout(args.sampling, args.segment_positions, args.segment_seconds)
+    try:
+        tag = embedding_tag(backend_cls, layout)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    if store.dim is not None and store.dim != backend_cls.dim:
+        print(f"Error: The store holds {store.dim}-d vectors, but '{args.model}' makes "
+              f"{backend_cls.dim}-d ones. Run 'process --reembed' first.")
+        return
+
+    start = time.perf_counter()
+    backend = backend_cls(engine=args.engine, threads=args.threads)
+    print(f"Loaded {tag} in {time.perf_counter() - start:.1f}s.")
+
+    # Watching starts before the catch-up round, so nothing added meanwhile is missed
+    watcher = open_watcher(args.dir, args.poll, args.poll_interval)
+    print(f"--- Watching {args.dir} (Ctrl-C to stop) ---")
+    changed, first_change, deferred = set(), None, set()
+    failures, catch_up = 0, True
+    try:
+        while True:
+            if not catch_up:
+                busy = changed or deferred or failures
+                # After a failed round, wait longer before each retry
+                timeout = min(args.settle * 2 ** failures, WATCH_MAX_DELAY) if busy else None
+                events = watcher.wait(timeout)
+                if events:
+                    changed |= events
+                    first_change = first_change or time.monotonic()
+                    # Debounce: wait until nothing changed for --settle seconds,
+                    # unless changes keep coming for longer than WATCH_MAX_DELAY
+                    if time.monotonic() - first_change < WATCH_MAX_DELAY:
+                        continue
+                if not busy:
+                    continue
+
             try:
-                vec = extract_embeddings(full_path, model)
-            except Exception as e:
-                print(f"\n[!] SKIPPING CORRUPT FILE: {full_path}")
-                print(f"Reason: {e}")
+                deferred = watch_round(args, backend, layout, tag, store, manifest, journal,
+                                       not (catch_up and args.rescan))
+                failures = 0
+            except Exception:
+                # Files vanishing mid-round, a full disk, a network share going away:
+                # keep the daemon alive and retry the round later
+                failures += 1
+                print(f"\n[!] Watch round failed, retrying in "
+                      f"{min(args.settle * 2 ** failures, WATCH_MAX_DELAY):g}s:")
                 print(traceback.format_exc())
-                continue
+            changed, first_change, catch_up = set(), None, False
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
 
-            raw_data[rel_path] = vec[0]
-            count += 1
 
-        print("Finished analysis. Saving raw data...")
-        save_json(raw_data, raw_db_path)
+def cmd_merge(args):
+    """Folds the stores written by process --shard into the main store."""
+    shards = load_shards(args.shards or find_shards(args.dir))
+    if not shards:
+        print("Error: No shards found. Run 'process --shard i/N' on each node first.")
+        return
 
-    # Create final Library JSON
-    foldername = os.path.basename(os.path.normpath(args.dir))
-    library_data = {"dir": f'/home/pipod/{foldername}', "files": {}}
-    for i, path in enumerate(raw_data.keys()):
-        # Rounding saves space and is fine for similarity checks
-        library_data['files'][path] = np.round(raw_data[path], 4).tolist()
+    store, manifest, _ = open_library(args.dir)
+    problems = check_shards(shards, store)
+    if problems:
+        print("Error: The shards cannot be merged:")
+        for problem in problems:
+            print(f"  {problem}")
+        return
 
-    save_json(library_data, lib_db_path)
-    print("Ready to sync.")
+    print(f"--- Merging {len(shards)} shards into {args.dir} ---")
+    counts = merge_shards(args.dir, shards, store, manifest)
+    store.save()
+    save_manifest(manifest, args.dir)
+    print(f"Merged {counts['merged']} tracks ({counts['unchanged']} already in the store, "
+          f"{counts['duplicates']} in several shards, {counts['stale']} changed or gone since, "
+          f"{counts['conflicts']} conflicts).")
+
+    if args.clean:
+        if counts['conflicts']:
+            print("Keeping the shard directories because of the conflicts above.")
+        else:
+            for path, _ in shards:
+                shutil.rmtree(path)
+            print(f"Removed {len(shards)} shard directories.")
+    print("Run 'process' to export the library.")
+
+
+def cmd_dedupe(args):
+    """Finds near-duplicate tracks and optionally leaves the extra copies out of the export."""
+    store = EmbeddingStore.open(args.dir)
+    if len(store) < 2:
+        print("Error: Need at least 2 analyzed tracks. Run 'process' first.")
+        return
+
+    print(f"--- Looking for duplicates among {len(store)} tracks ---")
+    clusters = find_duplicates(args.dir, store, args.threshold, args.strict,
+                               args.max_duration_diff, args.name_similarity)
+    report_duplicates(clusters)
+    excluded = save_duplicates(args.dir, clusters, args.exclude)
+    if args.exclude:
+        print(f"{len(excluded)} copies will be left out of the library. Run 'process' to export it.")
+    elif clusters:
+        print("Rerun with --exclude to leave the copies out of the exported library.")
+
+
+def cmd_compare_sampling(args):
+    """Reports decode cost and embedding agreement of a sampling layout vs the first window."""
+    store = EmbeddingStore.open(args.dir)
+    rel_paths = sorted(store.paths())
+    if not rel_paths:
+        print("Error: No analyzed tracks. Run 'process' first.")
+        return
+    layout = parse_layout("segments", args.segment_positions, args.segment_seconds)
+    backend = get_backend(args.model)(engine=args.engine, threads=args.threads)
+    compare_sampling(args.dir, rel_paths, backend, layout, args.sample)
+
+
+def cmd_simulate(args):
+    """Replays listening sessions through the Smart Shuffle update for every parameter set given."""
+    path = args.library
+    if path is None:
+        exported = [os.path.join(args.dir, name) for name in (LIBRARY_FILE, LIBRARY_BIN_FILE)
+                    if os.path.exists(os.path.join(args.dir, name))]
+        path = max(exported, key=os.path.getmtime) if exported else None
+    if path is None or not os.path.exists(path):
+        print("Error: No exported library found. Run 'process' first.")
+        return
+    paths, vectors = read_library(path)
+    if len(paths) < 2:
+        print("Error: Need at least 2 tracks in the library to simulate.")
+        return
+
+    recorded = None
+    if args.recorded:
+        try:
+            recorded = load_recorded(args.recorded)
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot read recorded sessions: {e}")
+            return
+    grid = {key: getattr(args, key) for key in GO_PARAMS}
+    print(f"Library: {path}")
+    simulate(paths, vectors, grid, args.sessions, args.steps, args.seed, recorded)
 
 
 def cmd_sync(args):
-    """Syncs files and library.json to Pi via rsync."""
-    if not args.user or not args.ip or not args.dest:
-        print("Error: Sync requires --user, --ip, and --dest arguments.")
+    """Sends new and changed tracks plus a library patch to the Pi, or everything with --full."""
+    if not args.local and (not args.user or not args.ip or not args.dest):
+        print("Error: Sync requires --user, --ip, and --dest arguments (or --local).")
+        return
+    if args.full:
+        full_sync(args.dir, args.local or f"{args.user}@{args.ip}:{args.dest}", args.dry_run)
         return
 
-    remote = f"{args.user}@{args.ip}:{args.dest}"
-    print(f"--- Syncing to {remote} ---")
-    src = args.dir if args.dir.endswith('/') else args.dir + '/'
+    if args.local:
+        transport = LocalTransport(args.local)
+        print(f"--- Syncing to {args.local} ---")
+    else:
+        transport = SshTransport(args.user, args.ip, args.dest)
+        print(f"--- Syncing to {transport.host}:{transport.dest} ---")
 
-    # Sync Music (exclude raw data file, include everything else)
+    try:
+        delta_sync(args.dir, transport, args.dry_run)
+        if not args.dry_run:
+            print("Sync Successful!")
+    except subprocess.CalledProcessError as e:
+        print(f"Sync Failed: {e}")
+    except FileNotFoundError as e:
+        if e.filename in transport.commands:
+            print(f"Error: '{e.filename}' command not found on this system.")
+        else:
+            print(f"Sync Failed: {e.filename} does not exist (removed during the sync?), run it again.")
+
+
+def full_sync(music_dir: str, target: str, dry_run: bool = False):
+    """Syncs the whole music folder to `target` (user@ip:dest, or a local directory) via rsync."""
+    print(f"--- Syncing to {target} ---")
+    src = music_dir if music_dir.endswith('/') else music_dir + '/'
+
+    # Sync Music (exclude raw data files, include everything else)
     # --delete removes songs on Pi that were deleted locally
-    cmd = [
-        "rsync", "-av", "--delete",
-        "--exclude", RAW_DB_FILE,  # Don't send the big raw file
-        src, remote
-    ]
+    cmd = ["rsync", "-av", "--delete"]
+    if dry_run:
+        cmd.append("--dry-run")
+    for name in LOCAL_ONLY_FILES + (SYNC_STATE_FILE, SYNC_STAGING_DIR):
+        cmd += ["--exclude", name]  # Don't send the big raw files
+    cmd += [src, target]
     
     print("Running rsync...")
     try:
@@ -173,20 +591,127 @@ def cmd_sync(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Pi Pod Music Manager")
     parser.add_argument("--dir", default=DEFAULT_MUSIC_DIR, help="Path to local music folder")
+    parser.add_argument("--walk-workers", type=int, default=DEFAULT_WALK_WORKERS,
+                        help="Threads listing directories concurrently")
+    parser.add_argument("--rescan", action="store_true",
+                        help="List every directory again instead of trusting cached listings")
     
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Scan
     p_scan = subparsers.add_parser("scan", help="Check for new files")
 
+    # Options shared by every command that embeds audio
+    embedding_opts = argparse.ArgumentParser(add_help=False)
+    embedding_opts.add_argument("--model", choices=sorted(BACKENDS), default=DEFAULT_MODEL,
+                                help="Embedding backend")
+    embedding_opts.add_argument("--engine", choices=("auto", "eager", "fused"), default="auto",
+                                help="PANNs inference: eager model, or the fused CPU model (auto = fused without a GPU)")
+    embedding_opts.add_argument("--threads", type=int, default=None,
+                                help="Intra-op CPU threads for inference (default: torch's choice)")
+    embedding_opts.add_argument("--segment-positions", type=parse_positions, default=list(DEFAULT_SEGMENT_POSITIONS),
+                                help="Window centres in percent of the track, comma separated")
+    embedding_opts.add_argument("--segment-seconds", type=float, default=DEFAULT_SEGMENT_SECONDS,
+                                help="Length of each sampling window")
+
+    # Options shared by process and watch
+    analysis_opts = argparse.ArgumentParser(add_help=False, parents=[embedding_opts])
+    analysis_opts.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                               help="Number of tracks per model forward pass")
+    analysis_opts.add_argument("--decode-workers", type=int, default=DEFAULT_DECODE_WORKERS,
+                               help="Processes decoding audio ahead of the model (0 = decode inline)")
+    analysis_opts.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                               help="Flush analyzed files to the journal every N files")
+    analysis_opts.add_argument("--checkpoint-seconds", type=float, default=DEFAULT_CHECKPOINT_SECONDS,
+                               help="Flush analyzed files to the journal at least every T seconds")
+    analysis_opts.add_argument("--sampling", choices=("head", "segments"), default=DEFAULT_SAMPLING,
+                               help="Embed the first CLIP_DURATION seconds, or short windows spread over the track")
+    analysis_opts.add_argument("--mel-cache", type=float, default=DEFAULT_MEL_CACHE_MB, metavar="MB",
+                               help="Cache log-mel features up to this size so re-embedding skips decoding (0 = off)")
+    analysis_opts.add_argument("--format", choices=("json", "f16", "int8"), default="json",
+                               help="Library export: library.json, or library.bin with float16 / int8 vectors")
+    analysis_opts.add_argument("--reduce", choices=("none", "pca", "random"), default="none",
+                               help="Reduce exported vectors with PCA or a random projection")
+    analysis_opts.add_argument("--dims", type=int, default=DEFAULT_REDUCED_DIMS,
+                               help="Exported vector width when --reduce is used")
+    analysis_opts.add_argument("--ann-lists", type=int, default=0,
+                               help="Export an IVF nearest neighbour index with this many lists (0 = off)")
+    analysis_opts.add_argument("--graph-k", type=int, default=DEFAULT_GRAPH_K,
+                               help="Export the top-k most similar tracks of every track (0 = off)")
+    analysis_opts.add_argument("--clusters", type=int, default=DEFAULT_CLUSTERS,
+                               help="Export this many mood clusters, refitted as the library grows (0 = off)")
+
     # Process
-    p_process = subparsers.add_parser("process", help="Analyze audio and update library")
+    p_process = subparsers.add_parser("process", parents=[analysis_opts],
+                                      help="Analyze audio and update library")
+    p_process.add_argument("--reembed", action="store_true",
+                           help="Allow replacing all stored vectors when --model changes the vector width")
+    p_process.add_argument("--profile", choices=("cprofile", "torch"), default=None,
+                           help="Capture a cProfile or torch.profiler trace of the analysis loop")
+    p_process.add_argument("--refit", action="store_true",
+                           help="Fit a new projection and clusters instead of reusing the saved ones")
+    p_process.add_argument("--shard", type=parse_shard, default=None, metavar="I/N",
+                           help="Only embed shard I of N into shards/, for several machines sharing --dir")
+
+    # Watch
+    p_watch = subparsers.add_parser("watch", parents=[analysis_opts],
+                                    help="Keep the model loaded and analyze new files as they appear")
+    p_watch.add_argument("--settle", type=float, default=DEFAULT_WATCH_SETTLE,
+                         help="Seconds a file must be left alone before it is analyzed")
+    p_watch.add_argument("--poll", action="store_true",
+                         help="Poll the folder instead of using inotify")
+    p_watch.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                         help="Seconds between listings when polling")
+    p_watch.set_defaults(refit=False)
     
+    # Merge
+    p_merge = subparsers.add_parser("merge", help="Merge the stores of process --shard runs into the main store")
+    p_merge.add_argument("shards", nargs="*",
+                         help="Shard directories (default: every directory in <dir>/shards)")
+    p_merge.add_argument("--clean", action="store_true",
+                         help="Remove the shard directories after a merge without conflicts")
+
+    # Dedupe
+    p_dedupe = subparsers.add_parser("dedupe", help="Find near-duplicate tracks")
+    p_dedupe.add_argument("--threshold", type=float, default=DEFAULT_DEDUPE_THRESHOLD,
+                          help="Cosine similarity above which two tracks may be copies")
+    p_dedupe.add_argument("--strict", type=float, default=DEFAULT_DEDUPE_STRICT,
+                          help="Similarity above which filenames do not need to match")
+    p_dedupe.add_argument("--max-duration-diff", type=float, default=2.0,
+                          help="Seconds two copies may differ in length")
+    p_dedupe.add_argument("--name-similarity", type=float, default=0.6,
+                          help="Minimum title similarity (0-1) below --strict")
+    p_dedupe.add_argument("--exclude", action="store_true",
+                          help="Leave all but the best copy of each cluster out of the exported library")
+
+    # Compare sampling layouts
+    p_compare = subparsers.add_parser("compare-sampling", parents=[embedding_opts],
+                                      help="Compare segment sampling against the first-window embeddings")
+    p_compare.add_argument("--sample", type=int, default=50, help="Number of analyzed tracks to compare")
+
+    # Simulate
+    p_simulate = subparsers.add_parser("simulate",
+                                       help="Replay listening sessions through Smart Shuffle to tune its constants")
+    p_simulate.add_argument("--library", default=None,
+                            help="Exported library to load (default: the newest library.json / library.bin in --dir)")
+    p_simulate.add_argument("--sessions", type=int, default=1000, help="Number of synthetic sessions")
+    p_simulate.add_argument("--steps", type=int, default=50, help="Tracks per synthetic session")
+    p_simulate.add_argument("--recorded", default=None,
+                            help="JSON list of recorded sessions, each a list of play fractions (0-1) in play order")
+    p_simulate.add_argument("--seed", type=int, default=0, help="Seed for the sessions, shared by every parameter set")
+    for key, value in GO_PARAMS.items():
+        p_simulate.add_argument(f"--{key.replace('_', '-')}", dest=key, type=parse_values, default=[value],
+                                help=f"Value(s) to try, comma separated (device: {value:g})")
+
     # Sync
     p_sync = subparsers.add_parser("sync", help="Sync to Pi")
     p_sync.add_argument("--user", help="Pi SSH Username (e.g. pi)")
     p_sync.add_argument("--ip", help="Pi IP Address")
     p_sync.add_argument("--dest", help="Remote destination path (e.g. /home/pi/music)")
+    p_sync.add_argument("--local", help="Sync to this directory instead of over ssh (e.g. a mounted SD card)")
+    p_sync.add_argument("--full", action="store_true",
+                        help="rsync the whole music folder (to the Pi or --local) instead of sending only what changed")
+    p_sync.add_argument("--dry-run", action="store_true", help="Only print what would be sent")
 
     args = parser.parse_args()
 
@@ -194,5 +719,15 @@ if __name__ == "__main__":
         cmd_scan(args)
     elif args.command == "process":
         cmd_process(args)
+    elif args.command == "watch":
+        cmd_watch(args)
+    elif args.command == "merge":
+        cmd_merge(args)
+    elif args.command == "dedupe":
+        cmd_dedupe(args)
+    elif args.command == "compare-sampling":
+        cmd_compare_sampling(args)
+    elif args.command == "simulate":
+        cmd_simulate(args)
     elif args.command == "sync":
         cmd_sync(args)
@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+
+from statics import PROJECTION_FILE
+from utils import atomic_open
+
+# Rows per chunk when streaming the raw store; bounds memory while fitting
+FIT_CHUNK = 4096
+REPORT_DIMS = (8, 16, 32, 64, 128, 256)
+
+
+def fit_pca(store, k: int):
+    """
+    Fits PCA over the whole store in a single streaming pass: the mean and
+    covariance are accumulated chunk by chunk in float64, so memory only
+    depends on the embedding width, not on the number of tracks.
+    """
+    dim = store.dim
+    n = 0
+    total = np.zeros(dim, dtype=np.float64)
+    outer = np.zeros((dim, dim), dtype=np.float64)
+    for chunk in store.chunks(FIT_CHUNK):
+        chunk = chunk.astype(np.float64)
+        n += len(chunk)
+        total += chunk.sum(axis=0)
+        outer += chunk.T @ chunk
+
+    mean = total / n
+    cov = (outer - n * np.outer(mean, mean)) / max(n - 1, 1)
+    eigvals, eigvecs = np.linalg.eigh(cov)
+
+    # eigh returns ascending order
+    order = np.argsort(eigvals)[::-1]
+    eigvals = np.clip(eigvals[order], 0, None)
+    eigvecs = eigvecs[:, order]
+
+    return {
+        "method": "pca",
+        "mean": mean.astype(np.float32),
+        "components": eigvecs[:, :k].T.astype(np.float32),
+        "explained_variance_ratio": (eigvals / max(eigvals.sum(), 1e-12)).astype(np.float32),
+        "n_fit": n,
+    }
+
+
+def fit_random_projection(dim: int, k: int, seed: int = 0):
+    """
+    Gaussian random projection. Needs no pass over the data at all, which
+    makes it the cheap choice for very large libraries; cosine similarities
+    are preserved approximately (Johnson-Lindenstrauss).
+    """
+    rng = np.random.default_rng(seed)
+    return {
+        "method": "random",
+        "mean": np.zeros(dim, dtype=np.float32),
+        "components": (rng.standard_normal((k, dim)) / np.sqrt(k)).astype(np.float32),
+        "explained_variance_ratio": np.zeros(0, dtype=np.float32),
+        "n_fit": 0,
+    }
+
+
+def project(vectors, projection):
+    return (np.asarray(vectors, dtype=np.float32) - projection['mean']) @ projection['components'].T
+
+
+def load_projection(root: str):
+    path = os.path.join(root, PROJECTION_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        projection = {key: data[key] for key in data.files}
+    projection['method'] = str(projection['method'])
+    projection['n_fit'] = int(projection['n_fit'])
+    return projection
+
+
+def save_projection(projection, root: str):
+    with atomic_open(os.path.join(root, PROJECTION_FILE), 'wb') as f:
+        np.savez(f, **projection)
+
+
+def report_projection(projection):
+    k = projection['components'].shape[0]
+    print(f"Projection: {projection['method']}, "
+          f"{projection['components'].shape[1]} -> {k} dims, fitted on {projection['n_fit']} tracks")
+
+    ratios = projection['explained_variance_ratio']
+    if len(ratios) == 0:
+        return
+    cumulative = np.cumsum(ratios)
+    for dims in sorted(set(REPORT_DIMS + (k,))):
+        if dims <= len(cumulative):
+            marker = "  <- selected" if dims == k else ""
+            print(f"  k={dims:<4} explained variance {cumulative[dims - 1] * 100:6.2f}%{marker}")
+
+
+def reduce_library(root: str, store, method: str, k: int, refit: bool = False):
+    """
+    Returns the projection to export the library with, or None to export
+    the raw vectors. A saved projection is reused as long as it still
+    matches the request, so new tracks are only projected; refit=True (or
+    a different method or k) fits a new one.
+    """
+    if method == "none":
+        return None
+    if len(store) <= k and method == "pca":
+        print(f"Not enough tracks ({len(store)}) to fit a {k}-d PCA. Exporting raw vectors.")
+        return None
+
+    projection = None if refit else load_projection(root)
+    if (projection is None
+            or projection['method'] != method
+            or projection['components'].shape != (k, store.dim)):
+        print(f"Fitting {method} projection to {k} dims...")
+        if method == "pca":
+            projection = fit_pca(store, k)
+        else:
+            projection = fit_random_projection(store.dim, k)
+        save_projection(projection, root)
+
+    report_projection(projection)
+    return projection
@@ -1,26 +1,96 @@
 import os
+import re
+import json
+import time
+import random
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from openai import OpenAI
 
-def get_corrected_filename(client, model, original_path):
-    """Sends the filename to the selected model for formatting."""
-    filename = os.path.basename(original_path)
-    
-    prompt = (
-        f"Extract the track ID and track name from this filename: '{filename}'. "
-        f"Return ONLY the corrected filename in the format: <track-id> - <track-name>.flac. "
+from statics import RENAME_CACHE_FILE
+from utils import atomic_write_json
+
+# Names that already follow "<track-id> - <track-name>.flac" are kept
+# without asking the model
+WELL_FORMED = re.compile(r"^\d{1,3} - \S.*\.flac$")
+
+
+def build_prompt(filenames):
+    if len(filenames) == 1:
+        return (
+            f"Extract the track ID and track name from this filename: '{filenames[0]}'. "
+            f"Return ONLY the corrected filename in the format: <track-id> - <track-name>.flac. "
+            f"If no track ID is found, use '00'. Do not include explanations."
+        )
+    return (
+        f"Extract the track ID and track name from each of these filenames: {json.dumps(filenames)}. "
+        f"Return ONLY a JSON array with one corrected filename per input, in the same order, "
+        f"each in the format: <track-id> - <track-name>.flac. "
         f"If no track ID is found, use '00'. Do not include explanations."
     )
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a precise music library assistant."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    
-    return response.choices[0].message.content.strip()
+
+def parse_reply(reply: str, count: int):
+    """Corrected names from a model reply, or ValueError if it does not hold `count` valid names."""
+    reply = reply.strip()
+    if count == 1 and not reply.startswith("["):
+        names = [reply]
+    else:
+        # Models like to wrap JSON in a markdown code block
+        reply = re.sub(r"^```(?:json)?\s*|\s*```$", "", reply)
+        names = json.loads(reply)
+    if not isinstance(names, list) or len(names) != count:
+        raise ValueError(f"expected {count} names, got: {reply[:200]}")
+    for name in names:
+        if not isinstance(name, str) or not name.lower().endswith(".flac") or os.sep in name:
+            raise ValueError(f"invalid filename in reply: {name!r}")
+    return [name.strip() for name in names]
+
+
+def ask_model(client, model, filenames, retries: int):
+    """Asks for corrected names of a batch, retrying with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "You are a precise music library assistant."},
+                    {"role": "user", "content": build_prompt(filenames)}
+                ]
+            )
+            return parse_reply(response.choices[0].message.content, len(filenames))
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.5))
+
+
+def correct_batch(client, model, filenames, retries: int):
+    """
+    Returns {filename: corrected name or Exception}. A batch the model
+    keeps answering badly is split into single-file requests.
+    """
+    try:
+        return dict(zip(filenames, ask_model(client, model, filenames, retries)))
+    except Exception as e:
+        if len(filenames) == 1:
+            return {filenames[0]: e}
+    results = {}
+    for filename in filenames:
+        try:
+            results[filename] = ask_model(client, model, [filename], retries)[0]
+        except Exception as e:
+            results[filename] = e
+    return results
+
+
+def load_cache(path: str):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
 
 def main():
     parser = argparse.ArgumentParser(description="Rename FLAC files using OpenAI or LM Studio.")
@@ -29,43 +99,67 @@ def main():
     parser.add_argument("--local", action="store_true", help="Use local LM Studio server instead of OpenAI")
     parser.add_argument("--url", default="http://localhost:1234/v1", help="Local server URL (default: http://localhost:1234/v1)")
     parser.add_argument("--dry-run", action="store_true", help="Preview changes without a prompt")
-    
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests sent to the model at the same time")
+    parser.add_argument("--batch-size", type=int, default=10, help="Filenames per request")
+    parser.add_argument("--retries", type=int, default=4, help="Retries per request, with exponential backoff")
+    parser.add_argument("--cache", default=None,
+                        help=f"Cache of corrected names (default: {RENAME_CACHE_FILE} in the searched directory)")
+
     args = parser.parse_args()
 
-    # Client Configuration
+    # Client Configuration (retries are handled here, with backoff)
     if args.local:
         print(f"Connecting to local LM Studio server at {args.url}...")
-        client = OpenAI(base_url=args.url, api_key="lm-studio") # Dummy key for local
+        client = OpenAI(base_url=args.url, api_key="lm-studio", max_retries=0) # Dummy key for local
     else:
         print("Connecting to OpenAI API...")
-        client = OpenAI() # Uses OPENAI_API_KEY environment variable
+        client = OpenAI(max_retries=0) # Uses OPENAI_API_KEY environment variable
 
     if not os.path.isdir(args.path):
         print(f"Error: {args.path} is not a valid directory.")
         return
 
-    pending_changes = []
+    cache_path = args.cache or os.path.join(args.path, RENAME_CACHE_FILE)
+    cache = load_cache(cache_path)
     print(f"Scanning files in: {args.path}...")
 
-    # 1. Collect all proposed changes
+    # 1. Collect all FLAC files; well-formed and cached names need no model call
+    flac_files = []
     for root, _, files in os.walk(args.path):
         for filename in files:
             if filename.lower().endswith(".flac"):
-                old_path = os.path.join(root, filename)
-                
-                try:
-                    print(f" Consulting model for: {filename}")
-                    new_filename = get_corrected_filename(client, args.model, old_path)
-                    
-                    if filename != new_filename:
-                        pending_changes.append((old_path, new_filename))
-                    else:
-                        print("  [SKIPPED] Name is already correct.")
-                        
-                except Exception as e:
-                    print(f" [ERROR] Could not process {filename}: {e}")
-
-    # 2. Review Phase
+                flac_files.append(os.path.join(root, filename))
+
+    to_ask = sorted({os.path.basename(p) for p in flac_files
+                     if not WELL_FORMED.match(os.path.basename(p)) and os.path.basename(p) not in cache})
+    print(f"Found {len(flac_files)} files, {len(to_ask)} unique names need the model.")
+
+    # 2. Ask the model, a few batches at a time
+    batches = [to_ask[i:i + args.batch_size] for i in range(0, len(to_ask), args.batch_size)]
+    failed = {}
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = [pool.submit(correct_batch, client, args.model, batch, args.retries) for batch in batches]
+        for done, future in enumerate(as_completed(futures), 1):
+            for filename, result in future.result().items():
+                if isinstance(result, Exception):
+                    failed[filename] = result
+                    print(f" [ERROR] Could not process {filename}: {result}")
+                else:
+                    cache[filename] = result
+            # Saved after every batch so an interrupted run loses nothing
+            atomic_write_json(cache, cache_path, indent=2)
+            print(f" [{done}/{len(batches)}] batches done")
+
+    pending_changes = []
+    for old_path in flac_files:
+        filename = os.path.basename(old_path)
+        if WELL_FORMED.match(filename) or filename in failed:
+            continue
+        new_filename = cache[filename]
+        if filename != new_filename:
+            pending_changes.append((old_path, new_filename))
+
+    # 3. Review Phase
     if not pending_changes:
         print("\nNo files need renaming.")
         return
@@ -79,10 +173,10 @@ def main():
         print(f"\nDry run complete. {len(pending_changes)} changes found.")
         return
 
-    # 3. Confirmation Phase
+    # 4. Confirmation Phase
     print(f"\nTotal changes: {len(pending_changes)}")
     confirm = input("Proceed with renaming? (y/N): ").lower()
-    
+
     if confirm == 'y':
         for old_path, new_filename in pending_changes:
             new_path = os.path.join(os.path.dirname(old_path), new_filename)
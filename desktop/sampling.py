@@ -0,0 +1,102 @@
+import os
+import time
+
+import numpy as np
+
+from decoder import load_windows
+from journal import MAX_MODEL_LEN
+
+# A sampling layout is None, for the first CLIP_DURATION seconds of every
+# track, or (positions, seconds): one window of `seconds` centred on each
+# position in percent of the track. The embeddings of the windows are
+# averaged. Vectors are tagged with their layout, so changing it analyzes
+# the library again like switching models does.
+
+
+def parse_layout(sampling: str, positions, seconds: float):
+    if sampling == "head":
+        return None
+    return tuple(float(p) for p in positions), float(seconds)
+
+
+def parse_positions(value: str):
+    positions = [float(p) for p in value.split(",") if p]
+    if not positions or any(not 0 <= p <= 100 for p in positions):
+        raise ValueError("positions are percentages between 0 and 100")
+    return positions
+
+
+def embedding_tag(backend_cls, layout):
+    """
+    Store tag of vectors made by a backend with a layout, e.g. 'cnn6@1/seg20,50,80x10'.
+    Raises ValueError when the layout makes the tag too long for a journal record.
+    """
+    if layout is None:
+        return backend_cls.tag()
+    positions, seconds = layout
+    tag = f"{backend_cls.tag()}/seg{','.join(f'{p:g}' for p in positions)}x{seconds:g}"
+    if len(tag.encode('utf-8')) > MAX_MODEL_LEN:
+        raise ValueError(f"{len(positions)} segment positions make the tag '{tag}' longer than "
+                         f"{MAX_MODEL_LEN} bytes, use fewer --segment-positions")
+    return tag
+
+
+def embed_windows(embed, tracks):
+    """Embeds the windows of all tracks in one call and returns one pooled vector per track."""
+    flat = [window for windows in tracks for window in windows]
+    vecs = embed(flat)
+    pooled, start = [], 0
+    for windows in tracks:
+        pooled.append(np.mean(vecs[start:start + len(windows)], axis=0))
+        start += len(windows)
+    return pooled
+
+
+def compare_sampling(root: str, rel_paths, backend, layout, sample: int, seed: int = 0):
+    """
+    Embeds a random sample of tracks with the first-window layout and with
+    `layout`, and reports decode time, how close the two vectors of every
+    track are and how much their nearest neighbours agree.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(rel_paths), size=min(sample, len(rel_paths)), replace=False)
+    rel_paths = [rel_paths[i] for i in sorted(picks)]
+    if len(rel_paths) < 2:
+        print("Error: Need at least 2 tracks to compare sampling layouts.")
+        return
+
+    print(f"--- Comparing sampling layouts on {len(rel_paths)} tracks ---")
+    results = {}
+    for name, candidate in (("head", None), ("segments", layout)):
+        decode_s, embed_s, audio_s, vectors = 0.0, 0.0, 0.0, []
+        for rel_path in rel_paths:
+            start = time.perf_counter()
+            windows = load_windows(os.path.join(root, rel_path), candidate)
+            decode_s += time.perf_counter() - start
+            audio_s += sum(len(w) for w in windows)
+
+            start = time.perf_counter()
+            vectors.append(embed_windows(backend.embed_batch, [windows])[0])
+            embed_s += time.perf_counter() - start
+        results[name] = (decode_s, embed_s, audio_s, np.stack(vectors))
+
+    head, seg = results["head"], results["segments"]
+    print(f"{'layout':<10} {'decode s':>9} {'embed s':>9} {'audio decoded':>14}")
+    for name, (decode_s, embed_s, audio_s, _) in results.items():
+        print(f"{name:<10} {decode_s:9.2f} {embed_s:9.2f} {audio_s / head[2] * 100:13.0f}%")
+    print(f"Decode cost of segments vs head: {seg[0] / max(head[0], 1e-9) * 100:.0f}%")
+
+    def unit(v):
+        return v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-9)
+    a, b = unit(head[3]), unit(seg[3])
+    cosine = np.sum(a * b, axis=1)
+    print(f"Cosine similarity head vs segments per track: mean {cosine.mean():.3f}, min {cosine.min():.3f}")
+
+    k = min(10, len(rel_paths) - 1)
+    sim_a, sim_b = a @ a.T, b @ b.T
+    np.fill_diagonal(sim_a, -np.inf)
+    np.fill_diagonal(sim_b, -np.inf)
+    top_a = np.argsort(sim_a, axis=1)[:, ::-1][:, :k]
+    top_b = np.argsort(sim_b, axis=1)[:, ::-1][:, :k]
+    overlap = np.mean([len(np.intersect1d(x, y)) / k for x, y in zip(top_a, top_b)])
+    print(f"Top-{k} neighbours shared between layouts: {overlap * 100:.1f}%")
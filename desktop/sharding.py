@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import hashlib
+import platform
+
+from statics import SHARDS_DIR, SHARD_META_FILE
+from utils import atomic_write_json
+from embedding_store import EmbeddingStore, VERSION as STORE_VERSION
+from manifest import load_manifest, describe
+
+# `process --shard i/N` embeds the files whose path hash falls in shard i
+# into <dir>/shards/shard-i-of-N, a store, manifest and journal of its own
+# next to a shard.json describing how it was made. Every node sharing the
+# music folder (e.g. over a NAS) runs one shard; `merge` then folds the
+# shard stores into the main store.
+SHARD_FORMAT = 1
+PARTITION = "blake2b64(posix rel_path) mod N"
+
+
+def parse_shard(value: str):
+    index, count = (int(part) for part in value.split("/"))
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError("shards are given as i/N with 1 <= i <= N")
+    return index, count
+
+
+def shard_of(rel_path: str, count: int):
+    """1-based shard of a path; the same on every node and OS, whatever the walk order."""
+    key = rel_path.replace(os.sep, "/").encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') % count + 1
+
+
+def shard_dir(root: str, index: int, count: int):
+    return os.path.join(root, SHARDS_DIR, f"shard-{index}-of-{count}")
+
+
+def save_shard_meta(out_dir: str, index: int, count: int, tag: str, store):
+    atomic_write_json({
+        "format": SHARD_FORMAT,
+        "store_version": STORE_VERSION,
+        "shard": index,
+        "count": count,
+        "partition": PARTITION,
+        "model": tag,
+        "dim": store.dim,
+        "tracks": len(store),
+        "host": platform.node(),
+        "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }, os.path.join(out_dir, SHARD_META_FILE), indent=2)
+
+
+def load_shards(shard_dirs):
+    """Returns [(dir, meta)] for the directories holding a shard.json."""
+    shards = []
+    for path in shard_dirs:
+        meta_path = os.path.join(path, SHARD_META_FILE)
+        if not os.path.exists(meta_path):
+            print(f"Warning: {path} has no {SHARD_META_FILE}, skipping it.")
+            continue
+        with open(meta_path, 'r') as f:
+            shards.append((path, json.load(f)))
+    return shards
+
+
+def find_shards(root: str):
+    base = os.path.join(root, SHARDS_DIR)
+    if not os.path.isdir(base):
+        return []
+    return sorted(os.path.join(base, name) for name in os.listdir(base)
+                  if os.path.isdir(os.path.join(base, name)))
+
+
+def check_shards(shards, main_store):
+    """Returns the problems that make the shards unsafe to merge; warns about gaps."""
+    problems = []
+    for path, meta in shards:
+        if meta.get('format') != SHARD_FORMAT or meta.get('store_version') != STORE_VERSION:
+            problems.append(f"{path}: shard format {meta.get('format')} / store version "
+                            f"{meta.get('store_version')}, expected {SHARD_FORMAT} / {STORE_VERSION}")
+
+    for key in ("count", "model", "dim", "partition"):
+        values = {meta.get(key) for _, meta in shards if meta.get(key) is not None}  # empty shards have no dim
+        if len(values) > 1:
+            problems.append(f"Shards disagree on {key}: "
+                            + ", ".join(f"{os.path.basename(p)}={m.get(key)}" for p, m in shards))
+
+    model = shards[0][1]['model']
+    dims = {meta['dim'] for _, meta in shards if meta['dim'] is not None}
+    if main_store.dim is not None and dims - {main_store.dim}:
+        problems.append(f"Shards hold {', '.join(map(str, sorted(dims)))}-d vectors, "
+                        f"the main store {main_store.dim}-d ones")
+    main_models = {main_store.model_of(p) for p in main_store.paths()}
+    if main_models and model not in main_models:
+        problems.append(f"Shards were embedded with {model}, the main store with {', '.join(sorted(main_models))}")
+
+    seen = {}
+    for path, meta in shards:
+        if meta['shard'] in seen:
+            problems.append(f"Shard {meta['shard']}/{meta['count']} found twice: {seen[meta['shard']]} and {path}")
+        seen[meta['shard']] = path
+    count = shards[0][1]['count']
+    missing = sorted(set(range(1, count + 1)) - seen.keys())
+    if missing and not problems:
+        print(f"Warning: shards {', '.join(map(str, missing))} of {count} are missing; "
+              f"merging the others, their tracks are left for 'process'.")
+    return problems
+
+
+def merge_shards(root: str, shards, store, manifest):
+    """
+    Folds the shard stores into `store` / `manifest`. A shard vector is only
+    taken when its file is still on disk with the fingerprint it was embedded
+    from. A path is taken from the first shard that has it; copies in later
+    shards made from other file contents are reported as conflicts and
+    dropped. Returns counts per outcome.
+    """
+    counts = {"merged": 0, "unchanged": 0, "stale": 0, "conflicts": 0, "duplicates": 0}
+    taken = {}  # rel_path -> fingerprint taken from an earlier shard
+    for path, meta in shards:
+        shard_store = EmbeddingStore(path)
+        shard_manifest = load_manifest(path)
+        for rel_path in shard_store.paths():
+            entry = shard_manifest.get(rel_path)
+            full_path = os.path.join(root, rel_path)
+            if entry is None or not os.path.exists(full_path):
+                counts['stale'] += 1
+                continue
+
+            if rel_path in taken:
+                if taken[rel_path] == entry['fp']:
+                    counts['duplicates'] += 1
+                else:
+                    counts['conflicts'] += 1
+                    print(f"Conflict: {rel_path} was embedded from different file contents by two shards")
+                continue
+
+            current = describe(full_path, entry)
+            if current['fp'] != entry['fp']:
+                counts['stale'] += 1  # changed since the shard embedded it
+                continue
+
+            taken[rel_path] = entry['fp']
+            model = shard_store.model_of(rel_path)
+            meta = shard_store.meta_of(rel_path)
+            if (rel_path in store and store.model_of(rel_path) == model
+                    and manifest.get(rel_path, {}).get('fp') == entry['fp']):
+                if meta is not None and store.meta_of(rel_path) is None:
+                    store.set_meta(rel_path, meta)
+                counts['unchanged'] += 1
+                continue
+            store.put(rel_path, shard_store.get(rel_path), model)
+            if meta is not None:
+                store.set_meta(rel_path, meta)
+            manifest[rel_path] = current
+            counts['merged'] += 1
+    return counts
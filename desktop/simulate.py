@@ -0,0 +1,236 @@
+import time
+import json
+import itertools
+
+import numpy as np
+
+from ann_index import normalize
+
+# Smart Shuffle as implemented in pi/internal/queue/smart_shuffle.go. Keep
+# these in step with the Go constants, they are the sweep's baseline.
+GO_PARAMS = {"min_lr": 0.3, "max_lr": 2.0, "decay": 5.0, "steepness": 4.0}
+FEEDBACK_SCALE = 1.5   # tanh feedback is scaled to -1.5 .. 1.5
+START_TRACKS = 3       # The start vector is the mean of the first shuffled tracks ...
+START_NOISE = 0.5      # ... plus uniform noise in [-0.5, 0.5) per dimension
+
+SIM_BATCH = 128        # Sessions replayed together; every step is one [batch, n] matrix product
+SETTLED_COS = 0.95     # A taste vector has converged once it stays this close to where it ends up
+LATENCY_REPEATS = 50   # Single-session decisions timed for the latency report
+
+# Synthetic listener: each session likes the tracks around a hidden taste.
+# Play fraction = sigmoid(SHARPNESS * (z - BAR)) + noise, with z the track's
+# similarity to the hidden taste standardized over the library; the top
+# ~16% of tracks are played past halfway.
+LISTENER_SHARPNESS = 2.0
+LISTENER_BAR = 1.0
+LISTENER_NOISE = 0.1
+
+
+def parse_values(value: str):
+    """A comma separated list of numbers, swept over by simulate."""
+    values = [float(v) for v in value.split(",") if v]
+    if not values or any(v <= 0 for v in values):
+        raise ValueError("values must be positive numbers, comma separated")
+    return values
+
+
+def make_sessions(units, count: int, steps: int, seed: int = 0, recorded=None):
+    """
+    Everything random about a batch of sessions, drawn once so that every
+    parameter set is replayed against exactly the same sessions. With
+    `recorded` play-fraction sequences those are replayed instead of the
+    synthetic listener; shorter sequences are padded with NaN (ended).
+    """
+    rng = np.random.default_rng(seed)
+    n, dim = units.shape
+    if recorded is not None:
+        count, steps = len(recorded), max(len(r) for r in recorded)
+    starts = np.stack([rng.choice(n, size=min(START_TRACKS, n), replace=False) for _ in range(count)])
+    sessions = {
+        "starts": starts,
+        "noise": (rng.random((count, dim)) - 0.5).astype(np.float32) * (2 * START_NOISE),
+        "steps": steps,
+    }
+    if recorded is not None:
+        fractions = np.full((count, steps), np.nan, dtype=np.float32)
+        for i, r in enumerate(recorded):
+            fractions[i, :len(r)] = np.clip(r, 0.0, 1.0)
+        sessions['fractions'] = fractions
+    else:
+        sessions['hidden'] = units[rng.choice(n, size=count)]
+        sessions['listener_noise'] = (rng.standard_normal((count, steps)) * LISTENER_NOISE).astype(np.float32)
+    return sessions
+
+
+def listener_bias(units, hidden):
+    """Per session mean and std of the similarity of every track to its hidden taste."""
+    mean, std = np.empty(len(hidden), dtype=np.float32), np.empty(len(hidden), dtype=np.float32)
+    for s0 in range(0, len(hidden), SIM_BATCH):
+        sims = hidden[s0:s0 + SIM_BATCH] @ units.T
+        mean[s0:s0 + SIM_BATCH], std[s0:s0 + SIM_BATCH] = sims.mean(axis=1), sims.std(axis=1) + 1e-6
+    return mean, std
+
+
+def listen(units, tracks, hidden, mean, std, noise):
+    """Play fractions the synthetic listener gives `tracks` (noise 0 gives the noiseless ones)."""
+    z = (np.einsum('ij,ij->i', units[tracks], hidden) - mean) / std
+    return np.clip(1.0 / (1.0 + np.exp(-LISTENER_SHARPNESS * (z - LISTENER_BAR))) + noise, 0.0, 1.0)
+
+
+def replay(units, sessions, params):
+    """
+    Replays every session through the Go update, SIM_BATCH sessions at a
+    time: the next track is chosen by the taste vector before it learns from
+    the current one, exactly like Next() does. Returns the picks and play
+    fractions [sessions, steps], the step each taste vector settled at, the
+    final taste vectors and the seconds spent deciding.
+    """
+    n, dim = units.shape
+    count, steps = len(sessions['starts']), sessions['steps']
+    picks = np.full((count, steps), -1, dtype=np.int64)
+    played = np.full((count, steps), np.nan, dtype=np.float32)
+    settled = np.zeros(count)
+    final = np.zeros((count, dim), dtype=np.float32)
+    synthetic = 'hidden' in sessions
+    if synthetic:
+        mean, std = listener_bias(units, sessions['hidden'])
+    deciding = 0.0
+
+    for s0 in range(0, count, SIM_BATCH):
+        rows = slice(s0, s0 + SIM_BATCH)
+        starts = sessions['starts'][rows]
+        batch = np.arange(len(starts))
+        taste = normalize(units[starts].mean(axis=1) + sessions['noise'][rows])
+        current = starts[:, 0]
+        inertia = np.ones(len(starts), dtype=np.float32)
+        seen = np.zeros((len(starts), n), dtype=bool)
+        seen[batch, current] = True
+        tastes = np.zeros((len(starts), steps, dim), dtype=np.float32)
+
+        for t in range(min(steps, n - 1)):
+            start = time.perf_counter()
+            scores = taste @ units.T
+            scores[seen] = -np.inf
+            following = np.argmax(scores, axis=1)
+            deciding += time.perf_counter() - start
+
+            if synthetic:
+                fraction = listen(units, current, sessions['hidden'][rows], mean[rows], std[rows],
+                                  sessions['listener_noise'][rows, t])
+            else:
+                fraction = sessions['fractions'][rows, t]
+            active = ~np.isnan(fraction)
+            fraction = np.where(active, fraction, 0.0).astype(np.float32)
+
+            inertia += fraction
+            rate = np.clip(params['decay'] / inertia, params['min_lr'], params['max_lr'])
+            feedback = np.tanh((fraction - 0.5) * params['steepness']) * FEEDBACK_SCALE
+            learned = normalize(taste + (units[current] - taste) * (rate * feedback)[:, None])
+            taste = np.where(active[:, None], learned, taste)
+
+            picks[rows, t] = np.where(active, current, -1)
+            played[rows, t] = np.where(active, fraction, np.nan)
+            tastes[:, t] = taste
+            current = np.where(active, following, current)
+            seen[batch[active], following[active]] = True
+
+        final[rows] = taste
+        settled[rows] = settle_steps(tastes, taste, picks[rows] >= 0)
+    return picks, played, settled, final, deciding
+
+
+def settle_steps(tastes, final, valid):
+    """Per session, the first step after which the taste vector stays within SETTLED_COS of its final value."""
+    close = (np.einsum('itd,id->it', tastes, final) >= SETTLED_COS) | ~valid
+    # Index of the last step that was still far away, plus one
+    far = ~close
+    return np.where(far.any(axis=1), close.shape[1] - np.argmax(far[:, ::-1], axis=1), 0)
+
+
+def summarize(units, sessions, picks, played, settled, final, deciding):
+    valid = picks >= 0
+    decisions = int(valid.sum())
+    # Spread: how far each pick is from the one before it (1 - cosine)
+    previous, following = picks[:, :-1], picks[:, 1:]
+    pairs = (previous >= 0) & (following >= 0)
+    spread = 1.0 - np.einsum('ij,ij->i', units[previous[pairs]], units[following[pairs]])
+    summary = {
+        "ms_per_decision": deciding / max(decisions, 1) * 1e3,
+        "played": float(np.nanmean(played)),
+        "settled": float(np.median(settled)),
+        "spread": float(spread.mean()) if len(spread) else 0.0,
+        "coverage": len(np.unique(picks[valid])) / len(units),
+    }
+    if 'hidden' in sessions:
+        summary['alignment'] = float(np.einsum('ij,ij->i', final, sessions['hidden']).mean())
+    return summary
+
+
+def single_latency(units, repeats: int = LATENCY_REPEATS):
+    """Milliseconds for one unbatched decision over the whole library, as the device makes them."""
+    rng = np.random.default_rng(0)
+    taste = normalize(rng.standard_normal((1, units.shape[1])).astype(np.float32))[0]
+    seen = np.zeros(len(units), dtype=bool)
+    seen[rng.choice(len(units), size=min(50, len(units)), replace=False)] = True
+    start = time.perf_counter()
+    for _ in range(repeats):
+        scores = units @ taste
+        scores[seen] = -np.inf
+        np.argmax(scores)
+    return (time.perf_counter() - start) / repeats * 1e3
+
+
+def random_baseline(units, sessions):
+    """Mean play fraction the synthetic listener gives tracks picked at random (plain shuffle)."""
+    mean, std = listener_bias(units, sessions['hidden'])
+    rng = np.random.default_rng(1)
+    tracks = rng.choice(len(units), size=len(mean))
+    return float(listen(units, tracks, sessions['hidden'], mean, std, 0.0).mean())
+
+
+def load_recorded(path: str):
+    """Recorded sessions: a JSON list of play-fraction lists, one list per session, in play order."""
+    with open(path, 'r') as f:
+        recorded = json.load(f)
+    recorded = [r for r in recorded if r]
+    if not recorded:
+        raise ValueError(f"{path} holds no sessions")
+    return recorded
+
+
+def simulate(paths, vectors, grid, count: int, steps: int, seed: int = 0, recorded=None):
+    """Replays the same sessions for every parameter set in `grid` and prints one line per set."""
+    units = normalize(np.asarray(vectors, dtype=np.float32))
+    sessions = make_sessions(units, count, steps, seed, recorded)
+    count, steps = len(sessions['starts']), sessions['steps']
+    kind = "recorded" if recorded is not None else "synthetic"
+    print(f"--- Replaying {count} {kind} sessions of up to {steps} tracks over {len(paths)} tracks "
+          f"({units.shape[1]}-d) ---")
+    print(f"Single-session decision: {single_latency(units):.3f} ms on this machine "
+          f"(the Pi scores the same {len(paths)} tracks, only slower)")
+    if recorded is None:
+        print(f"Random shuffle baseline: {random_baseline(units, sessions):.3f} mean play fraction")
+
+    header = (f"{'min_lr':>6} {'max_lr':>6} {'decay':>6} {'steep':>6} | {'ms/dec':>7} {'played':>6} "
+              f"{'settled':>7} {'spread':>6} {'cover':>6}")
+    if recorded is None:
+        header += f" {'align':>6}"
+    print(header)
+    results = []
+    start = time.perf_counter()
+    for values in itertools.product(*(grid[key] for key in GO_PARAMS)):
+        params = dict(zip(GO_PARAMS, values))
+        summary = summarize(units, sessions, *replay(units, sessions, params))
+        results.append((params, summary))
+        marker = "  <- device" if params == GO_PARAMS else ""
+        line = (f"{params['min_lr']:>6g} {params['max_lr']:>6g} {params['decay']:>6g} {params['steepness']:>6g} | "
+                f"{summary['ms_per_decision']:>7.4f} {summary['played']:>6.3f} {summary['settled']:>7.1f} "
+                f"{summary['spread']:>6.3f} {summary['coverage'] * 100:>5.1f}%")
+        if 'alignment' in summary:
+            line += f" {summary['alignment']:>6.3f}"
+        print(line + marker)
+    print(f"{len(results)} parameter sets in {time.perf_counter() - start:.1f}s. played = mean play fraction, "
+          f"settled = median steps until the taste vector stops moving, spread = 1 - cosine between "
+          f"consecutive picks, cover = share of the library ever picked"
+          + (", align = cosine of the final taste to the listener's hidden taste." if recorded is None else "."))
+    return results
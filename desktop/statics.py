@@ -1,4 +1,52 @@
+import os
+
 DEFAULT_MUSIC_DIR = "./music"  # Current folder by default
-RAW_DB_FILE = "raw_features.json" # Local storage of big vectors
+RAW_DB_FILE = "raw_features.json" # Legacy JSON storage of big vectors (migrated on first run)
+RAW_STORE_FILE = "raw_features.f32"        # Local storage of big vectors (float32 matrix)
+RAW_INDEX_FILE = "raw_features.index.json" # Path -> row index into RAW_STORE_FILE
+JOURNAL_FILE = "raw_features.journal"      # Vectors analyzed by a process run that is not compacted yet
+MANIFEST_FILE = "manifest.json"            # Size, mtime and fingerprint each embedding was computed from
+DIR_CACHE_FILE = "dircache.json"           # Directory listings keyed on directory mtime
+PROJECTION_FILE = "projection.npz"         # Fitted dimensionality reduction for the exported library
+RUN_SUMMARY_FILE = "process_summary.json"  # Timings, throughput and skipped files of the last process run
+MEL_CACHE_DIR = "melcache"                 # Cached log-mel features, see mel_cache.py
+DUPLICATES_FILE = "duplicates.json"        # Duplicate clusters found by dedupe and the copies left out of the export
+GRAPH_STATE_FILE = "graph.npz"             # Neighbour graph of the last export, updated incrementally
+CLUSTER_STATE_FILE = "clusters.npz"        # Mood clusters of the last export, see clusters.py
+SHARDS_DIR = "shards"                      # Output of process --shard runs, one directory per shard
+SHARD_META_FILE = "shard.json"             # Describes the shard in each shard directory
+RENAME_CACHE_FILE = ".rename_cache.json"   # Corrected names from rename_files.py
 LIBRARY_FILE = "library.json"     # The file synced to Pi (small vectors)
+LIBRARY_BIN_FILE = "library.bin"  # Binary alternative to LIBRARY_FILE with quantized vectors
+ANN_INDEX_FILE = "library.ivf"    # Inverted-file nearest neighbour index over the exported vectors
+GRAPH_FILE = "library.graph"      # Top-k most similar tracks of every track, see graph.py
+CLUSTERS_FILE = "library.clusters"  # Mood cluster centroids and the cluster of every track
+SYNCED_EXPORTS = (LIBRARY_BIN_FILE, ANN_INDEX_FILE, GRAPH_FILE, CLUSTERS_FILE)  # Exports sync replaces whole when they changed
 SUPPORTED_EXTS = ('.mp3', '.flac', '.wav', '.m4a')
+LOCAL_ONLY_FILES = (RAW_DB_FILE, RAW_DB_FILE + ".migrated", RAW_STORE_FILE, RAW_INDEX_FILE, JOURNAL_FILE,
+                    MANIFEST_FILE, DIR_CACHE_FILE, PROJECTION_FILE,
+                    RUN_SUMMARY_FILE, MEL_CACHE_DIR, DUPLICATES_FILE, GRAPH_STATE_FILE, CLUSTER_STATE_FILE, SHARDS_DIR,
+                    RENAME_CACHE_FILE,
+                    "process_profile.prof", "process_profile.trace.json")
+
+SAMPLE_RATE = 32000     # Rate the PANNs models were trained on
+CLIP_DURATION = 120     # Seconds of audio embedded per track
+DEFAULT_MODEL = "cnn6"  # Embedding backend, see embedders.py
+LEGACY_MODEL_TAG = "cnn6@1"  # Backend of vectors stored before backends were tracked
+DEFAULT_BATCH_SIZE = 4  # Tracks per forward pass (a 120s clip is ~200MB of activations)
+DEFAULT_DECODE_WORKERS = min(4, max(1, (os.cpu_count() or 2) - 1))
+DEFAULT_CHECKPOINT_EVERY = 50     # Files between journal flushes
+DEFAULT_CHECKPOINT_SECONDS = 60.0 # Max seconds between journal flushes
+DEFAULT_WALK_WORKERS = 8          # Threads listing directories concurrently
+DEFAULT_REDUCED_DIMS = 64         # Width of the exported vectors when a reduction is used
+DEFAULT_MEL_CACHE_MB = 0          # Mel cache size cap; a 120s track takes ~1.5MB
+DEFAULT_SAMPLING = "head"         # "head" embeds the first CLIP_DURATION seconds, "segments" short windows
+DEFAULT_SEGMENT_POSITIONS = (20, 50, 80)  # Window centres in percent of the track
+DEFAULT_SEGMENT_SECONDS = 10.0            # Length of each window
+DEFAULT_DEDUPE_THRESHOLD = 0.97  # Cosine similarity above which two tracks may be copies
+DEFAULT_DEDUPE_STRICT = 0.995    # Above this the filenames are not compared
+DEFAULT_GRAPH_K = 0              # Neighbours per track in the exported graph (0 = no graph)
+DEFAULT_CLUSTERS = 0             # Mood clusters exported with the library (0 = no clusters)
+DEFAULT_WATCH_SETTLE = 5.0       # Seconds without changes (and since a file's mtime) before watch analyzes
+DEFAULT_POLL_INTERVAL = 5.0      # Seconds between listings when watch cannot use inotify
+WATCH_MAX_DELAY = 60.0           # Longest watch waits for changes to settle before analyzing anyway
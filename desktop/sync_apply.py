@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import shutil
+import itertools
+
+# Device side of `pipod_manager.py sync`. Runs on the Pi, either imported
+# (--local transport) or piped to `python3 -` over ssh, so it may only use
+# the standard library and the modules shipped in the staging directory.
+#
+# The desktop uploads new audio files in place, then a staging directory
+# holding patch.json, any export files that are replaced whole and the
+# json_stream module (with utils.py) to patch library.json with. Applying
+# the patch moves and deletes audio, patches library.json, swaps in the
+# staged exports and finally writes the sync state. Every step can be
+# repeated, so a sync that is interrupted halfway is simply run again.
+
+STATE_FILE = ".pipod_sync.json"
+STAGING_DIR = ".pipod_staging"
+PATCH_FILE = "patch.json"
+LIBRARY_JSON = "library.json"
+
+
+def prune_dirs(dest, rel_path):
+    """Removes directories left empty by a move or delete, up to dest."""
+    parent = os.path.dirname(os.path.join(dest, rel_path))
+    while os.path.normpath(parent) != os.path.normpath(dest):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
+
+
+def apply_library(dest, lib):
+    """Streams library.json into a patched copy and swaps it in; returns the track count."""
+    from json_stream import iter_entries, write_entries
+
+    path = os.path.join(dest, LIBRARY_JSON)
+    skip = set(lib['remove']) | set(lib['add']) | set(lib['update'])
+
+    # The track metadata sits before "files", so it is read with the first entry
+    header = {}
+    existing = iter_entries(path, "files", header)
+    first = next(existing, None)
+    meta = {p: m for p, m in header.get('meta', {}).items() if p not in skip}
+    meta.update(lib.get('meta', {}))
+
+    def entries():
+        for rel_path, vec in itertools.chain([first] if first else [], existing):
+            if rel_path not in skip:
+                yield rel_path, vec
+        yield from lib['add'].items()
+        yield from lib['update'].items()
+
+    return write_entries(path, entries(), field="files", header={"dir": lib['dir'], "meta": meta})
+
+
+def apply_patch(dest):
+    staging = os.path.join(dest, STAGING_DIR)
+    sys.path.insert(0, staging)
+    from utils import atomic_write_json
+
+    with open(os.path.join(staging, PATCH_FILE), 'r') as f:
+        patch = json.load(f)
+
+    for old, new in patch['moves'].items():
+        src, dst = os.path.join(dest, old), os.path.join(dest, new)
+        if os.path.exists(src):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+            prune_dirs(dest, old)
+
+    for rel_path in patch['deletes']:
+        try:
+            os.remove(os.path.join(dest, rel_path))
+        except FileNotFoundError:
+            pass
+        prune_dirs(dest, rel_path)
+
+    if patch['library'] is not None:
+        total = apply_library(dest, patch['library'])
+        print(f"Patched {LIBRARY_JSON} ({total} tracks)")
+
+    for name in patch['exports']:
+        os.replace(os.path.join(staging, name), os.path.join(dest, name))
+
+    # Written last: until here the next sync plans against the old state
+    atomic_write_json(patch['state'], os.path.join(dest, STATE_FILE))
+    shutil.rmtree(staging)
+    print(f"Applied sync patch: {len(patch['moves'])} moved, {len(patch['deletes'])} deleted, "
+          f"{len(patch['exports'])} exports replaced")
+
+
+if __name__ == "__main__":
+    apply_patch(sys.argv[1])
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import platform
+from contextlib import contextmanager
+
+from utils import atomic_write_json
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its finished children, in MiB."""
+    if resource is None:
+        return None
+    peak = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        peak = max(peak, resource.getrusage(who).ru_maxrss)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class RunStats:
+    """
+    Per-stage timers and counters for a `process` run, a live progress
+    line with throughput and ETA, and a JSON summary at the end.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+        self.loop_started = None
+        self.stages = {}
+        self.counters = {}
+        self.skipped = []
+        self._live = sys.stdout.isatty()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry['seconds'] += time.perf_counter() - start
+            entry['calls'] += 1
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def skip(self, path: str, reason: str):
+        self.skipped.append({"path": path, "reason": reason})
+        self.count("skipped")
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def start_loop(self):
+        """Starts the throughput clock, so model loading does not count against it."""
+        self.loop_started = time.perf_counter()
+
+    def loop_elapsed(self):
+        return time.perf_counter() - (self.loop_started or self.started)
+
+    def progress(self, rel_path: str):
+        """Advances by one file and redraws the progress line."""
+        self.done += 1
+        rate = self.done / max(self.loop_elapsed(), 1e-9)
+        eta = format_eta((self.total - self.done) / rate) if rate > 0 else "--:--:--"
+        line = (f"[{self.done}/{self.total}] {rate:.2f} files/s, ETA {eta} | "
+                f"Analyzing: {rel_path}")
+        if self._live:
+            width = os.get_terminal_size().columns - 1
+            print("\r" + line[:width].ljust(width), end="", flush=True)
+        else:
+            print(line)
+
+    def end_progress(self):
+        if self._live and self.done:
+            print()
+
+    def summary(self):
+        elapsed = self.elapsed()
+        return {
+            "files_total": self.total,
+            "files_seen": self.done,
+            "elapsed_s": round(elapsed, 3),
+            "files_per_s": round(self.counters.get("embedded", 0) / max(self.loop_elapsed(), 1e-9), 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {name: {"seconds": round(s['seconds'], 3), "calls": s['calls'],
+                              "share": round(s['seconds'] / max(elapsed, 1e-9), 3)}
+                       for name, s in self.stages.items()},
+            "counters": self.counters,
+            "skipped": self.skipped,
+        }
+
+    def report(self):
+        summary = self.summary()
+        print(f"Analyzed {summary['counters'].get('embedded', 0)} files in {summary['elapsed_s']:.1f}s "
+              f"({summary['files_per_s']:.2f} files/s), peak RSS {summary['peak_rss_mb'] or 0:.0f} MiB")
+        for name, s in sorted(summary['stages'].items(), key=lambda kv: -kv[1]['seconds']):
+            print(f"  {name:<12} {s['seconds']:9.2f}s  {s['share'] * 100:5.1f}%  ({s['calls']} calls)")
+        if self.skipped:
+            print(f"  Skipped {len(self.skipped)} corrupt files, see the run summary")
+
+    def save(self, path: str, extra=None):
+        atomic_write_json({**(extra or {}), **self.summary()}, path, indent=2)
+        print(f"Saved run summary to {path}")
+
+
+@contextmanager
+def profiled(kind: str, out_prefix: str):
+    """
+    Runs the block under cProfile ("cprofile") or torch.profiler ("torch")
+    and writes the capture next to `out_prefix`; kind=None does nothing.
+    """
+    if not kind:
+        yield
+        return
+
+    if kind == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = out_prefix + ".prof"
+            profiler.dump_stats(path)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+            print(f"Saved cProfile capture to {path} (open with snakeviz or pstats)")
+        return
+
+    import torch
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities) as profiler:
+        yield
+    path = out_prefix + ".trace.json"
+    profiler.export_chrome_trace(path)
+    print(profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=15))
+    print(f"Saved torch.profiler trace to {path} (open in chrome://tracing or Perfetto)")
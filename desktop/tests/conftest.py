@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The desktop tools are flat scripts importing their siblings by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
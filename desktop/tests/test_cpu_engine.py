@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchlibrosa")
+
+from cpu_engine import PARITY_TOLERANCE, build_cpu_engine, check_parity, load_cpu_engine
+from embedders import Cnn6Backend, Cnn10Backend
+
+
+def random_model(backend_cls):
+    """A PANNs model with random weights and BatchNorm statistics, so the folding has work to do."""
+    from pytorch import models
+
+    torch.manual_seed(0)
+    params = {k: v for k, v in backend_cls.frontend.items() if k != "clip_duration"}
+    model = getattr(models, backend_cls.model_cls)(classes_num=527, **params)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+    return model.eval()
+
+
+@pytest.mark.parametrize("backend_cls", [Cnn6Backend, Cnn10Backend])
+def test_fused_engine_matches_eager_model(backend_cls):
+    model = random_model(backend_cls)
+    assert check_parity(model, build_cpu_engine(model)) <= PARITY_TOLERANCE
+
+
+def test_saved_engine_is_reused(tmp_path):
+    model = random_model(Cnn6Backend)
+    checkpoint = str(tmp_path / "Cnn6.pth")
+    with open(checkpoint, 'wb') as f:
+        f.write(b"stand-in checkpoint")
+
+    traced = load_cpu_engine(model, checkpoint)
+    saved = str(tmp_path / "Cnn6.cpu.pt")
+    assert os.path.exists(saved)
+    built_at = os.path.getmtime(saved)
+
+    loaded = load_cpu_engine(model, checkpoint)
+    assert os.path.getmtime(saved) == built_at
+    audio = torch.zeros(1, 32000).uniform_(-0.5, 0.5)
+    with torch.inference_mode():
+        assert torch.allclose(traced(audio), loaded(audio))
+
+    # A newer checkpoint makes the saved engine stale
+    os.utime(checkpoint, (built_at + 10, built_at + 10))
+    load_cpu_engine(model, checkpoint)
+    assert os.path.getmtime(saved) > built_at
@@ -0,0 +1,38 @@
+import numpy as np
+
+import dedupe
+from embedding_store import EmbeddingStore
+
+
+def make_store(root, durations):
+    store = EmbeddingStore(root)
+    rng = np.random.default_rng(0)
+    vec = rng.standard_normal(16)
+    for rel_path, duration in durations.items():
+        store.put(rel_path, vec + rng.standard_normal(16) * 1e-4, "dsp@1")
+        if duration is not None:
+            store.set_meta(rel_path, {"gain": 0.0, "duration": duration, "bpm": 120.0})
+    return store
+
+
+def test_durations_come_from_the_store(tmp_path, monkeypatch):
+    store = make_store(str(tmp_path), {"a/song.flac": 200.0, "b/song.mp3": 200.5, "c/song.wav": 260.0})
+    read = []
+    monkeypatch.setattr(dedupe, "header_duration", lambda path: read.append(path))
+
+    clusters = dedupe.find_duplicates(str(tmp_path), store, 0.97, 0.995, 2.0, 0.6)
+
+    assert read == []
+    # c/song.wav is a minute longer, so not a copy
+    assert [(c['keep'], c['drop']) for c in clusters] == [("a/song.flac", ["b/song.mp3"])]
+
+
+def test_header_is_read_only_without_a_stored_duration(tmp_path, monkeypatch):
+    store = make_store(str(tmp_path), {"a/song.flac": 200.0, "b/song.mp3": None})
+    read = []
+    monkeypatch.setattr(dedupe, "header_duration", lambda path: read.append(path) or 201.0)
+
+    clusters = dedupe.find_duplicates(str(tmp_path), store, 0.97, 0.995, 2.0, 0.6)
+
+    assert read == [str(tmp_path / "b" / "song.mp3")]
+    assert [c['drop'] for c in clusters] == [["b/song.mp3"]]
@@ -0,0 +1,124 @@
+import os
+import json
+
+import numpy as np
+
+from statics import LIBRARY_FILE
+from manifest import describe, save_manifest
+from library_export import export_library
+from delta_sync import LocalTransport, delta_sync
+
+DIM = 8
+
+
+def write_library(root, tracks, meta=None):
+    """Stands in for 'process': writes the audio files, their manifest and library.json."""
+    for rel_path, (content, _) in tracks.items():
+        full_path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if not os.path.exists(full_path):
+            with open(full_path, 'wb') as f:
+                f.write(content)
+    save_manifest({p: describe(os.path.join(root, p)) for p in tracks}, root)
+    paths = sorted(tracks)
+    vectors = np.array([tracks[p][1] for p in paths], dtype=np.float32)
+    metas = [(meta or {}).get(p) for p in paths]
+    export_library(os.path.join(root, LIBRARY_FILE), '/home/pipod/music', paths, vectors, "json", metas)
+
+
+def audio_files(root):
+    found = {}
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(".mp3"):
+                full_path = os.path.join(dirpath, name)
+                with open(full_path, 'rb') as f:
+                    found[os.path.relpath(full_path, root)] = f.read()
+    return found
+
+
+def read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def assert_in_sync(root, dest):
+    assert audio_files(dest) == audio_files(root)
+    assert read_json(os.path.join(dest, LIBRARY_FILE)) == read_json(os.path.join(root, LIBRARY_FILE))
+
+
+def make_tracks():
+    rng = np.random.default_rng(0)
+    return {
+        "a.mp3": (b"a" * 100, rng.standard_normal(DIM).round(4).tolist()),
+        "b.mp3": (b"b" * 200, rng.standard_normal(DIM).round(4).tolist()),
+        os.path.join("sub", "c.mp3"): (b"c" * 300, rng.standard_normal(DIM).round(4).tolist()),
+    }
+
+
+def test_first_sync_sends_everything(tmp_path):
+    root, dest = str(tmp_path / "music"), str(tmp_path / "device")
+    write_library(root, make_tracks(), {"a.mp3": {"gain": -3.5, "duration": 180.0, "bpm": 120.0}})
+
+    plan = delta_sync(root, LocalTransport(dest))
+
+    assert sorted(plan.upload) == sorted(make_tracks())
+    assert LIBRARY_FILE in plan.exports
+    assert_in_sync(root, dest)
+
+
+def test_second_sync_is_a_no_op(tmp_path):
+    root, dest = str(tmp_path / "music"), str(tmp_path / "device")
+    write_library(root, make_tracks())
+    delta_sync(root, LocalTransport(dest))
+
+    plan = delta_sync(root, LocalTransport(dest))
+
+    assert not any(plan)
+    assert_in_sync(root, dest)
+
+
+def test_move_delete_and_reembed_round_trip(tmp_path):
+    root, dest = str(tmp_path / "music"), str(tmp_path / "device")
+    tracks = make_tracks()
+    write_library(root, tracks)
+    delta_sync(root, LocalTransport(dest))
+
+    # Move a.mp3, delete b.mp3 and re-embed sub/c.mp3 without touching its audio
+    moved_to = os.path.join("moved", "a.mp3")
+    os.makedirs(os.path.join(root, "moved"))
+    os.replace(os.path.join(root, "a.mp3"), os.path.join(root, moved_to))
+    tracks[moved_to] = tracks.pop("a.mp3")
+    os.remove(os.path.join(root, "b.mp3"))
+    del tracks["b.mp3"]
+    c = os.path.join("sub", "c.mp3")
+    tracks[c] = (tracks[c][0], [-v for v in tracks[c][1]])
+    write_library(root, tracks)
+
+    plan = delta_sync(root, LocalTransport(dest))
+
+    assert plan.upload == []
+    assert plan.moved == {"a.mp3": moved_to}
+    assert plan.deleted == ["b.mp3"]
+    assert plan.lib_add == [moved_to]
+    assert plan.lib_update == [c]
+    assert sorted(plan.lib_remove) == ["a.mp3", "b.mp3"]
+    assert LIBRARY_FILE not in plan.exports
+    assert_in_sync(root, dest)
+    assert not any(delta_sync(root, LocalTransport(dest)))
+
+
+def test_files_missing_from_the_manifest_are_synced_by_what_is_on_disk(tmp_path):
+    root, dest = str(tmp_path / "music"), str(tmp_path / "device")
+    write_library(root, make_tracks())
+    # Not processed yet (or skipped as corrupt): on disk, not in the manifest
+    with open(os.path.join(root, "new.mp3"), 'wb') as f:
+        f.write(b"n" * 50)
+    # Processed, then deleted before the sync: in the manifest, not on disk
+    os.remove(os.path.join(root, "b.mp3"))
+
+    plan = delta_sync(root, LocalTransport(dest))
+
+    assert "new.mp3" in plan.upload
+    assert "b.mp3" not in plan.upload
+    assert audio_files(dest) == audio_files(root)
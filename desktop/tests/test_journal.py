@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from journal import Journal, encode_record, MAX_MODEL_LEN
+from sampling import parse_layout, embedding_tag
+from embedders import get_backend
+
+
+def test_longest_tag_round_trips_with_and_without_meta(tmp_path):
+    tag = "x" * MAX_MODEL_LEN
+    vec = np.arange(4, dtype=np.float32)
+    meta = {"gain": -3.0, "duration": 200.0, "bpm": None}
+    journal = Journal(str(tmp_path / "journal"), flush_every=1)
+    journal.append("a.mp3", tag, vec, meta)
+    journal.append("b.mp3", tag, vec)
+
+    records = list(journal.replay())
+
+    assert [(p, m, r) for p, m, _, r in records] == [("a.mp3", tag, meta), ("b.mp3", tag, None)]
+    assert all(np.array_equal(v, vec) for _, _, v, _ in records)
+
+
+def test_longer_tags_are_rejected():
+    with pytest.raises(ValueError):
+        encode_record("a.mp3", "x" * (MAX_MODEL_LEN + 1), np.zeros(4))
+
+    backend_cls = get_backend("dsp")
+    assert embedding_tag(backend_cls, parse_layout("segments", [20, 50, 80], 10.0)) == "dsp@1/seg20,50,80x10"
+    with pytest.raises(ValueError):
+        embedding_tag(backend_cls, parse_layout("segments", [p + 0.5 for p in range(40)], 10.0))
@@ -0,0 +1,18 @@
+import os
+
+import numpy as np
+import pytest
+
+from library_export import export_library, read_library
+
+
+@pytest.mark.parametrize("fmt", ["json", "f16", "int8"])
+def test_empty_library_exports(tmp_path, fmt):
+    path = str(tmp_path / ("library.json" if fmt == "json" else "library.bin"))
+
+    export_library(path, '/home/pipod/music', [], np.zeros((0, 0), dtype=np.float32), fmt, [])
+
+    paths, vectors = read_library(path)
+    assert paths == []
+    assert len(vectors) == 0
+    assert os.path.getsize(path) > 0
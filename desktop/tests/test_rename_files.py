@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from statics import RENAME_CACHE_FILE
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rename_files.py")
+CORRECTED = {
+    "Artist_-_01_First_Song.flac": "01 - First Song.flac",
+    "02.second song (live).flac": "02 - Second Song (Live).flac",
+}
+
+
+class StubModel(BaseHTTPRequestHandler):
+    """Answers chat completions like a local LM Studio server, from CORRECTED."""
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+        StubModel.requests.append(prompt)
+        asked = sorted((name for name in CORRECTED if name in prompt), key=prompt.index)
+        content = CORRECTED[asked[0]] if len(asked) == 1 else json.dumps([CORRECTED[n] for n in asked])
+        reply = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": body['model'],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubModel)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubModel.requests = []
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def rename(root, url):
+    env = {k: v for k, v in os.environ.items() if "proxy" not in k.lower()}
+    result = subprocess.run([sys.executable, SCRIPT, root, "--local", "--url", url, "--retries", "0"],
+                            input="y\n", capture_output=True, text=True, env=env, timeout=120)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def test_renames_through_the_local_server_then_uses_the_cache(tmp_path, stub_url):
+    root = str(tmp_path / "music")
+    for name in CORRECTED:
+        touch(os.path.join(root, "album", name))
+    touch(os.path.join(root, "album", "03 - Already Fine.flac"))
+
+    rename(root, stub_url)
+
+    assert sorted(os.listdir(os.path.join(root, "album"))) == sorted([*CORRECTED.values(), "03 - Already Fine.flac"])
+    assert len(StubModel.requests) == 1  # one batch, the well-formed name is not asked about
+    with open(os.path.join(root, RENAME_CACHE_FILE), 'r') as f:
+        assert json.load(f) == CORRECTED
+
+    # The same badly named file in another album is renamed from the cache
+    name = next(iter(CORRECTED))
+    touch(os.path.join(root, "other", name))
+
+    output = rename(root, stub_url)
+
+    assert "0 unique names need the model" in output
+    assert len(StubModel.requests) == 1
+    assert os.listdir(os.path.join(root, "other")) == [CORRECTED[name]]
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import subprocess
+
+import numpy as np
+import pytest
+
+from statics import SHARD_META_FILE
+from embedding_store import EmbeddingStore
+from sharding import shard_dir, find_shards
+
+MANAGER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pipod_manager.py")
+SAMPLE_RATE = 32000
+
+
+def run(root, *args):
+    """Runs pipod_manager in a process of its own, as a separate node would."""
+    return subprocess.Popen([sys.executable, MANAGER, "--dir", root, *args],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def finish(proc):
+    output, _ = proc.communicate(timeout=300)
+    assert proc.returncode == 0, output
+    return output
+
+
+def make_library(root, count=8):
+    import soundfile as sf
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        rel_path = os.path.join("sub", f"t{i}.wav") if i % 2 else f"t{i}.wav"
+        os.makedirs(os.path.dirname(os.path.join(root, rel_path)), exist_ok=True)
+        audio = rng.standard_normal(SAMPLE_RATE * 3) * 0.02 * (i + 1)
+        sf.write(os.path.join(root, rel_path), audio.astype(np.float32), SAMPLE_RATE)
+        paths.append(rel_path)
+    return paths
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    """A library embedded by two concurrent 'process --shard i/2' runs, not merged yet."""
+    root = str(tmp_path / "music")
+    paths = make_library(root)
+    procs = [run(root, "process", "--model", "dsp", "--decode-workers", "0", "--shard", f"{i}/2")
+             for i in (1, 2)]
+    for proc in procs:
+        finish(proc)
+    return root, paths
+
+
+def test_merge_collects_every_shard(sharded):
+    root, paths = sharded
+    shards = [EmbeddingStore(shard_dir(root, i, 2)) for i in (1, 2)]
+    assert all(len(s) for s in shards)
+    assert not set(shards[0].paths()) & set(shards[1].paths())
+    embedded = {p: (s.get(p).copy(), s.model_of(p)) for s in shards for p in s.paths()}
+
+    output = finish(run(root, "merge", "--clean"))
+
+    assert "0 conflicts" in output
+    store = EmbeddingStore(root)
+    assert sorted(store.paths()) == sorted(paths)
+    for rel_path, (vec, model) in embedded.items():
+        assert np.array_equal(store.get(rel_path), vec)
+        assert store.model_of(rel_path) == model
+    assert find_shards(root) == []
+
+
+@pytest.mark.parametrize("key, value", [("model", "cnn6@1"), ("store_version", 999)])
+def test_merge_rejects_mismatched_shards(sharded, key, value):
+    root, _ = sharded
+    meta_path = os.path.join(shard_dir(root, 2, 2), SHARD_META_FILE)
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    meta[key] = value
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    output = finish(run(root, "merge", "--clean"))
+
+    assert "Error: The shards cannot be merged" in output
+    assert len(EmbeddingStore(root)) == 0
+    assert len(find_shards(root)) == 2
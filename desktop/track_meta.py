@@ -0,0 +1,85 @@
+import numpy as np
+from scipy.signal import lfilter
+
+# Per-track metadata measured on the audio decoded for embedding, so no
+# file is read twice: ReplayGain 2.0 style gain from the BS.1770 integrated
+# loudness, the true duration and an estimated tempo. Kept free of torch,
+# like decoder.py, because it runs in the decode workers.
+
+REFERENCE_LUFS = -18.0  # ReplayGain 2.0 reference level
+BLOCK_SECONDS = 0.4     # BS.1770 gating block
+BLOCK_STEP = 0.1        # 75% block overlap
+ABSOLUTE_GATE = -70.0   # LUFS
+RELATIVE_GATE = -10.0   # LU below the absolutely gated loudness
+TEMPO_HOP = 512
+
+
+def k_weighting(sr: int):
+    """
+    The two BS.1770 K-weighting stages as (b, a) pairs for any sample rate,
+    derived like libebur128 does so that 48 kHz gives the standard's table.
+    """
+    # Stage 1: high shelf modelling the acoustic effect of the head
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / sr)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = (np.array([vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k]) / a0,
+             np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]))
+
+    # Stage 2: the RLB high pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / sr)
+    a0 = 1 + k / q + k * k
+    high_pass = (np.array([1.0, -2.0, 1.0]),
+                 np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]))
+    return [shelf, high_pass]
+
+
+def block_powers(audio, sr: int):
+    """Mean square of the K-weighted signal over every 400 ms gating block."""
+    for b, a in k_weighting(sr):
+        audio = lfilter(b, a, audio)
+    size, step = int(BLOCK_SECONDS * sr), int(BLOCK_STEP * sr)
+    if len(audio) < size:
+        return np.zeros(0)
+    csum = np.concatenate([[0.0], np.cumsum(audio.astype(np.float64) ** 2)])
+    starts = np.arange(0, len(audio) - size + 1, step)
+    return (csum[starts + size] - csum[starts]) / size
+
+
+def integrated_loudness(windows, sr: int):
+    """Gated integrated loudness in LUFS of the decoded windows, or None for silence."""
+    # The decoder downmixes to mono; BS.1770 sums channel powers, so the
+    # downmix counts as the same signal on both channels ("dual mono")
+    z = np.concatenate([block_powers(w, sr) for w in windows]) * 2
+    with np.errstate(divide='ignore'):
+        levels = -0.691 + 10 * np.log10(z)
+    z = z[levels > ABSOLUTE_GATE]
+    if len(z) == 0:
+        return None
+    relative = -0.691 + 10 * np.log10(z.mean()) + RELATIVE_GATE
+    z = z[-0.691 + 10 * np.log10(z) > relative]
+    return float(-0.691 + 10 * np.log10(z.mean()))
+
+
+def estimate_bpm(windows, sr: int):
+    """Tempo from the autocorrelation of the onset envelope, the median over windows."""
+    import librosa
+    tempos = []
+    for w in windows:
+        envelope = librosa.onset.onset_strength(y=w, sr=sr, hop_length=TEMPO_HOP)
+        if envelope.any():
+            tempos.append(librosa.feature.tempo(onset_envelope=envelope, sr=sr, hop_length=TEMPO_HOP)[0])
+    return float(np.median(tempos)) if tempos else 0.0
+
+
+def measure(windows, sr: int, duration: float):
+    """{"gain", "duration", "bpm"} for a track; gain is 0 dB for silent tracks, bpm 0 when unknown."""
+    lufs = integrated_loudness(windows, sr)
+    return {
+        "gain": round(REFERENCE_LUFS - lufs, 2) if lufs is not None else 0.0,
+        "duration": round(float(duration), 2),
+        "bpm": round(estimate_bpm(windows, sr), 1),
+    }
@@ -0,0 +1,27 @@
+import os
+import json
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """
+    Opens a temporary file next to `path` and renames it over `path` only
+    once the block finished without errors, so readers (and a crash halfway
+    through a write) never see a partially written file.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def atomic_write_json(data, path, **kwargs):
+    with atomic_open(path, 'w') as f:
+        json.dump(data, f, **kwargs)
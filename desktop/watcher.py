@@ -0,0 +1,115 @@
+import os
+import time
+
+from statics import SUPPORTED_EXTS
+from discovery import scan_dir
+
+# inotify is optional (pip install inotify_simple, Linux only); without it
+# the music folder is polled
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+def is_relevant(rel_path: str, is_dir: bool):
+    """Only audio files and directories matter; the library exports next to them do not."""
+    return is_dir or rel_path.lower().endswith(SUPPORTED_EXTS)
+
+
+class InotifyWatcher:
+    """Reports changed paths from inotify events, with a watch on every directory."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.inotify = INotify()
+        self.mask = (flags.CREATE | flags.CLOSE_WRITE | flags.DELETE | flags.MOVED_FROM
+                     | flags.MOVED_TO | flags.DELETE_SELF)
+        self.dirs = {}  # watch descriptor -> relative directory
+        self.add_tree("")
+
+    def add_tree(self, rel_dir: str):
+        for full_dir, _, _ in os.walk(os.path.join(self.root, rel_dir)):
+            try:
+                wd = self.inotify.add_watch(full_dir, self.mask)
+            except OSError:
+                # Removed again already, or out of watches (fs.inotify.max_user_watches)
+                continue
+            rel = os.path.relpath(full_dir, self.root)
+            self.dirs[wd] = "" if rel == "." else rel
+
+    def wait(self, timeout=None):
+        """Blocks up to `timeout` seconds (None = until something happens); returns the changed paths."""
+        changed = set()
+        events = self.inotify.read(timeout=None if timeout is None else int(timeout * 1000))
+        for event in events:
+            if event.mask & flags.Q_OVERFLOW:
+                # Events were dropped: the next round still walks the whole tree
+                changed.add("")
+                continue
+            rel_dir = self.dirs.get(event.wd)
+            if rel_dir is None:
+                continue
+            if event.mask & flags.IGNORED:
+                del self.dirs[event.wd]
+                continue
+            rel_path = os.path.join(rel_dir, event.name) if event.name else rel_dir
+            is_dir = bool(event.mask & flags.ISDIR)
+            if is_dir and event.mask & (flags.CREATE | flags.MOVED_TO):
+                self.add_tree(rel_path)
+            if is_relevant(rel_path, is_dir):
+                changed.add(rel_path)
+        return changed
+
+
+class PollingWatcher:
+    """
+    Finds changes by walking the tree every `interval` seconds. Directories
+    whose mtime did not change are not listed again, only their files are
+    stat'ed.
+    """
+
+    def __init__(self, root: str, interval: float):
+        self.root = root
+        self.interval = interval
+        self.listings = {}
+        self.files = self.snapshot()
+
+    def snapshot(self):
+        files, listings = {}, {}
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            _, listing = scan_dir(self.root, rel_dir, self.listings.get(rel_dir))
+            if listing is None:
+                continue  # removed while walking
+            listings[rel_dir] = listing
+            stack.extend(os.path.join(rel_dir, name) for name in listing['dirs'])
+            for name, stat in listing['files'].items():
+                files[os.path.join(rel_dir, name)] = tuple(stat)
+        self.listings = listings
+        return files
+
+    def wait(self, timeout=None):
+        """Polls until something changed or `timeout` seconds passed; returns the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else deadline - time.monotonic()
+            time.sleep(max(0.0, min(self.interval, remaining)))
+            files = self.snapshot()
+            changed = {p for p in files.keys() | self.files.keys() if files.get(p) != self.files.get(p)}
+            self.files = files
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+def open_watcher(root: str, poll: bool, interval: float):
+    if not poll and INotify is not None:
+        try:
+            return InotifyWatcher(root)
+        except OSError as e:
+            print(f"Note: inotify is not available ({e}), polling instead.")
+    elif not poll:
+        print("Note: inotify_simple is not installed, polling instead (pip install inotify_simple).")
+    print(f"Polling {root} every {interval:g}s.")
+    return PollingWatcher(root, interval)
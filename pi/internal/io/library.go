@@ -1,6 +1,7 @@
 package io
 
 import (
+	"bufio"
 	"encoding/json"
 	"fmt"
 	"os"
@@ -10,6 +11,17 @@ import (
 type MusicLibrary struct {
 	Dir   string               `json:"dir"`
 	Files map[string][]float32 `json:"Files"`
+	// Measured by the desktop from the same decode as the embedding; tracks
+	// analyzed before the metadata existed have no entry
+	Meta map[string]TrackMeta `json:"meta"`
+}
+
+// TrackMeta holds the ReplayGain 2.0 style gain (dB, relative to -18 LUFS),
+// the duration in seconds and the estimated tempo (0 when unknown).
+type TrackMeta struct {
+	Gain     float32 `json:"gain"`
+	Duration float32 `json:"duration"`
+	BPM      float32 `json:"bpm"`
 }
 
 func (ml *MusicLibrary) Filenames() []string {
@@ -41,24 +53,35 @@ func LoadMusicLibary(path string) (*MusicLibrary, error) {
 	defer file.Close()
 
 	var lib MusicLibrary
-	decoder := json.NewDecoder(file)
-	if err := decoder.Decode(&lib); err != nil {
-		return nil, err
+	if filepath.Ext(path) == ".bin" {
+		if err := decodeBinaryLibrary(bufio.NewReader(file), &lib); err != nil {
+			return nil, err
+		}
+	} else {
+		decoder := json.NewDecoder(file)
+		if err := decoder.Decode(&lib); err != nil {
+			return nil, err
+		}
 	}
 
 	updatedMap := make(map[string][]float32)
+	updatedMeta := make(map[string]TrackMeta, len(lib.Meta))
 	for path, embeddings := range lib.Files {
 		fullPath := filepath.Join(lib.Dir, path)
 		delete(lib.Files, path)
 
 		if fileExists(fullPath) {
 			updatedMap[fullPath] = embeddings
+			if meta, ok := lib.Meta[path]; ok {
+				updatedMeta[fullPath] = meta
+			}
 		} else {
 			fmt.Printf("Removing '%s' from library as file does not exist on local drive\n", fullPath)
 		}
 	}
 
 	lib.Files = updatedMap
+	lib.Meta = updatedMeta
 
 	return &lib, nil
 }
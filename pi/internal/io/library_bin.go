@@ -0,0 +1,135 @@
+package io
+
+import (
+	"bufio"
+	"encoding/binary"
+	"fmt"
+	goio "io"
+	"math"
+)
+
+// Binary library written by `pipod_manager.py process --format f16|int8`.
+// See desktop/library_export.py for the layout.
+const (
+	binMagic     = "PPLB"
+	binVersion   = 2
+	binDtypeF16  = 1
+	binDtypeInt8 = 2
+	// Version 2 appends gain, duration and bpm per track
+	binMetaFields = 3
+)
+
+type binHeader struct {
+	Magic       [4]byte
+	Version     uint16
+	Dtype       uint8
+	Flags       uint8
+	Dim         uint32
+	Count       uint32
+	StringsSize uint32
+	_           [12]byte
+}
+
+func decodeBinaryLibrary(r *bufio.Reader, lib *MusicLibrary) error {
+	var header binHeader
+	if err := binary.Read(r, binary.LittleEndian, &header); err != nil {
+		return err
+	}
+	if string(header.Magic[:]) != binMagic {
+		return fmt.Errorf("not a binary music library")
+	}
+	if header.Version < 1 || header.Version > binVersion {
+		return fmt.Errorf("unsupported binary library version %d", header.Version)
+	}
+
+	strings := make([]byte, header.StringsSize)
+	if _, err := goio.ReadFull(r, strings); err != nil {
+		return err
+	}
+
+	names := make([]string, 0, header.Count+1)
+	for offset := 0; len(names) < int(header.Count)+1; {
+		if offset+2 > len(strings) {
+			return fmt.Errorf("binary library string table is truncated")
+		}
+		length := int(binary.LittleEndian.Uint16(strings[offset:]))
+		offset += 2
+		if offset+length > len(strings) {
+			return fmt.Errorf("binary library string table is truncated")
+		}
+		names = append(names, string(strings[offset:offset+length]))
+		offset += length
+	}
+
+	count, dim := int(header.Count), int(header.Dim)
+	scales := make([]float32, count)
+	var raw []byte
+
+	switch header.Dtype {
+	case binDtypeF16:
+		raw = make([]byte, count*dim*2)
+	case binDtypeInt8:
+		if err := binary.Read(r, binary.LittleEndian, scales); err != nil {
+			return err
+		}
+		raw = make([]byte, count*dim)
+	default:
+		return fmt.Errorf("unsupported binary library dtype %d", header.Dtype)
+	}
+	if _, err := goio.ReadFull(r, raw); err != nil {
+		return err
+	}
+
+	var meta []float32
+	if header.Version >= 2 {
+		meta = make([]float32, count*binMetaFields)
+		if err := binary.Read(r, binary.LittleEndian, meta); err != nil {
+			return err
+		}
+	}
+
+	lib.Dir = names[0]
+	lib.Files = make(map[string][]float32, count)
+	lib.Meta = make(map[string]TrackMeta, len(meta)/binMetaFields)
+	for i, name := range names[1:] {
+		// NaN marks tracks without metadata
+		if meta != nil && !math.IsNaN(float64(meta[i*binMetaFields])) {
+			m := meta[i*binMetaFields:]
+			lib.Meta[name] = TrackMeta{Gain: m[0], Duration: m[1], BPM: m[2]}
+		}
+		vec := make([]float32, dim)
+		for j := range vec {
+			if header.Dtype == binDtypeF16 {
+				vec[j] = float16ToFloat32(binary.LittleEndian.Uint16(raw[(i*dim+j)*2:]))
+			} else {
+				vec[j] = float32(int8(raw[i*dim+j])) * scales[i]
+			}
+		}
+		lib.Files[name] = vec
+	}
+
+	return nil
+}
+
+func float16ToFloat32(h uint16) float32 {
+	sign := uint32(h>>15) << 31
+	exp := uint32(h>>10) & 0x1f
+	frac := uint32(h) & 0x3ff
+
+	switch {
+	case exp == 0 && frac == 0:
+		return math.Float32frombits(sign)
+	case exp == 0:
+		// Subnormal: normalise the fraction
+		for frac&0x400 == 0 {
+			frac <<= 1
+			exp--
+		}
+		exp++
+		frac &= 0x3ff
+	case exp == 0x1f:
+		return math.Float32frombits(sign | 0xff<<23 | frac<<13)
+	}
+
+	return math.Float32frombits(sign | (exp+127-15)<<23 | frac<<13)
+}
@@ -45,7 +45,9 @@ func NewSmartShuffledQueue(library *io.MusicLibrary) SmartShuffledQueue {
 		log.Fatal(err)
 	}
 
-	startEmbedding := make([]float32, 512)
+	// Vectors may be reduced on the desktop, so take the width from the library
+	dim := len(normalizedEmbeddings[files[0]])
+	startEmbedding := make([]float32, dim)
 	limit := 3
 	if len(files) < 3 {
 		limit = len(files)
@@ -53,12 +55,12 @@ func NewSmartShuffledQueue(library *io.MusicLibrary) SmartShuffledQueue {
 
 	for i := 0; i < limit; i++ {
 		vec := normalizedEmbeddings[files[i]]
-		for j := range 512 {
+		for j := range dim {
 			startEmbedding[j] += vec[j]
 		}
 	}
 
-	for i := range 512 {
+	for i := range dim {
 		startEmbedding[i] = (startEmbedding[i] / float32(limit)) + (rand.Float32() - 0.5)
 	}
 	normalize(startEmbedding)